@@ -0,0 +1,59 @@
+"""
+python -m fishtank.benchmarks [--rows 10000 100000] [--benchmarks ...]
+    [--database-url URL] [--output results.json]
+    [--compare baseline.json] [--threshold 0.2]
+
+Exits with a non-zero status when compared against a baseline and any
+benchmark regressed.
+"""
+
+import argparse
+import sys
+
+from fishtank.benchmarks.runner import (
+    BENCHMARKS,
+    DEFAULT_ROWS,
+    DEFAULT_THRESHOLD,
+    POSTGRES_BENCHMARKS,
+    compare_results,
+    format_results,
+    load_results,
+    run_benchmarks,
+    save_results,
+)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m fishtank.benchmarks")
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS)
+    parser.add_argument("--benchmarks", nargs="+", choices=list(BENCHMARKS))
+    parser.add_argument("--database-url")
+    parser.add_argument("--output")
+    parser.add_argument("--compare")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args(argv)
+    if args.database_url is None and POSTGRES_BENCHMARKS & set(args.benchmarks or []):
+        parser.error(f"{' '.join(sorted(POSTGRES_BENCHMARKS))} need --database-url")
+
+    results = run_benchmarks(args.benchmarks, args.rows, args.database_url)
+    print(format_results(results))
+    if args.output:
+        save_results(args.output, results)
+
+    if args.compare:
+        regressions = compare_results(
+            results, load_results(args.compare), args.threshold
+        )
+        for regression in regressions:
+            print(
+                f"{regression['benchmark']} at {regression['num_rows']:,} rows "
+                f"dropped to {regression['rows_per_second']:,.0f} rows/s "
+                f"from {regression['baseline_rows_per_second']:,.0f}"
+            )
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+"""
+Synthetic data shaped like what our loaders see, sized by a row count so
+the same benchmark can run at 10^4 rows or 10^7.
+"""
+
+import numpy as np
+import pandas as pd
+
+# the North Pacific region the Earth Engine loaders fetch
+NORTH_PACIFIC_BBOX = (-179, 34, -120, 79)
+# tag data is recorded every few minutes
+TIME_SERIES_STEP = np.timedelta64(300, "s")
+NUM_PTTS = 100
+
+
+def generate_points(num_rows, bbox=NORTH_PACIFIC_BBOX, seed=0):
+    """
+    Returns a dataframe of uniformly scattered (lat, lon) points with a
+    measure, like a month of Earth Engine pixels
+    """
+    rng = np.random.default_rng(seed)
+    min_lon, min_lat, max_lon, max_lat = bbox
+    return pd.DataFrame(
+        {
+            "lat": rng.uniform(min_lat, max_lat, num_rows),
+            "lon": rng.uniform(min_lon, max_lon, num_rows),
+            "value": rng.normal(10, 5, num_rows),
+        }
+    )
+
+
+def generate_grid(num_cells, bbox=NORTH_PACIFIC_BBOX, seed=0):
+    """
+    Returns (lats, lons, values) of a regular grid over the bbox with about
+    `num_cells` cells and some land (nan) in it, like a bathymetry raster
+    """
+    rng = np.random.default_rng(seed)
+    min_lon, min_lat, max_lon, max_lat = bbox
+    aspect = (max_lon - min_lon) / (max_lat - min_lat)
+    num_lats = max(int(np.sqrt(num_cells / aspect)), 1)
+    num_lons = max(num_cells // num_lats, 1)
+    lats = np.linspace(min_lat, max_lat, num_lats)
+    lons = np.linspace(min_lon, max_lon, num_lons)
+    values = rng.normal(-3000, 1000, (num_lats, num_lons))
+    values[values > -1000] = np.nan
+    return lats, lons, values
+
+
+def generate_time_series(num_rows, num_ptts=NUM_PTTS, seed=0):
+    """
+    Returns a tag time series (ptt, depth, temperature, datetime) with the
+    rows split evenly between the tags
+    """
+    rng = np.random.default_rng(seed)
+    per_ptt = -(-num_rows // num_ptts)
+    starts = np.datetime64("2018-01-01") + rng.integers(0, 365, num_ptts).astype(
+        "timedelta64[D]"
+    )
+    steps = np.arange(per_ptt) * TIME_SERIES_STEP
+    return pd.DataFrame(
+        {
+            "ptt": np.repeat(np.arange(num_ptts).astype(str), per_ptt)[:num_rows],
+            "depth_m": rng.gamma(2, 50, num_rows),
+            "temperature_c": rng.normal(8, 3, num_rows),
+            "datetime": (starts[:, None] + steps[None, :]).ravel()[:num_rows],
+        }
+    )
@@ -0,0 +1,260 @@
+"""
+Times the hot paths of our loaders on synthetic data.
+
+Every benchmark has a setup (generating its data, which isn't timed) and
+a run that returns how many rows it processed. For each benchmark and row
+count we record the wall time, rows per second, the peak memory
+allocated during the run and the totals of every instrumented stage it
+went through (see `fishtank.instrumentation`).
+
+The database bound benchmarks go through `get_engine` like the loaders
+do, by default against a throwaway SQLite file so they can run anywhere.
+Point them at a real postgres with a database url to include the network.
+Fact writes use COPY, so that benchmark only runs against postgres (into
+its own scratch table).
+
+Results can be saved and compared against a baseline, anything whose
+throughput dropped by more than the threshold counts as a regression.
+"""
+
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import sqlalchemy as sa
+
+from fishtank.bulk import write_dataframe
+from fishtank.benchmarks.data import (
+    generate_grid,
+    generate_points,
+    generate_time_series,
+)
+from fishtank.db import dispose_engine, get_engine
+from fishtank.dimensions.dates import add_date_keys_to_facts
+from fishtank.dimensions.keys import disable_key_registry
+from fishtank.instrumentation import disable_instrumentation, enable_instrumentation
+from fishtank.dimensions.spatial import (
+    H3_RESOLUTIONS,
+    H3_TABLE_PREFIX,
+    add_spatial_keys_to_facts,
+    build_spatial_dimension_addition,
+    get_coords,
+    spatial_key_to_index,
+)
+from fishtank.raster import aggregate_block, get_row_blocks, merge_aggregates
+
+DEFAULT_ROWS = [10_000, 100_000]
+DEFAULT_THRESHOLD = 0.2
+BENCHMARK_RESOLUTION = max(H3_RESOLUTIONS)
+GRID_BLOCK_ROWS = 256
+FACT_WRITE_TABLE = "benchmark_tag_data"
+
+
+def use_database(url=None):
+    """
+    Points `get_engine` at the given database, or a new SQLite file, and
+    makes sure the dimension tables the benchmarks read from exist
+    """
+    if url is None:
+        directory = tempfile.mkdtemp(prefix="fishtank-benchmarks-")
+        url = f"sqlite:///{os.path.join(directory, 'benchmarks.db')}"
+    os.environ["FISHTANK_DATABASE_URL"] = url
+    dispose_engine()
+    # every lookup should actually go to the database
+    disable_key_registry()
+    with get_engine().begin() as connection:
+        for resolution in H3_RESOLUTIONS:
+            connection.execute(
+                sa.text(
+                    f"create table if not exists {H3_TABLE_PREFIX}{resolution} "
+                    f"(h3_key_{resolution} bigint, geometry text)"
+                )
+            )
+    return url
+
+
+def setup_spatial_keys(num_rows):
+    return (generate_points(num_rows),)
+
+
+def run_spatial_keys(points):
+    add_spatial_keys_to_facts(points, lon_col="lon", lat_col="lat")
+    return points.shape[0]
+
+
+def setup_coords(num_rows):
+    points = generate_points(num_rows)
+    add_spatial_keys_to_facts(points, lon_col="lon", lat_col="lat")
+    keys = np.unique(points[f"h3_key_{BENCHMARK_RESOLUTION}"])
+    return ([spatial_key_to_index(int(key)) for key in keys],)
+
+
+def run_coords(h3_indexes):
+    for h3_index in h3_indexes:
+        get_coords(h3_index)
+    return len(h3_indexes)
+
+
+def setup_spatial_dimension(num_rows):
+    points = generate_points(num_rows)
+    add_spatial_keys_to_facts(points, lon_col="lon", lat_col="lat")
+    return (points,)
+
+
+def run_spatial_dimension(points):
+    build_spatial_dimension_addition(points, BENCHMARK_RESOLUTION)
+    return points.shape[0]
+
+
+def setup_date_keys(num_rows):
+    return (generate_time_series(num_rows),)
+
+
+def run_date_keys(time_series):
+    add_date_keys_to_facts(time_series, date_col="datetime")
+    return time_series.shape[0]
+
+
+def setup_grid_aggregation(num_rows):
+    return generate_grid(num_rows)
+
+
+def run_grid_aggregation(lats, lons, values):
+    merge_aggregates(
+        aggregate_block(
+            lats[start:stop], lons, values[start:stop], BENCHMARK_RESOLUTION
+        )
+        for start, stop in get_row_blocks(len(lats), GRID_BLOCK_ROWS)
+    )
+    return values.size
+
+
+def setup_fact_writes(num_rows):
+    time_series = generate_time_series(num_rows)
+    add_date_keys_to_facts(time_series, date_col="datetime")
+    # every run writes into an empty table
+    with get_engine().begin() as connection:
+        connection.execute(sa.text(f"drop table if exists {FACT_WRITE_TABLE}"))
+    return (time_series,)
+
+
+def run_fact_writes(time_series):
+    return write_dataframe(time_series, FACT_WRITE_TABLE)
+
+
+# name -> (setup, run, whether it touches the database)
+BENCHMARKS = {
+    "spatial_keys": (setup_spatial_keys, run_spatial_keys, False),
+    "coords": (setup_coords, run_coords, False),
+    "spatial_dimension": (setup_spatial_dimension, run_spatial_dimension, True),
+    "date_keys": (setup_date_keys, run_date_keys, False),
+    "grid_aggregation": (setup_grid_aggregation, run_grid_aggregation, False),
+    "fact_writes": (setup_fact_writes, run_fact_writes, True),
+}
+
+# the benchmarks that need postgres rather than SQLite
+POSTGRES_BENCHMARKS = {"fact_writes"}
+
+
+def run_benchmark(name, num_rows):
+    """
+    Runs a benchmark once and returns its result
+    """
+    setup, run, _ = BENCHMARKS[name]
+    args = setup(num_rows)
+
+    recorder = enable_instrumentation()
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        rows = run(*args)
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        disable_instrumentation()
+
+    return {
+        "benchmark": name,
+        "num_rows": num_rows,
+        "rows": rows,
+        "seconds": seconds,
+        "rows_per_second": rows / seconds if seconds > 0 else float("inf"),
+        "peak_memory_mb": peak / 1024**2,
+        "stages": recorder.get_totals(),
+    }
+
+
+def run_benchmarks(names=None, row_counts=None, database_url=None):
+    """
+    Runs every benchmark (or the named ones) at every row count
+    """
+    if names is None:
+        names = [
+            name
+            for name in BENCHMARKS
+            if database_url is not None or name not in POSTGRES_BENCHMARKS
+        ]
+    elif database_url is None and POSTGRES_BENCHMARKS & set(names):
+        raise ValueError(
+            f"{', '.join(sorted(POSTGRES_BENCHMARKS & set(names)))} "
+            f"need a postgres database url"
+        )
+    row_counts = DEFAULT_ROWS if row_counts is None else row_counts
+    if any(BENCHMARKS[name][2] for name in names):
+        use_database(database_url)
+    return [run_benchmark(name, num_rows) for name in names for num_rows in row_counts]
+
+
+def compare_results(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Returns the results whose throughput is more than `threshold` (a
+    fraction) below the baseline, each with the baseline's throughput
+    """
+    baseline = {
+        (result["benchmark"], result["num_rows"]): result["rows_per_second"]
+        for result in baseline
+    }
+    regressions = []
+    for result in results:
+        expected = baseline.get((result["benchmark"], result["num_rows"]))
+        if expected is not None and result["rows_per_second"] < expected * (
+            1 - threshold
+        ):
+            regressions.append(dict(result, baseline_rows_per_second=expected))
+    return regressions
+
+
+def format_results(results):
+    lines = [
+        f"{'benchmark':<20}{'rows':>12}{'seconds':>10}{'rows/s':>14}{'peak MB':>10}"
+    ]
+    for result in results:
+        lines.append(
+            f"{result['benchmark']:<20}{result['num_rows']:>12,}"
+            f"{result['seconds']:>10.3f}{result['rows_per_second']:>14,.0f}"
+            f"{result['peak_memory_mb']:>10.1f}"
+        )
+        # slowest stage first
+        stages = sorted(
+            result.get("stages", {}).items(), key=lambda item: -item[1]["seconds"]
+        )
+        for name, totals in stages:
+            lines.append(
+                f"  {name:<34}{totals['seconds']:>10.3f}"
+                f"  {totals['calls']:,} calls, {totals['round_trips']:,} round trips"
+            )
+    return "\n".join(lines)
+
+
+def save_results(path, results):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
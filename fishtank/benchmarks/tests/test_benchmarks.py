@@ -0,0 +1,93 @@
+import unittest
+import unittest.mock as mock
+import numpy as np
+
+
+from fishtank.benchmarks.data import (
+    NORTH_PACIFIC_BBOX,
+    generate_points,
+    generate_grid,
+    generate_time_series,
+)
+from fishtank.benchmarks.runner import (
+    FACT_WRITE_TABLE,
+    run_benchmark,
+    run_benchmarks,
+    compare_results,
+    format_results,
+)
+from fishtank.instrumentation import get_recorder
+
+
+class TestGenerators(unittest.TestCase):
+    def test_points(self):
+        points = generate_points(1000)
+        min_lon, min_lat, max_lon, max_lat = NORTH_PACIFIC_BBOX
+        assert points.shape[0] == 1000
+        assert points["lat"].between(min_lat, max_lat).all()
+        assert points["lon"].between(min_lon, max_lon).all()
+
+    def test_grid(self):
+        lats, lons, values = generate_grid(10_000)
+        assert values.shape == (len(lats), len(lons))
+        assert 0.9 * 10_000 <= values.size <= 10_000
+        assert np.isnan(values).any()
+
+    def test_time_series(self):
+        time_series = generate_time_series(1001, num_ptts=10)
+        assert time_series.shape[0] == 1001
+        assert time_series["ptt"].nunique() == 10
+        assert time_series["datetime"].dtype == "datetime64[s]"
+
+
+class TestRunBenchmark(unittest.TestCase):
+    def test_base_case(self):
+        result = run_benchmark("date_keys", 1000)
+        assert result["rows"] == 1000
+        assert result["rows_per_second"] > 0
+        assert result["peak_memory_mb"] > 0
+        # the time in each instrumented stage, and nothing recorded after
+        assert result["stages"]["add_date_keys_to_facts"]["calls"] == 1
+        assert get_recorder() is None
+        assert "  add_date_keys_to_facts" in format_results([result])
+
+    def test_fact_writes(self):
+        with mock.patch("fishtank.benchmarks.runner.get_engine"), mock.patch(
+            "fishtank.benchmarks.runner.write_dataframe", return_value=1000
+        ) as write_dataframe:
+            result = run_benchmark("fact_writes", 1000)
+        assert result["rows"] == 1000
+        dataframe, table = write_dataframe.call_args[0]
+        assert table == FACT_WRITE_TABLE
+        assert "date_key" in dataframe.columns
+
+
+class TestRunBenchmarks(unittest.TestCase):
+    def test_postgres_only(self):
+        with mock.patch("fishtank.benchmarks.runner.use_database"), mock.patch(
+            "fishtank.benchmarks.runner.run_benchmark"
+        ) as run_benchmark:
+            run_benchmarks(row_counts=[10])
+            with self.assertRaises(ValueError):
+                run_benchmarks(["fact_writes"], [10])
+        names = [call[0][0] for call in run_benchmark.call_args_list]
+        assert "fact_writes" not in names
+        assert "date_keys" in names
+
+
+class TestCompareResults(unittest.TestCase):
+    def setUp(self):
+        self.baseline = [
+            {"benchmark": "a", "num_rows": 10, "rows_per_second": 100.0},
+            {"benchmark": "b", "num_rows": 10, "rows_per_second": 100.0},
+        ]
+
+    def test_regression(self):
+        results = [
+            {"benchmark": "a", "num_rows": 10, "rows_per_second": 70.0},
+            {"benchmark": "b", "num_rows": 10, "rows_per_second": 90.0},
+            {"benchmark": "c", "num_rows": 10, "rows_per_second": 1.0},
+        ]
+        (regression,) = compare_results(results, self.baseline, 0.2)
+        assert regression["benchmark"] == "a"
+        assert regression["baseline_rows_per_second"] == 100.0
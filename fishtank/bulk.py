@@ -0,0 +1,166 @@
+"""
+Bulk writes for our fact and dimension tables. Rather than going through
+`DataFrame.to_sql`, which issues batches of inserts, we stream each
+dataframe into postgres with `COPY ... FROM STDIN`.
+
+Tables are still created the way pandas would have created them, so
+switching a loader over to `write_dataframe` doesn't change its schema.
+Geometries are sent as hex EWKB, which PostGIS geometry columns take
+without having to parse text. shapely is only imported by whoever made
+the geometries, never here.
+"""
+
+import io
+import sys
+
+import numpy as np
+import pandas as pd
+
+from fishtank.db import get_engine
+from fishtank.instrumentation import instrument, record_io
+
+DEFAULT_CHUNKSIZE = 100_000
+NULL = "\\N"
+DEFAULT_SRID = 4326
+
+
+def quote_identifier(identifier):
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def prepare_dataframe(dataframe, srid=DEFAULT_SRID):
+    """
+    Returns a copy of the dataframe with geometries as hex EWKB
+    """
+    dataframe = pd.DataFrame(dataframe)
+    # nothing can be a geometry if shapely was never imported, and date or
+    # fact only loads shouldn't have to pay for importing it
+    shapely = sys.modules.get("shapely")
+    if shapely is None:
+        return dataframe
+    for column in dataframe.columns:
+        series = dataframe[column]
+        sample = series.dropna().head(1)
+        if series.dtype.name == "geometry" or (
+            len(sample) > 0 and isinstance(sample.iloc[0], shapely.Geometry)
+        ):
+            geometries = np.array(
+                [
+                    geometry if isinstance(geometry, shapely.Geometry) else None
+                    for geometry in series
+                ],
+                dtype=object,
+            )
+            dataframe[column] = shapely.to_wkb(
+                shapely.set_srid(geometries, srid), hex=True, include_srid=True
+            )
+    return dataframe
+
+
+def to_copy_buffer(dataframe):
+    """
+    Serializes a dataframe as the CSV flavour `COPY` reads
+    """
+    dataframe = dataframe.copy()
+    for column in dataframe.columns:
+        series = dataframe[column]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            if series.dt.tz is None:
+                dataframe[column] = series.dt.strftime("%Y-%m-%d %H:%M:%S.%f")
+            else:
+                dataframe[column] = series.dt.strftime("%Y-%m-%d %H:%M:%S.%f%z")
+    buffer = io.StringIO()
+    dataframe.to_csv(buffer, header=False, index=False, na_rep=NULL)
+    buffer.seek(0)
+    return buffer
+
+
+def copy_dataframe(connection, dataframe, table, chunksize, upsert_keys=None):
+    """
+    Copies the (prepared) dataframe into `table` on a connection, leaving
+    the transaction to whoever opened it. Returns the number of rows.
+    """
+    # let pandas create the table just like to_sql would
+    dataframe.head(0).to_sql(table, connection, if_exists="append", index=False)
+    if dataframe.shape[0] == 0:
+        return 0
+
+    columns = ",".join(quote_identifier(column) for column in dataframe.columns)
+    target = quote_identifier(table)
+    cursor = connection.connection.cursor()
+    if upsert_keys is not None:
+        staging = quote_identifier(f"{table}_staging")
+        cursor.execute(f"create temporary table {staging} (like {target})")
+        copy_target = staging
+    else:
+        copy_target = target
+
+    for start in range(0, dataframe.shape[0], chunksize):
+        buffer = to_copy_buffer(dataframe.iloc[start : start + chunksize])
+        cursor.copy_expert(
+            f"copy {copy_target} ({columns}) from stdin "
+            f"with (format csv, null '{NULL}')",
+            buffer,
+        )
+        # copy reads the whole buffer so its position is its size
+        record_io(round_trips=1, bytes_written=buffer.tell())
+
+    if upsert_keys is not None:
+        matches = " and ".join(
+            f"t.{quote_identifier(key)} = s.{quote_identifier(key)}"
+            for key in upsert_keys
+        )
+        distinct_keys = ",".join(quote_identifier(key) for key in upsert_keys)
+        # rows another transaction inserts after our check are skipped by
+        # the table's unique constraint. Inserting in key order means two
+        # writers lock shared keys in the same order so they can't deadlock,
+        # though one still waits for the other to commit the keys they share
+        cursor.execute(f"""
+            insert into {target} ({columns})
+            select distinct on ({distinct_keys}) {columns}
+            from {staging} s
+            where not exists (
+                select 1 from {target} t where {matches}
+            )
+            order by {distinct_keys}
+            on conflict do nothing
+            """)
+        # dropped now rather than on commit, the transaction may write more
+        cursor.execute(f"drop table {staging}")
+        # creating, inserting from and dropping the staging table
+        record_io(round_trips=3)
+    cursor.close()
+    return dataframe.shape[0]
+
+
+@instrument()
+def write_dataframe(
+    dataframe,
+    table,
+    chunksize=DEFAULT_CHUNKSIZE,
+    upsert_keys=None,
+    engine=None,
+    connection=None,
+):
+    """
+    Writes the dataframe to `table` with `COPY`, `chunksize` rows at a time
+    and all in one transaction, creating the table in it if need be. With a
+    `connection` the write is part of that connection's transaction and
+    commits with it.
+
+    If `upsert_keys` is given the rows are copied into a staging table first
+    and only the rows whose keys aren't in `table` yet are inserted, so the
+    same dataframe can be appended any number of times. With a unique
+    constraint on the keys this is also safe to run from several processes
+    at once.
+    """
+    dataframe = prepare_dataframe(dataframe)
+    if connection is not None:
+        return copy_dataframe(connection, dataframe, table, chunksize, upsert_keys)
+
+    engine = get_engine() if engine is None else engine
+    with engine.begin() as connection:
+        rows = copy_dataframe(connection, dataframe, table, chunksize, upsert_keys)
+    # the commit
+    record_io(round_trips=1)
+    return rows
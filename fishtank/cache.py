@@ -0,0 +1,132 @@
+"""
+An on-disk cache of the pixel tables we fetch from remote services, so
+rerunning a loader after changing its transform logic (or without a
+network) doesn't download the same windows again.
+
+Entries are keyed by a hash of everything that determines the response
+(collection, bands, date window, region, scale). Each entry is a directory
+holding one `.npy` file per column. Numeric columns are memory mapped when
+read back and the dataframe is built on the maps without copying them, so
+a hit only reads the pages that are used. The maps are copy on write,
+changing the dataframe never changes the cache. When the cache grows past
+its size limit the least recently used entries are evicted.
+
+Entries aren't Parquet (even though the exports need pyarrow) because a
+Parquet file has to be decoded in full on every hit, an `.npy` file can
+just be mapped.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "fishtank")
+DEFAULT_CACHE_BYTES = 10 * 1024**3
+META_FILE = "meta.json"
+
+
+def get_cache_key(params):
+    """
+    Returns a stable hash of the parameters of a fetch
+    """
+    encoded = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def get_entry_size(path):
+    return sum(entry.stat().st_size for entry in os.scandir(path))
+
+
+class FetchCache:
+    def __init__(self, directory=None, max_bytes=None):
+        if directory is None:
+            directory = os.environ.get("FISHTANK_CACHE_DIR", DEFAULT_CACHE_DIR)
+        if max_bytes is None:
+            max_bytes = int(os.environ.get("FISHTANK_CACHE_BYTES", DEFAULT_CACHE_BYTES))
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, params):
+        """
+        Returns the cached dataframe for the parameters, or None
+        """
+        path = os.path.join(self.directory, get_cache_key(params))
+        try:
+            with open(os.path.join(path, META_FILE)) as f:
+                meta = json.load(f)
+            columns = {
+                name: np.load(os.path.join(path, f"{i}.npy"), mmap_mode="c")
+                for i, name in enumerate(meta["columns"])
+            }
+            # mark it as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        # each column is its own block, so pandas keeps the maps as they are
+        return pd.DataFrame(columns, copy=False)
+
+    def put(self, params, dataframe):
+        """
+        Stores a dataframe for the parameters and evicts old entries if the
+        cache has grown too big
+        """
+        path = os.path.join(self.directory, get_cache_key(params))
+        staging = tempfile.mkdtemp(dir=self.directory, prefix=".staging-")
+        try:
+            for i, name in enumerate(dataframe.columns):
+                values = dataframe[name].to_numpy()
+                if values.dtype == object:
+                    # fixed width strings keep the file free of pickles
+                    values = values.astype(str)
+                np.save(os.path.join(staging, f"{i}.npy"), values)
+            with open(os.path.join(staging, META_FILE), "w") as f:
+                json.dump(
+                    {"columns": list(dataframe.columns), "params": params},
+                    f,
+                    default=str,
+                )
+            with self.lock:
+                if os.path.exists(path):
+                    shutil.rmtree(path)
+                os.rename(staging, path)
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits
+        """
+        with self.lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.is_dir() and not entry.name.startswith("."):
+                    entries.append(
+                        (entry.stat().st_mtime, get_entry_size(entry.path), entry.path)
+                    )
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+
+    def fetch(self, params, fetch):
+        """
+        Returns the cached dataframe for the parameters, calling `fetch()`
+        and caching what it returns on a miss
+        """
+        dataframe = self.get(params)
+        if dataframe is None:
+            dataframe = fetch()
+            self.put(params, dataframe)
+        return dataframe
@@ -0,0 +1,203 @@
+"""
+fishtank <command> [options], see `fishtank --help`.
+
+One entry point for our loaders and dimension builders. Every command
+imports what it needs when it runs, so `fishtank --help` (or a command
+that only touches dates) never waits on geopandas, Earth Engine and the
+rest.
+
+Loads are instrumented like everything else, set FISHTANK_METRICS_PATH to
+get their stage totals.
+"""
+
+import argparse
+import importlib
+import os
+import sys
+from datetime import datetime
+
+# (min_lon, min_lat, max_lon, max_lat) of the North Pacific we load, the
+# same as the Earth Engine loaders' region
+DEFAULT_BBOX = (-179, 34, -120, 79)
+EARTH_ENGINE_LOADERS = {
+    "temperature": "fishtank.loaders.temperature",
+    "primary-productivity": "fishtank.loaders.primary_productivity",
+}
+
+
+def parse_date(value):
+    return datetime.fromisoformat(value)
+
+
+def get_kwargs(args, names):
+    """
+    Returns the arguments that were given, so the loaders' own defaults
+    apply to the rest
+    """
+    return {
+        name: getattr(args, name)
+        for name in names
+        if getattr(args, name, None) is not None
+    }
+
+
+def authenticate_earth_engine():
+    import ee
+
+    ee.Authenticate()
+
+
+def run_earth_engine_loader(args):
+    loader = importlib.import_module(args.loader)
+    authenticate_earth_engine()
+    rows = loader.load_months(
+        **get_kwargs(args, ["start", "end", "scale", "num_fetch_workers"])
+    )
+    print(f"loaded {rows:,} rows")
+
+
+def run_tagging(args):
+    from fishtank.loaders.tagging import load_tagging
+
+    rows = load_tagging(
+        **get_kwargs(args, ["tracks_path", "inventory_path", "time_series_path"])
+    )
+    print(f"loaded {rows:,} rows")
+
+
+def run_bathymetry(args):
+    from fishtank.loaders.bathymetry import load_bathymetry
+
+    cells = load_bathymetry(**get_kwargs(args, ["prefix", "num_processes"]))
+    print(f"wrote {cells:,} cells")
+
+
+def run_load_all(args):
+    from fishtank.enrichment import load_enriched_tracks, read_tracks
+    from fishtank.parallel import format_report, run_jobs, split_months
+
+    authenticate_earth_engine()
+    workers = os.cpu_count() if args.workers is None else args.workers
+
+    # the tracks are enriched once the environment is loaded, not alongside
+    jobs = [("fishtank.loaders.tagging:load_tagging", {"enrich": False})]
+    for name in EARTH_ENGINE_LOADERS.values():
+        loader = importlib.import_module(name)
+        start = loader.START if args.start is None else args.start
+        end = loader.END if args.end is None else args.end
+        num_ranges = max(1, workers // len(EARTH_ENGINE_LOADERS))
+        for range_start, range_end in split_months(start, end, num_ranges):
+            kwargs = get_kwargs(args, ["scale", "num_fetch_workers"])
+            kwargs.update(start=range_start, end=range_end)
+            jobs.append((f"{name}:load_months", kwargs))
+
+    results, seconds = run_jobs(jobs, workers)
+    print(format_report(results, seconds))
+    rows = load_enriched_tracks(read_tracks())
+    print(f"enriched {rows:,} tracks")
+
+
+def run_dates(args):
+    from fishtank.dimensions.dates import ensure_date_table, load_date_dimension
+
+    ensure_date_table()
+    rows = load_date_dimension(args.start, args.end)
+    print(f"added {rows:,} dates")
+
+
+def run_spatial(args):
+    from fishtank.dimensions.keys import enable_key_registry
+    from fishtank.dimensions.spatial import load_spatial_dimension
+    from fishtank.schema import ensure_schema
+
+    ensure_schema()
+    enable_key_registry()
+    added = load_spatial_dimension(tuple(args.bbox), args.resolutions)
+    for resolution, rows in added.items():
+        print(f"added {rows:,} cells at resolution {resolution}")
+
+
+def add_date_range_arguments(parser, required=False):
+    parser.add_argument("--start", type=parse_date, required=required)
+    parser.add_argument("--end", type=parse_date, required=required)
+
+
+def add_earth_engine_arguments(parser):
+    add_date_range_arguments(parser)
+    parser.add_argument("--scale", type=int, help="meters between fetched pixels")
+    parser.add_argument(
+        "--fetch-workers", type=int, dest="num_fetch_workers", metavar="WORKERS"
+    )
+
+
+def get_parser():
+    # defaults that aren't given here are the loaders' own
+    parser = argparse.ArgumentParser(prog="fishtank")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    for command, description in [
+        ("temperature", "load sea surface temperature from Earth Engine"),
+        ("primary-productivity", "load chlorophyll from Earth Engine"),
+    ]:
+        subparser = commands.add_parser(command, help=description)
+        add_earth_engine_arguments(subparser)
+        subparser.set_defaults(
+            handler=run_earth_engine_loader, loader=EARTH_ENGINE_LOADERS[command]
+        )
+
+    subparser = commands.add_parser(
+        "tagging", help="load the tag tracks, context and time series"
+    )
+    subparser.add_argument("--tracks", dest="tracks_path")
+    subparser.add_argument("--inventory", dest="inventory_path")
+    subparser.add_argument("--time-series", dest="time_series_path")
+    subparser.set_defaults(handler=run_tagging)
+
+    subparser = commands.add_parser(
+        "bathymetry", help="average the GEBCO grid onto h3 cells"
+    )
+    subparser.add_argument("--prefix")
+    subparser.add_argument(
+        "--processes", type=int, dest="num_processes", metavar="PROCESSES"
+    )
+    subparser.set_defaults(handler=run_bathymetry)
+
+    subparser = commands.add_parser(
+        "load-all", help="run every loader at once across a pool of processes"
+    )
+    add_earth_engine_arguments(subparser)
+    subparser.add_argument(
+        "--workers", type=int, help="processes to run (default one per core)"
+    )
+    subparser.set_defaults(handler=run_load_all)
+
+    subparser = commands.add_parser("dates", help="build the date dimension")
+    add_date_range_arguments(subparser, required=True)
+    subparser.set_defaults(handler=run_dates)
+
+    subparser = commands.add_parser("spatial", help="build the h3 dimensions")
+    subparser.add_argument(
+        "--bbox",
+        type=float,
+        nargs=4,
+        default=DEFAULT_BBOX,
+        metavar=("MIN_LON", "MIN_LAT", "MAX_LON", "MAX_LAT"),
+    )
+    subparser.add_argument("--resolutions", type=int, nargs="+")
+    subparser.set_defaults(handler=run_spatial)
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+
+    from fishtank.instrumentation import configure_instrumentation, export_metrics
+
+    configure_instrumentation()
+    args.handler(args)
+    export_metrics()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,58 +1,168 @@
 """
 For dates we're going to have pregenerated keys. Specifically,
 we'll just use the epoch of 12:00:00 AM on that day as the key.
+
+Like the spatial dimension the full set of dates is known up front so
+a whole span can be loaded at once with `load_date_dimension`.
 """
 
+import numpy as np
 import pandas as pd
 import sqlalchemy as sa
-from psycopg2 import errors, errorcodes
+from fishtank.bulk import write_dataframe
 from fishtank.db import get_engine
+from fishtank.instrumentation import instrument
+from fishtank.dimensions.keys import get_key_registry, read_missing_keys
 
 DATE_TABLE = "dates"
+SECONDS_PER_DAY = 86400
+
+# declared here rather than in fishtank.schema (which adds it to its
+# metadata) so commands that only touch dates don't import the spatial
+# stack to create it
+date_table = sa.Table(
+    DATE_TABLE,
+    sa.MetaData(),
+    sa.Column("date_key", sa.BigInteger, primary_key=True),
+    sa.Column("date", sa.DateTime),
+    sa.Column("year", sa.Integer),
+    sa.Column("month", sa.Integer),
+    sa.Column("day", sa.Integer),
+    sa.Column("day_of_year", sa.Integer),
+    sa.Column("iso_week", sa.Integer),
+    sa.Column("season", sa.Text),
+    sa.Column("month_key", sa.BigInteger),
+)
 
+# meteorological (northern hemisphere) seasons by month
+SEASONS = np.array(
+    [
+        "winter",
+        "winter",
+        "spring",
+        "spring",
+        "spring",
+        "summer",
+        "summer",
+        "summer",
+        "autumn",
+        "autumn",
+        "autumn",
+        "winter",
+    ]
+)
 
+
+@instrument()
 def add_date_keys_to_facts(dataframe, date_col="date"):
     dataframe["date_key"] = dataframe[date_col].astype("datetime64[s]").astype(int)
     dataframe["date_key"] = dataframe["date_key"] - dataframe["date_key"] % 86400
 
 
-def build_date_dimension_addition(dataframe):
-    keys = set(dataframe[f"date_key"])
-    keys_filter = ",".join([str(key) for key in keys])
-
-    sql = f"""
-    select distinct 
-        date_key
-    from 
-        {DATE_TABLE}
-    where
-        date_key in ({keys_filter})
-    """
-    try:
-        existing_keys = set(pd.read_sql(sql, get_engine())[f"date_key"])
-    except sa.exc.ProgrammingError as e:
-        try:
-            raise e.orig
-        except errors.lookup(errorcodes.UNDEFINED_TABLE):
-            existing_keys = set()
-
-    new_keys = keys - existing_keys
-
-    dataframe = pd.DataFrame(new_keys, columns=["date_key"])
-    dataframe["date"] = pd.to_datetime(dataframe["date_key"], unit="s")
-    dataframe["year"] = dataframe["date"].dt.year
-    dataframe["month"] = dataframe["date"].dt.month
-    dataframe["day"] = dataframe["date"].dt.day
+def build_date_dimension(keys):
+    """
+    Returns the dimension rows for an array of date keys
+    """
+    keys = np.asarray(keys, dtype=np.int64)
+    dates = keys.astype("datetime64[s]")
+    months = dates.astype("datetime64[M]")
+    month_of_year = months.astype(np.int64) % 12
 
+    dataframe = pd.DataFrame({"date_key": keys, "date": pd.to_datetime(dates)})
+    dataframe["year"] = dates.astype("datetime64[Y]").astype(np.int64) + 1970
+    dataframe["month"] = month_of_year + 1
+    dataframe["day"] = (dates.astype("datetime64[D]") - months).astype(np.int64) + 1
+    dataframe["day_of_year"] = dataframe["date"].dt.dayofyear
+    dataframe["iso_week"] = dataframe["date"].dt.isocalendar().week.astype(np.int64)
+    dataframe["season"] = SEASONS[month_of_year]
+    dataframe["month_key"] = months.astype("datetime64[s]").astype(np.int64)
     return dataframe
 
 
+@instrument()
+def build_date_dimension_addition(dataframe):
+    keys = np.unique(dataframe["date_key"].to_numpy())
+    registry = get_key_registry()
+    if registry is not None:
+        new_keys = registry.new_keys(DATE_TABLE, "date_key", keys)
+    else:
+        new_keys = read_missing_keys(DATE_TABLE, "date_key", keys)
+
+    return build_date_dimension(sorted(new_keys))
+
+
+def ensure_date_table(engine=None):
+    """
+    Creates the dates table if it doesn't exist. One created by an earlier
+    version (missing columns or its key) goes through the full
+    `ensure_schema` instead.
+    """
+    engine = get_engine() if engine is None else engine
+    with engine.begin() as connection:
+        inspector = sa.inspect(connection)
+        if not inspector.has_table(DATE_TABLE):
+            date_table.create(connection)
+            return
+        columns = set(column["name"] for column in inspector.get_columns(DATE_TABLE))
+        primary_key = inspector.get_pk_constraint(DATE_TABLE)["constrained_columns"]
+    if set(date_table.columns.keys()) - columns or not primary_key:
+        from fishtank.schema import ensure_schema
+
+        ensure_schema(engine)
+
+
+_has_date_attributes = False
+
+
+def backfill_date_attributes():
+    """
+    Fills in the attributes of dates written by an earlier version, which
+    `ensure_schema` added the columns for
+    """
+    global _has_date_attributes
+    if _has_date_attributes:
+        return
+    with get_engine().begin() as connection:
+        if sa.inspect(connection).has_table(DATE_TABLE):
+            connection.exec_driver_sql(f"""
+                update {DATE_TABLE} set
+                    day_of_year = extract(doy from "date"),
+                    iso_week = extract(week from "date"),
+                    season = case
+                        when extract(month from "date") in (12, 1, 2) then 'winter'
+                        when extract(month from "date") in (3, 4, 5) then 'spring'
+                        when extract(month from "date") in (6, 7, 8) then 'summer'
+                        else 'autumn'
+                    end,
+                    month_key = extract(epoch from date_trunc('month', "date"))
+                where
+                    season is null
+                """)
+    _has_date_attributes = True
+
+
+@instrument()
 def append_date_dimension_addition(dataframe):
     assert dataframe.shape[0] > 0
 
-    dataframe.to_sql(
-        f"{DATE_TABLE}",
-        get_engine(),
-        if_exists="append",
-        index=False,
-    )
+    backfill_date_attributes()
+    write_dataframe(dataframe, DATE_TABLE, upsert_keys=["date_key"])
+
+    registry = get_key_registry()
+    if registry is not None:
+        registry.add_keys(DATE_TABLE, dataframe["date_key"])
+
+
+@instrument()
+def load_date_dimension(start, end):
+    """
+    Precomputes the date dimension for every day from start to end
+    (inclusive). Returns the number of rows added.
+    """
+    start_key = pd.Timestamp(start).floor("D").value // 10**9
+    end_key = pd.Timestamp(end).floor("D").value // 10**9
+    keys = np.arange(start_key, end_key + 1, SECONDS_PER_DAY)
+    dimension = build_date_dimension_addition(pd.DataFrame({"date_key": keys}))
+    if dimension.shape[0] > 0:
+        append_date_dimension_addition(dimension)
+    return dimension.shape[0]
@@ -0,0 +1,165 @@
+"""
+Our dimension tables only ever grow, so rather than asking the database
+which keys already exist for every batch of facts we can load them once
+and keep track of what we append from then on.
+
+By default the registry holds every key of a table in memory. For very
+large dimensions it can instead be bounded, in which case it behaves like
+an LRU cache in front of the database and only the keys it hasn't seen
+recently are looked up.
+"""
+
+import io
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+from psycopg2 import errors, errorcodes
+
+from fishtank.db import get_engine
+from fishtank.instrumentation import instrument, record_io
+
+
+@instrument()
+def read_existing_keys(table, key_col, keys=None):
+    """
+    Returns the set of keys in `table`, restricted to `keys` if given
+    """
+    sql = f"""
+    select distinct
+        {key_col}
+    from
+        {table}
+    """
+    if keys is not None:
+        if len(keys) == 0:
+            return set()
+        keys_filter = ",".join([str(key) for key in keys])
+        sql += f"""
+    where
+        {key_col} in ({keys_filter})
+    """
+    try:
+        return set(pd.read_sql(sql, get_engine())[key_col])
+    except sa.exc.ProgrammingError as e:
+        try:
+            raise e.orig
+        except errors.lookup(errorcodes.UNDEFINED_TABLE):
+            return set()
+
+
+@instrument()
+def read_missing_keys(table, key_col, keys):
+    """
+    Returns the subset of `keys` that isn't in `table`. Rather than sending
+    the keys as a literal list they're copied into a temporary table and
+    anti-joined against `table`.
+    """
+    keys = np.unique(np.asarray(list(keys), dtype=np.int64))
+    if len(keys) == 0:
+        return set()
+
+    connection = get_engine().raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(
+            f"create temporary table missing_keys ({key_col} bigint) on commit drop"
+        )
+        cursor.copy_expert(
+            f"copy missing_keys ({key_col}) from stdin",
+            io.StringIO("\n".join(str(key) for key in keys)),
+        )
+        try:
+            cursor.execute(f"""
+                select
+                    k.{key_col}
+                from
+                    missing_keys k
+                where
+                    not exists (
+                        select 1 from {table} t where t.{key_col} = k.{key_col}
+                    )
+                """)
+        except errors.lookup(errorcodes.UNDEFINED_TABLE):
+            connection.rollback()
+            return set(keys.tolist())
+        missing_keys = set(row[0] for row in cursor.fetchall())
+        connection.commit()
+        record_io(round_trips=4)
+        return missing_keys
+    finally:
+        connection.close()
+
+
+class DimensionKeyRegistry:
+    def __init__(self, max_keys=None):
+        self.max_keys = max_keys
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def _load(self, table, key_col):
+        if table not in self._keys:
+            if self.max_keys is None:
+                self._keys[table] = read_existing_keys(table, key_col)
+            else:
+                self._keys[table] = OrderedDict()
+        return self._keys[table]
+
+    def _remember(self, known, keys):
+        if self.max_keys is None:
+            known.update(keys)
+            return
+        for key in keys:
+            known[key] = None
+            known.move_to_end(key)
+        while len(known) > self.max_keys:
+            known.popitem(last=False)
+
+    def new_keys(self, table, key_col, keys):
+        """
+        Returns the subset of `keys` that isn't in `table` yet
+        """
+        keys = set(keys)
+        with self._lock:
+            known = self._load(table, key_col)
+            if self.max_keys is None:
+                return keys - known
+            hits = set(key for key in keys if key in known)
+            existing = read_existing_keys(table, key_col, keys - hits)
+            self._remember(known, hits | existing)
+            return keys - hits - existing
+
+    def add_keys(self, table, keys):
+        """
+        Records keys that have just been written to `table`
+        """
+        with self._lock:
+            if table in self._keys:
+                self._remember(self._keys[table], keys)
+            elif self.max_keys is not None:
+                self._keys[table] = OrderedDict()
+                self._remember(self._keys[table], keys)
+
+    def clear(self):
+        with self._lock:
+            self._keys = {}
+
+
+_registry = None
+
+
+def enable_key_registry(max_keys=None):
+    global _registry
+    _registry = DimensionKeyRegistry(max_keys)
+    return _registry
+
+
+def disable_key_registry():
+    global _registry
+    _registry = None
+
+
+def get_key_registry():
+    return _registry
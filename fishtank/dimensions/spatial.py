@@ -3,24 +3,41 @@ For our spatial data we're going to take a slightly different tack
 than we do for some of the other dimensions. Because we know the
 complete set of possible values for this dimension, we're going to
 precompute the set of possible values and store them in the database
-in advance. 
+in advance.
 
 Also we're going to take advantage of uber h3 library so we can generate
 all our keys without ever having to reference the database. In the following
 if we say "h3_index" that's a string and if we say "h3_key" that's an integer.
 """
 
+import warnings
 import h3
+import numpy as np
 import pandas as pd
-import geopandas as gpd
-from shapely.geometry import Polygon
-import sqlalchemy as sa
-from psycopg2 import errors, errorcodes
+import shapely
+from shapely.affinity import translate
+from shapely.geometry import Polygon, MultiPolygon, box, mapping
 
-from fishtank.db import get_engine
+from fishtank.bulk import write_dataframe
+from fishtank.dimensions.keys import get_key_registry, read_existing_keys
+from fishtank.instrumentation import instrument
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore")
+    from h3.unstable import vect as h3_vect
 
 H3_RESOLUTIONS = [2, 4]
 H3_TABLE_PREFIX = "h3_resolution_"
+SPATIAL_DIMENSION_BATCH_SIZE = 50_000
+
+# bit layout of an h3 index, see https://h3geo.org/docs/core-library/h3Indexing
+H3_MAX_RESOLUTION = 15
+H3_RESOLUTION_OFFSET = 52
+H3_RESOLUTION_MASK = 0xF << H3_RESOLUTION_OFFSET
+H3_DIGIT_BITS = 3
+
+EARTH_RADIUS_KM = 6371.0
+RADIUS_REGION_POINTS = 64
 
 
 def spatial_index_to_key(spatial_index):
@@ -42,62 +59,394 @@ def get_coords(h3_index):
     return coords
 
 
-def add_spatial_keys_to_facts(dataframe, lon_col="lon", lat_col="lat"):
+def spatial_keys_to_parents(spatial_keys, resolution):
+    """
+    Returns the parent keys at the given (coarser) resolution for an
+    array of h3 keys. This is pure bit twiddling so it never has to
+    go back to the coordinates.
+    """
+    spatial_keys = np.asarray(spatial_keys, dtype=np.int64)
+    unused_digits = (1 << (H3_DIGIT_BITS * (H3_MAX_RESOLUTION - resolution))) - 1
+    parents = (
+        (spatial_keys & ~H3_RESOLUTION_MASK)
+        | (resolution << H3_RESOLUTION_OFFSET)
+        | unused_digits
+    )
+    # h3 hands back a key of 0 for invalid coordinates, keep it that way
+    return np.where(spatial_keys == 0, 0, parents)
+
+
+def get_parent_key_sql(key_col, resolution):
+    """
+    Returns the SQL expression for `spatial_keys_to_parents` of a column
+    """
+    unused_digits = (1 << (H3_DIGIT_BITS * (H3_MAX_RESOLUTION - resolution))) - 1
+    return (
+        f"case when {key_col} = 0 then 0 else "
+        f"({key_col} & {~H3_RESOLUTION_MASK}) "
+        f"| {resolution << H3_RESOLUTION_OFFSET} | {unused_digits} end"
+    )
+
+
+def get_spatial_keys(lats, lons, resolutions=None, nested=False):
     """
-    Returns a dataframe with the h3 keys for the given resolutions
+    Returns a dict of resolution -> array of h3 keys for the given
+    arrays of coordinates.
+
+    h3 cells don't nest perfectly so the parent of a point's fine cell
+    isn't always the coarse cell the point falls in. By default every
+    resolution is hashed from the coordinates (matching `h3.geo_to_h3`),
+    with `nested=True` only the finest resolution is hashed and the
+    coarser keys are its parents.
+    """
+    resolutions = H3_RESOLUTIONS if resolutions is None else resolutions
+    finest = max(resolutions)
+    finest_keys = h3_vect.geo_to_h3(lats, lons, finest).astype(np.int64)
+    spatial_keys = {}
+    for resolution in resolutions:
+        if resolution == finest:
+            spatial_keys[resolution] = finest_keys
+        elif nested:
+            spatial_keys[resolution] = spatial_keys_to_parents(finest_keys, resolution)
+        else:
+            spatial_keys[resolution] = h3_vect.geo_to_h3(lats, lons, resolution).astype(
+                np.int64
+            )
+    return spatial_keys
+
+
+@instrument()
+def add_spatial_keys_to_facts(dataframe, lon_col="lon", lat_col="lat", nested=False):
     """
+    Returns a dataframe with the h3 keys for the given resolutions (see
+    `get_spatial_keys` for `nested`)
+    """
+    spatial_keys = get_spatial_keys(
+        dataframe[lat_col].to_numpy(), dataframe[lon_col].to_numpy(), nested=nested
+    )
     for resolution in H3_RESOLUTIONS:
-        dataframe[f"h3_key_{resolution}"] = dataframe.apply(
-            lambda row: spatial_index_to_key(
-                h3.geo_to_h3(row[lat_col], row[lon_col], resolution)
-            ),
-            axis=1,
-        )
+        dataframe[f"h3_key_{resolution}"] = spatial_keys[resolution]
+
+
+# reducers for aggregate_points_to_h3, each takes the values sorted by
+# group, the start of every group and the group sizes
+POINT_REDUCERS = {
+    "sum": lambda values, starts, counts: np.add.reduceat(values, starts),
+    "mean": lambda values, starts, counts: np.add.reduceat(values, starts) / counts,
+    "min": lambda values, starts, counts: np.minimum.reduceat(values, starts),
+    "max": lambda values, starts, counts: np.maximum.reduceat(values, starts),
+    "count": lambda values, starts, counts: counts,
+}
+
+
+def get_location_codes(lats, lons):
+    """
+    Returns a code per point that's shared by the points at the same
+    location, along with the latitude and longitude of each code
+    """
+    lat_codes, unique_lats = pd.factorize(lats)
+    lon_codes, unique_lons = pd.factorize(lons)
+    codes, locations = pd.factorize(
+        lat_codes.astype(np.int64) * len(unique_lons) + lon_codes
+    )
+    return (
+        codes,
+        unique_lats[locations // len(unique_lons)],
+        unique_lons[locations % len(unique_lons)],
+    )
+
+
+@instrument()
+def aggregate_points_to_h3(
+    lats, lons, values, reducers, resolutions=None, by_location=True
+):
+    """
+    Aggregates point values onto h3 cells and returns a row per cell at the
+    finest resolution with its keys at every resolution, the mean latitude
+    and longitude of its points and a column per reducer.
+
+    `values` is a dict of name -> array and `reducers` is a dict of output
+    column -> (name, reducer) where the reducer is one of POINT_REDUCERS.
+
+    With `by_location` the points that share a location (e.g. one pixel at
+    several times) are averaged first, so every location counts once in
+    its cell. Either way each location is only hashed once, at the finest
+    resolution, the coarser keys are its cell's parents.
+    """
+    resolutions = H3_RESOLUTIONS if resolutions is None else resolutions
+    finest = max(resolutions)
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    values = {
+        name: np.asarray(column, dtype=np.float64) for name, column in values.items()
+    }
+
+    if by_location:
+        codes, lats, lons = get_location_codes(lats, lons)
+        counts = np.bincount(codes, minlength=len(lats))
+        values = {
+            name: np.bincount(codes, weights=column, minlength=len(lats)) / counts
+            for name, column in values.items()
+        }
+
+    keys = get_spatial_keys(lats, lons, [finest])[finest]
+    codes, cells = pd.factorize(keys)
+    order = np.argsort(codes, kind="stable")
+    counts = np.bincount(codes, minlength=len(cells))
+    starts = np.cumsum(counts) - counts
+
+    def reduce(column, reducer):
+        if len(cells) == 0:
+            return np.empty(0)
+        return POINT_REDUCERS[reducer](column[order], starts, counts)
+
+    dataframe = pd.DataFrame({f"h3_key_{finest}": cells})
+    for resolution in resolutions:
+        if resolution != finest:
+            dataframe[f"h3_key_{resolution}"] = spatial_keys_to_parents(
+                cells, resolution
+            )
+    dataframe["latitude"] = reduce(lats, "mean")
+    dataframe["longitude"] = reduce(lons, "mean")
+    for column, (name, reducer) in reducers.items():
+        dataframe[column] = reduce(values[name], reducer)
+    return dataframe
 
 
+@instrument()
 def build_spatial_dimension_addition(dataframe, resolution):
     assert resolution in H3_RESOLUTIONS
 
     keys = set(dataframe[f"h3_key_{resolution}"])
-    keys_filter = ",".join([str(key) for key in keys])
-
-    sql = f"""
-    select distinct 
-        h3_key_{resolution} 
-    from 
-        {H3_TABLE_PREFIX}{resolution}
-    where
-        h3_key_{resolution} in ({keys_filter})
-    """
-    try:
-        existing_keys = set(pd.read_sql(sql, get_engine())[f"h3_key_{resolution}"])
-    except sa.exc.ProgrammingError as e:
-        try:
-            raise e.orig
-        except errors.lookup(errorcodes.UNDEFINED_TABLE):
-            existing_keys = set()
-
-    new_keys = keys - existing_keys
+    table = f"{H3_TABLE_PREFIX}{resolution}"
+    key_col = f"h3_key_{resolution}"
+    registry = get_key_registry()
+    if registry is not None:
+        new_keys = registry.new_keys(table, key_col, keys)
+    else:
+        new_keys = keys - read_existing_keys(table, key_col, keys)
+
+    return build_spatial_dimension(new_keys, resolution)
 
+
+def build_spatial_dimension(keys, resolution):
+    """
+    Returns the dimension rows (key and boundary) for the given keys
+    """
+    # only needed here and slow to import
+    import geopandas as gpd
+
+    keys = list(keys)
     dataframe = gpd.GeoDataFrame(
-        [
-            {
-                f"h3_key_{resolution}": key,
-                "geometry": Polygon(get_coords(spatial_key_to_index(key))),
-            }
-            for key in new_keys
-        ]
-    ).to_wkt()
+        {
+            f"h3_key_{resolution}": np.array(keys, dtype=np.int64),
+            "geometry": gpd.GeoSeries(
+                [Polygon(get_coords(spatial_key_to_index(key))) for key in keys],
+                crs="EPSG:4326",
+            ),
+        }
+    )
     return dataframe
 
 
+@instrument()
 def append_spatial_dimension_addition(dataframe, resolution):
     assert resolution in H3_RESOLUTIONS
     assert dataframe.shape[0] > 0
 
-    dataframe.to_sql(
+    write_dataframe(
+        dataframe,
         f"{H3_TABLE_PREFIX}{resolution}",
-        get_engine(),
-        if_exists="append",
-        index=False,
+        upsert_keys=[f"h3_key_{resolution}"],
     )
+
+    registry = get_key_registry()
+    if registry is not None:
+        registry.add_keys(
+            f"{H3_TABLE_PREFIX}{resolution}", dataframe[f"h3_key_{resolution}"]
+        )
+
+
+def to_region(region):
+    """
+    Turns a (min_lon, min_lat, max_lon, max_lat) bounding box into a polygon,
+    splitting it in two if it crosses the antimeridian
+    """
+    if isinstance(region, (Polygon, MultiPolygon)):
+        return region
+    min_lon, min_lat, max_lon, max_lat = region
+    if min_lon > max_lon:
+        return MultiPolygon(
+            [box(min_lon, min_lat, 180, max_lat), box(-180, min_lat, max_lon, max_lat)]
+        )
+    return box(min_lon, min_lat, max_lon, max_lat)
+
+
+def get_region_spatial_keys(region, resolution):
+    """
+    Returns every h3 key at the given resolution whose cell overlaps the
+    region (a bounding box or shapely polygon).
+
+    h3's polyfill only gives us the cells whose centers are inside the region
+    so we also take the cells along the boundary, and their neighbors, to be
+    sure every point in the region lands on one of the keys.
+    """
+    region = to_region(region)
+    polygons = region.geoms if isinstance(region, MultiPolygon) else [region]
+
+    keys = set()
+    for polygon in polygons:
+        keys.update(
+            spatial_index_to_key(h3_index)
+            for h3_index in h3.polyfill(
+                mapping(polygon), resolution, geo_json_conformant=True
+            )
+        )
+
+    # sample the boundary at less than an edge length apart
+    spacing = h3.edge_length(resolution, "km") / 111.0 / 2
+    boundary = np.concatenate(
+        [
+            shapely.get_coordinates(shapely.segmentize(polygon.boundary, spacing))
+            for polygon in polygons
+        ]
+    )
+    boundary_keys = get_spatial_keys(boundary[:, 1], boundary[:, 0], [resolution])
+    for key in set(boundary_keys[resolution]):
+        keys.update(
+            spatial_index_to_key(h3_index)
+            for h3_index in h3.k_ring(spatial_key_to_index(key), 1)
+        )
+    return np.array(sorted(keys), dtype=np.int64)
+
+
+def wrap_region(region):
+    """
+    Splits a polygon that runs past the antimeridian (longitudes beyond
+    +-180) into the parts on either side of it
+    """
+    world = box(-180, -90, 180, 90)
+    parts = [
+        translate(region.intersection(translate(world, xoff=offset)), xoff=-offset)
+        for offset in [-360, 0, 360]
+    ]
+    parts = [part for part in parts if not part.is_empty]
+    if len(parts) == 1:
+        return parts[0]
+    return MultiPolygon(
+        [
+            polygon
+            for part in parts
+            for polygon in (part.geoms if hasattr(part, "geoms") else [part])
+        ]
+    )
+
+
+def get_radius_region(lon, lat, radius_km, num_points=RADIUS_REGION_POINTS):
+    """
+    Returns a polygon approximating the circle of `radius_km` around a point
+    """
+    lon, lat = np.radians(lon), np.radians(lat)
+    distance = radius_km / EARTH_RADIUS_KM
+    bearings = np.linspace(0, 2 * np.pi, num_points, endpoint=False)
+    lats = np.arcsin(
+        np.sin(lat) * np.cos(distance)
+        + np.cos(lat) * np.sin(distance) * np.cos(bearings)
+    )
+    lons = lon + np.arctan2(
+        np.sin(bearings) * np.sin(distance) * np.cos(lat),
+        np.cos(distance) - np.sin(lat) * np.sin(lats),
+    )
+    return wrap_region(Polygon(zip(np.degrees(lons), np.degrees(lats))))
+
+
+def compact_spatial_keys(spatial_keys, resolution, resolutions=None):
+    """
+    Replaces every complete set of children in an array of h3 keys with
+    their parent, for each coarser entry of `resolutions`. Returns a dict of
+    resolution -> array of keys that together cover the same cells.
+    """
+    resolutions = H3_RESOLUTIONS if resolutions is None else resolutions
+    spatial_keys = np.unique(np.asarray(spatial_keys, dtype=np.int64))
+    compacted = {}
+    for coarser in sorted((r for r in resolutions if r < resolution), reverse=True):
+        parents, counts = np.unique(
+            spatial_keys_to_parents(spatial_keys, coarser), return_counts=True
+        )
+        children = 7 ** (resolution - coarser)
+        # pentagons have 5 hexagon children and a pentagon
+        pentagon_children = 1 + 5 * (children - 1) // 6
+        complete = counts == children
+        for i in np.flatnonzero(counts == pentagon_children):
+            complete[i] = h3.h3_is_pentagon(spatial_key_to_index(int(parents[i])))
+
+        partial = ~np.isin(
+            spatial_keys_to_parents(spatial_keys, coarser), parents[complete]
+        )
+        compacted[resolution] = spatial_keys[partial]
+        spatial_keys, resolution = parents[complete], coarser
+    compacted[resolution] = spatial_keys
+    return compacted
+
+
+def spatial_keys_to_child_ranges(spatial_keys, resolution):
+    """
+    Returns the (lowest, highest) keys of the children at the given (finer)
+    resolution of an array of h3 keys. The children of a cell only differ
+    in the digits below it so they're the only valid keys in that range.
+    """
+    spatial_keys = np.asarray(spatial_keys, dtype=np.int64)
+    parent_resolutions = (spatial_keys & H3_RESOLUTION_MASK) >> H3_RESOLUTION_OFFSET
+    unused_digits = (1 << (H3_DIGIT_BITS * (H3_MAX_RESOLUTION - resolution))) - 1
+    child_digits = (
+        (1 << (H3_DIGIT_BITS * (H3_MAX_RESOLUTION - parent_resolutions))) - 1
+    ) & ~unused_digits
+    lows = (
+        (spatial_keys & ~H3_RESOLUTION_MASK) | (resolution << H3_RESOLUTION_OFFSET)
+    ) & ~child_digits
+    return lows, lows | child_digits
+
+
+def get_region_coverage(region, resolution=None):
+    """
+    Returns a dict of resolution -> array of h3 keys covering the region
+    (a bounding box or shapely polygon), with the cells at `resolution` (by
+    default the finest we have) compacted to coarser parents wherever all
+    of a parent's children are needed
+    """
+    resolution = max(H3_RESOLUTIONS) if resolution is None else resolution
+    assert resolution in H3_RESOLUTIONS
+    return compact_spatial_keys(get_region_spatial_keys(region, resolution), resolution)
+
+
+@instrument()
+def load_spatial_dimension(
+    region, resolutions=None, batch_size=SPATIAL_DIMENSION_BATCH_SIZE
+):
+    """
+    Precomputes the spatial dimension for a region, writing every missing
+    cell at each resolution to its table in batches. Returns a dict of
+    resolution -> number of rows added.
+    """
+    resolutions = H3_RESOLUTIONS if resolutions is None else resolutions
+    added = {}
+    for resolution in resolutions:
+        assert resolution in H3_RESOLUTIONS
+
+        table = f"{H3_TABLE_PREFIX}{resolution}"
+        key_col = f"h3_key_{resolution}"
+        keys = set(get_region_spatial_keys(region, resolution))
+        registry = get_key_registry()
+        if registry is not None:
+            new_keys = registry.new_keys(table, key_col, keys)
+        else:
+            new_keys = keys - read_existing_keys(table, key_col)
+        new_keys = sorted(new_keys)
+
+        for start in range(0, len(new_keys), batch_size):
+            dimension = build_spatial_dimension(
+                new_keys[start : start + batch_size], resolution
+            )
+            append_spatial_dimension_addition(dimension, resolution)
+        added[resolution] = len(new_keys)
+    return added
@@ -7,7 +7,25 @@ from psycopg2.errors import UndefinedTable
 
 from fishtank.dimensions.dates import (
     add_date_keys_to_facts,
+    build_date_dimension,
     build_date_dimension_addition,
+    date_table,
+    ensure_date_table,
+    load_date_dimension,
+)
+
+DATE_COLUMNS = set(
+    [
+        "date_key",
+        "date",
+        "year",
+        "month",
+        "day",
+        "day_of_year",
+        "iso_week",
+        "season",
+        "month_key",
+    ]
 )
 
 
@@ -47,37 +65,97 @@ class TestBuildDateDimensionAddition(unittest.TestCase):
         )
 
     def test_all_new_keys(self):
-        with mock.patch("pandas.read_sql") as read_sql:
-            read_sql.return_value = pd.DataFrame(
-                [
-                    {"date_key": 2 * 24 * 3600},
-                ]
-            )
+        with mock.patch(
+            "fishtank.dimensions.dates.read_missing_keys"
+        ) as read_missing_keys:
+            read_missing_keys.return_value = set([0, 24 * 3600])
             results = build_date_dimension_addition(self.dataframe)
         assert results.shape[0] == 2
         assert set(results["year"]) == set([1970])
         assert set(results["month"]) == set([1])
         assert set(results["day"]) == set([1, 2])
-        assert set(results.columns) == set(["date_key", "date", "year", "month", "day"])
+        assert set(results.columns) == DATE_COLUMNS
+        assert set(read_missing_keys.call_args[0][2]) == set([0, 24 * 3600])
 
     def test_some_new_keys(self):
-        with mock.patch("pandas.read_sql") as read_sql:
-            read_sql.return_value = pd.DataFrame(
-                [
-                    {"date_key": 1 * 24 * 3600},
-                ]
-            )
+        with mock.patch(
+            "fishtank.dimensions.dates.read_missing_keys"
+        ) as read_missing_keys:
+            read_missing_keys.return_value = set([0])
             results = build_date_dimension_addition(self.dataframe)
         assert results.shape[0] == 1
-        assert set(results.columns) == set(["date_key", "date", "year", "month", "day"])
+        assert set(results.columns) == DATE_COLUMNS
 
     def test_no_new_keys(self):
-        with mock.patch("pandas.read_sql") as read_sql:
-            read_sql.return_value = pd.DataFrame(
-                [
-                    {"date_key": 1 * 24 * 3600},
-                    {"date_key": 0 * 24 * 3600},
-                ]
-            )
+        with mock.patch(
+            "fishtank.dimensions.dates.read_missing_keys"
+        ) as read_missing_keys:
+            read_missing_keys.return_value = set()
             results = build_date_dimension_addition(self.dataframe)
         assert results.shape[0] == 0
+
+
+class TestBuildDateDimension(unittest.TestCase):
+    def test_attributes(self):
+        dates = pd.date_range("1999-12-25", "2001-01-10", freq="D")
+        keys = dates.values.astype("datetime64[s]").astype(int)
+        results = build_date_dimension(keys)
+        assert (results["year"] == dates.year).all()
+        assert (results["month"] == dates.month).all()
+        assert (results["day"] == dates.day).all()
+        assert (results["day_of_year"] == dates.dayofyear).all()
+        assert (results["iso_week"] == dates.isocalendar().week.values).all()
+        row = results[results["date"] == datetime(2000, 7, 4)].iloc[0]
+        assert row["season"] == "summer"
+        assert row["month_key"] == datetime(2000, 7, 1).timestamp() - (
+            datetime(1970, 1, 1).timestamp()
+        )
+
+    def test_empty(self):
+        assert set(build_date_dimension([]).columns) == DATE_COLUMNS
+
+
+class TestLoadDateDimension(unittest.TestCase):
+    def test_span(self):
+        with mock.patch(
+            "fishtank.dimensions.dates.read_missing_keys"
+        ) as read_missing_keys, mock.patch(
+            "fishtank.dimensions.dates.append_date_dimension_addition"
+        ) as append:
+            read_missing_keys.side_effect = lambda table, col, keys: set(keys[1:])
+            added = load_date_dimension(datetime(1970, 1, 1, 12), datetime(1970, 1, 10))
+        keys = read_missing_keys.call_args[0][2]
+        assert list(keys) == [day * 24 * 3600 for day in range(10)]
+        assert added == 9
+        assert append.call_args[0][0].shape[0] == 9
+
+
+class TestEnsureDateTable(unittest.TestCase):
+    def ensure(self, has_table, columns=DATE_COLUMNS, primary_key=["date_key"]):
+        engine = mock.MagicMock()
+        inspector = mock.MagicMock()
+        inspector.has_table.return_value = has_table
+        inspector.get_columns.return_value = [{"name": column} for column in columns]
+        inspector.get_pk_constraint.return_value = {"constrained_columns": primary_key}
+        with mock.patch("sqlalchemy.inspect", return_value=inspector), mock.patch(
+            "fishtank.schema.ensure_schema"
+        ) as ensure_schema, mock.patch.object(date_table, "create") as create:
+            ensure_date_table(engine)
+        return create, ensure_schema
+
+    def test_missing(self):
+        create, ensure_schema = self.ensure(False)
+        create.assert_called_once()
+        ensure_schema.assert_not_called()
+
+    def test_current(self):
+        create, ensure_schema = self.ensure(True)
+        create.assert_not_called()
+        ensure_schema.assert_not_called()
+
+    def test_earlier_version(self):
+        # made by to_sql, without the attributes or a key
+        _, ensure_schema = self.ensure(
+            True, ["date_key", "date", "year", "month", "day"], []
+        )
+        ensure_schema.assert_called_once()
@@ -0,0 +1,92 @@
+import unittest
+import unittest.mock as mock
+import pandas as pd
+
+
+from fishtank.dimensions.keys import (
+    DimensionKeyRegistry,
+    read_existing_keys,
+    read_missing_keys,
+    enable_key_registry,
+    disable_key_registry,
+)
+from fishtank.dimensions.dates import (
+    build_date_dimension_addition,
+    append_date_dimension_addition,
+)
+
+
+class TestReadExistingKeys(unittest.TestCase):
+    def test_no_keys(self):
+        with mock.patch("pandas.read_sql") as read_sql:
+            assert read_existing_keys("dates", "date_key", set()) == set()
+        read_sql.assert_not_called()
+
+    def test_filter(self):
+        with mock.patch("pandas.read_sql") as read_sql:
+            read_sql.return_value = pd.DataFrame([{"date_key": 0}])
+            assert read_existing_keys("dates", "date_key", [0, 86400]) == set([0])
+        assert "in (0,86400)" in read_sql.call_args[0][0]
+
+
+class TestReadMissingKeys(unittest.TestCase):
+    def test_anti_join(self):
+        with mock.patch("fishtank.dimensions.keys.get_engine") as get_engine:
+            connection = get_engine.return_value.raw_connection.return_value
+            cursor = connection.cursor.return_value
+            cursor.fetchall.return_value = [(86400,)]
+            assert read_missing_keys("dates", "date_key", [86400, 0, 0]) == set([86400])
+        buffer = cursor.copy_expert.call_args[0][1]
+        assert buffer.read() == "0\n86400"
+        assert "not exists" in cursor.execute.call_args[0][0]
+        connection.commit.assert_called_once()
+
+    def test_no_keys(self):
+        with mock.patch("fishtank.dimensions.keys.get_engine") as get_engine:
+            assert read_missing_keys("dates", "date_key", []) == set()
+        get_engine.assert_not_called()
+
+
+class TestDimensionKeyRegistry(unittest.TestCase):
+    def test_unbounded(self):
+        registry = DimensionKeyRegistry()
+        with mock.patch("pandas.read_sql") as read_sql:
+            read_sql.return_value = pd.DataFrame([{"date_key": 0}])
+            assert registry.new_keys("dates", "date_key", [0, 1]) == set([1])
+            registry.add_keys("dates", [1])
+            assert registry.new_keys("dates", "date_key", [0, 1, 2]) == set([2])
+        assert read_sql.call_count == 1
+        assert "where" not in read_sql.call_args[0][0]
+
+    def test_bounded(self):
+        registry = DimensionKeyRegistry(max_keys=2)
+        with mock.patch("pandas.read_sql") as read_sql:
+            read_sql.return_value = pd.DataFrame([{"date_key": 0}, {"date_key": 1}])
+            assert registry.new_keys("dates", "date_key", [0, 1, 2]) == set([2])
+            registry.add_keys("dates", [2])
+            # 0 has been evicted so only it is looked up
+            read_sql.return_value = pd.DataFrame([{"date_key": 0}])
+            assert registry.new_keys("dates", "date_key", [0, 1, 2]) == set()
+        assert read_sql.call_count == 2
+        assert "in (0)" in read_sql.call_args[0][0]
+
+
+class TestRegistryIntegration(unittest.TestCase):
+    def setUp(self):
+        enable_key_registry()
+
+    def tearDown(self):
+        disable_key_registry()
+
+    def test_dates(self):
+        dataframe = pd.DataFrame([{"date_key": 0}, {"date_key": 86400}])
+        with mock.patch("pandas.read_sql") as read_sql:
+            read_sql.return_value = pd.DataFrame([{"date_key": 0}])
+            dimension = build_date_dimension_addition(dataframe)
+            assert set(dimension["date_key"]) == set([86400])
+            with mock.patch("fishtank.dimensions.dates.write_dataframe"), mock.patch(
+                "fishtank.dimensions.dates.backfill_date_attributes"
+            ):
+                append_date_dimension_addition(dimension)
+            assert build_date_dimension_addition(dataframe).shape[0] == 0
+        assert read_sql.call_count == 1
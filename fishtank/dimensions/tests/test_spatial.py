@@ -1,5 +1,6 @@
 import unittest
 import h3
+import numpy as np
 import unittest.mock as mock
 import pandas as pd
 from psycopg2.errors import UndefinedTable
@@ -9,8 +10,18 @@ from fishtank.dimensions.spatial import (
     get_coords,
     spatial_index_to_key,
     spatial_key_to_index,
+    spatial_keys_to_parents,
+    get_spatial_keys,
     add_spatial_keys_to_facts,
+    aggregate_points_to_h3,
     build_spatial_dimension_addition,
+    to_region,
+    get_region_spatial_keys,
+    load_spatial_dimension,
+    get_radius_region,
+    compact_spatial_keys,
+    spatial_keys_to_child_ranges,
+    get_region_coverage,
     H3_RESOLUTIONS,
 )
 
@@ -42,6 +53,117 @@ class TestSpatialKeyToIndex(unittest.TestCase):
         assert spatial_key_to_index(spatial_key) == h3_index
 
 
+class TestSpatialKeysToParents(unittest.TestCase):
+    def test_matches_h3(self):
+        h3_index = h3.geo_to_h3(57.1, -152.4, 6)
+        for resolution in range(0, 7):
+            parents = spatial_keys_to_parents(
+                np.array([spatial_index_to_key(h3_index)]), resolution
+            )
+            assert parents[0] == spatial_index_to_key(
+                h3.h3_to_parent(h3_index, resolution)
+            )
+
+    def test_invalid_key(self):
+        assert (spatial_keys_to_parents(np.array([0]), 2) == [0]).all()
+
+
+class TestGetSpatialKeys(unittest.TestCase):
+    def test_matches_h3(self):
+        rng = np.random.default_rng(0)
+        lats = rng.uniform(34, 79, 1000)
+        lons = rng.uniform(-180, 180, 1000)
+        spatial_keys = get_spatial_keys(lats, lons, [1, 2, 4])
+        assert set(spatial_keys) == set([1, 2, 4])
+        for resolution, keys in spatial_keys.items():
+            assert keys.dtype == np.int64
+            expected = [
+                spatial_index_to_key(h3.geo_to_h3(lat, lon, resolution))
+                for lat, lon in zip(lats, lons)
+            ]
+            assert (keys == expected).all()
+
+    def test_nested(self):
+        rng = np.random.default_rng(0)
+        lats = rng.uniform(34, 79, 1000)
+        lons = rng.uniform(-180, 180, 1000)
+        spatial_keys = get_spatial_keys(lats, lons, [2, 4], nested=True)
+        assert (
+            spatial_keys[4]
+            == [
+                spatial_index_to_key(h3.geo_to_h3(lat, lon, 4))
+                for lat, lon in zip(lats, lons)
+            ]
+        ).all()
+        assert (
+            spatial_keys[2]
+            == [
+                spatial_index_to_key(h3.h3_to_parent(spatial_key_to_index(key), 2))
+                for key in spatial_keys[4]
+            ]
+        ).all()
+
+
+class TestAggregatePointsToH3(unittest.TestCase):
+    def setUp(self):
+        # two readings of one pixel and one of another in the same hex, and
+        # a pixel far away
+        self.lats = [50.0, 50.0, 50.01, 10.0]
+        self.lons = [-150.0, -150.0, -150.01, 10.0]
+        self.values = {"value": [1.0, 3.0, 5.0, 7.0]}
+
+    def test_by_location(self):
+        results = aggregate_points_to_h3(
+            self.lats,
+            self.lons,
+            self.values,
+            {"mean": ("value", "mean"), "count": ("value", "count")},
+        ).sort_values("latitude", ascending=False)
+        assert list(results["mean"]) == [3.5, 7.0]
+        assert list(results["count"]) == [2, 1]
+        assert np.isclose(results["latitude"].iloc[0], 50.005)
+
+    def test_by_point(self):
+        results = aggregate_points_to_h3(
+            self.lats,
+            self.lons,
+            self.values,
+            {
+                "total": ("value", "sum"),
+                "low": ("value", "min"),
+                "high": ("value", "max"),
+            },
+            by_location=False,
+        ).sort_values("latitude", ascending=False)
+        assert list(results["total"]) == [9.0, 7.0]
+        assert list(results["low"]) == [1.0, 7.0]
+        assert list(results["high"]) == [5.0, 7.0]
+
+    def test_keys(self):
+        results = aggregate_points_to_h3(
+            self.lats, self.lons, self.values, {}
+        ).sort_values("latitude", ascending=False)
+        finest = max(H3_RESOLUTIONS)
+        assert list(results.columns) == [
+            f"h3_key_{resolution}"
+            for resolution in sorted(H3_RESOLUTIONS, reverse=True)
+        ] + ["latitude", "longitude"]
+        for resolution in H3_RESOLUTIONS:
+            assert list(results[f"h3_key_{resolution}"]) == [
+                spatial_index_to_key(
+                    h3.h3_to_parent(h3.geo_to_h3(lat, lon, finest), resolution)
+                )
+                for lat, lon in [(50.0, -150.0), (10.0, 10.0)]
+            ]
+
+    def test_empty(self):
+        results = aggregate_points_to_h3(
+            [], [], {"value": []}, {"mean": ("value", "mean")}
+        )
+        assert results.shape[0] == 0
+        assert "mean" in results.columns
+
+
 class TestAddSpatialKeysToFacts(unittest.TestCase):
     def test_base_case(self):
         dataframe = pd.DataFrame(
@@ -57,6 +179,11 @@ class TestAddSpatialKeysToFacts(unittest.TestCase):
             + [f"h3_key_{resolution}" for resolution in H3_RESOLUTIONS]
         )
         assert dataframe.shape[0] == 3
+        for resolution in H3_RESOLUTIONS:
+            assert list(dataframe[f"h3_key_{resolution}"]) == [
+                spatial_index_to_key(h3.geo_to_h3(lat, lon, resolution))
+                for lat, lon in zip(dataframe["lat"], dataframe["lon"])
+            ]
 
 
 class TestBuildSpatialDimensionAddition(unittest.TestCase):
@@ -135,3 +262,112 @@ class TestBuildSpatialDimensionAddition(unittest.TestCase):
             results = build_spatial_dimension_addition(self.dataframe, 4)
         assert results.shape[0] == 1
         assert set(results.columns) == set(["h3_key_4", "geometry"])
+
+
+class TestToRegion(unittest.TestCase):
+    def test_bbox(self):
+        region = to_region((-179, 34, -120, 79))
+        assert region.bounds == (-179, 34, -120, 79)
+
+    def test_antimeridian(self):
+        region = to_region((170, 50, -170, 60))
+        assert len(region.geoms) == 2
+        assert region.area == 20 * 10
+
+
+class TestGetRegionSpatialKeys(unittest.TestCase):
+    def test_covers_region(self):
+        rng = np.random.default_rng(0)
+        lats = rng.uniform(34, 79, 10000)
+        lons = rng.uniform(-179, -120, 10000)
+        for resolution in H3_RESOLUTIONS:
+            keys = get_region_spatial_keys((-179, 34, -120, 79), resolution)
+            point_keys = get_spatial_keys(lats, lons, [resolution])[resolution]
+            assert set(point_keys) <= set(keys)
+
+    def test_small_region(self):
+        # much smaller than a single cell
+        keys = get_region_spatial_keys((0, 0, 0.01, 0.01), 2)
+        assert spatial_index_to_key(h3.geo_to_h3(0, 0, 2)) in keys
+
+
+class TestGetRadiusRegion(unittest.TestCase):
+    def test_base_case(self):
+        region = get_radius_region(-150, 50, 111.2)
+        min_lon, min_lat, max_lon, max_lat = region.bounds
+        assert np.isclose(min_lat, 49, atol=0.01)
+        assert np.isclose(max_lat, 51, atol=0.01)
+
+    def test_antimeridian(self):
+        region = get_radius_region(179.5, 50, 200)
+        assert len(region.geoms) == 2
+        assert region.bounds[0] == -180 and region.bounds[2] == 180
+
+
+def get_children(spatial_key, resolution):
+    return [
+        spatial_index_to_key(h3_index)
+        for h3_index in h3.h3_to_children(spatial_key_to_index(spatial_key), resolution)
+    ]
+
+
+class TestCompactSpatialKeys(unittest.TestCase):
+    def test_base_case(self):
+        parent = spatial_index_to_key(h3.geo_to_h3(50, -150, 2))
+        children = get_children(parent, 4)
+        stray = spatial_index_to_key(h3.geo_to_h3(0, 0, 4))
+        compacted = compact_spatial_keys(children + [stray], 4)
+        assert compacted[2].tolist() == [parent]
+        assert compacted[4].tolist() == [stray]
+
+        compacted = compact_spatial_keys(children[1:], 4)
+        assert len(compacted[2]) == 0
+        assert len(compacted[4]) == len(children) - 1
+
+    def test_pentagon(self):
+        parent = spatial_index_to_key(sorted(h3.get_pentagon_indexes(2))[0])
+        compacted = compact_spatial_keys(get_children(parent, 4), 4)
+        assert compacted[2].tolist() == [parent]
+
+
+class TestSpatialKeysToChildRanges(unittest.TestCase):
+    def test_base_case(self):
+        parent = spatial_index_to_key(h3.geo_to_h3(50, -150, 2))
+        (low,), (high,) = spatial_keys_to_child_ranges([parent], 4)
+        children = get_children(parent, 4)
+        assert low == min(children)
+        assert all(low <= child <= high for child in children)
+        for neighbour in h3.k_ring(spatial_key_to_index(parent), 1):
+            if spatial_index_to_key(neighbour) != parent:
+                for child in get_children(spatial_index_to_key(neighbour), 4):
+                    assert not low <= child <= high
+
+    def test_same_resolution(self):
+        key = spatial_index_to_key(h3.geo_to_h3(50, -150, 4))
+        lows, highs = spatial_keys_to_child_ranges([key], 4)
+        assert lows.tolist() == highs.tolist() == [key]
+
+
+class TestGetRegionCoverage(unittest.TestCase):
+    def test_covers_region(self):
+        region = (-179, 34, -120, 79)
+        coverage = get_region_coverage(region)
+        assert len(coverage[2]) > 0
+        covered = set(coverage[4])
+        for key in coverage[2]:
+            covered.update(get_children(key, 4))
+        assert covered == set(get_region_spatial_keys(region, 4))
+
+
+class TestLoadSpatialDimension(unittest.TestCase):
+    def test_only_new_keys(self):
+        keys = get_region_spatial_keys((0, 0, 1, 1), 2)
+        with mock.patch("pandas.read_sql") as read_sql, mock.patch(
+            "fishtank.dimensions.spatial.write_dataframe"
+        ) as write_dataframe:
+            read_sql.return_value = pd.DataFrame([{"h3_key_2": keys[0]}])
+            added = load_spatial_dimension((0, 0, 1, 1), [2], batch_size=2)
+        assert added == {2: len(keys) - 1}
+        written = pd.concat([call[0][0] for call in write_dataframe.call_args_list])
+        assert set(written["h3_key_2"]) == set(keys[1:])
+        assert set(written.columns) == set(["h3_key_2", "geometry"])
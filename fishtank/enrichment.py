@@ -0,0 +1,288 @@
+"""
+Pairs every tag track position with the environment around it, the sea
+surface temperature and primary productivity of the hex the fish was in at
+the nearest monthly date.
+
+Doing this in SQL means a big range join per fact, so instead we pull the
+rollups (one value per hex and date) into memory once and index them.
+Hex keys are looked up through a hash index and the nearest date within a
+hex by binary search, which handles a season of tracks in seconds.
+
+The environment datasets have holes (cloud cover, coastlines) so when a
+hex has nothing we fall back to the mean of its neighbours at the same
+resolution and then to its parent hex. Which of these supplied each value
+is kept in a `{measure}_match` column.
+"""
+
+import h3
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+from psycopg2 import errors, errorcodes
+
+from fishtank.bulk import write_dataframe
+from fishtank.db import get_engine
+from fishtank.instrumentation import instrument
+from fishtank.dimensions.spatial import (
+    H3_RESOLUTIONS,
+    get_spatial_keys,
+    spatial_index_to_key,
+    spatial_key_to_index,
+)
+from fishtank.rollups import get_rollup_table
+from fishtank.schema import recreate_table, tag_tracks_enriched
+
+ENRICHED_TRACKS_TABLE = "tag_tracks_enriched"
+ENRICHMENT_BATCH_SIZE = 100_000
+# the environment facts are monthly composites
+ENRICHMENT_MAX_DAYS = 31
+
+# the measure each fact contributes to the enriched tracks
+ENRICHMENT_MEASURES = {
+    "sea_surface_temperature": "temperature_c",
+    "primary_productivity": "log_chla_ave",
+}
+
+MATCH_CELL = "cell"
+MATCH_NEIGHBOURS = "neighbours"
+MATCH_PARENT = "parent"
+
+# room for every date key once shifted to be positive (about 500 years)
+DATE_KEY_OFFSET = 1 << 33
+DATE_KEY_SPAN = 1 << 34
+
+
+class FactIndex:
+    """
+    An in memory index of one measure by (h3 key, date key) that finds the
+    value at the nearest date for a hex
+    """
+
+    def __init__(self, spatial_keys, date_keys, values):
+        spatial_keys = np.asarray(spatial_keys, dtype=np.int64)
+        date_keys = np.asarray(date_keys, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+
+        self.cells, groups = np.unique(spatial_keys, return_inverse=True)
+        self.lookup_cells = pd.Index(self.cells)
+        order = np.lexsort((date_keys, groups))
+        self.groups = groups[order]
+        self.date_keys = date_keys[order]
+        self.values = values[order]
+        # (group, date) flattened into one sorted array we can binary search
+        self.composite = self.groups * DATE_KEY_SPAN + self.date_keys + DATE_KEY_OFFSET
+        self.starts = np.searchsorted(self.groups, np.arange(len(self.cells)))
+        self.ends = np.searchsorted(
+            self.groups, np.arange(len(self.cells)), side="right"
+        )
+
+    def __len__(self):
+        return len(self.values)
+
+    def lookup(self, spatial_keys, date_keys, max_days=ENRICHMENT_MAX_DAYS):
+        """
+        Returns the value at the nearest date for each (h3 key, date key),
+        nan where the hex isn't indexed or its nearest date is more than
+        max_days away
+        """
+        spatial_keys = np.asarray(spatial_keys, dtype=np.int64)
+        date_keys = np.asarray(date_keys, dtype=np.int64)
+        results = np.full(len(spatial_keys), np.nan)
+
+        groups = self.lookup_cells.get_indexer(spatial_keys)
+        found = np.flatnonzero(groups >= 0)
+        if len(found) == 0:
+            return results
+        groups = groups[found]
+        starts, ends = self.starts[groups], self.ends[groups]
+
+        positions = np.searchsorted(
+            self.composite,
+            groups * DATE_KEY_SPAN + date_keys[found] + DATE_KEY_OFFSET,
+        )
+        after = np.minimum(positions, ends - 1)
+        before = np.maximum(positions - 1, starts)
+        gap_after = np.abs(self.date_keys[after] - date_keys[found])
+        gap_before = np.abs(self.date_keys[before] - date_keys[found])
+        nearest = np.where(gap_before <= gap_after, before, after)
+        gaps = np.minimum(gap_before, gap_after)
+
+        values = self.values[nearest]
+        if max_days is not None:
+            values = np.where(gaps <= max_days * 86400, values, np.nan)
+        results[found] = values
+        return results
+
+
+def read_fact_index(fact, resolution, engine=None):
+    """
+    Builds the index for a fact's measure from its rollup at a resolution,
+    an empty index if the fact hasn't been loaded (and rolled up) yet
+    """
+    measure = ENRICHMENT_MEASURES[fact]
+    key_col = f"h3_key_{resolution}"
+    engine = get_engine() if engine is None else engine
+    try:
+        rollup = pd.read_sql(
+            f"select {key_col}, date_key, {measure}_mean "
+            f"from {get_rollup_table(fact, resolution)}",
+            engine,
+        )
+    except sa.exc.ProgrammingError as e:
+        try:
+            raise e.orig
+        except errors.lookup(errorcodes.UNDEFINED_TABLE):
+            return FactIndex([], [], [])
+    return FactIndex(rollup[key_col], rollup["date_key"], rollup[f"{measure}_mean"])
+
+
+def read_tracks(engine=None):
+    """
+    Returns every loaded track position
+    """
+    engine = get_engine() if engine is None else engine
+    return pd.read_sql(
+        "select ptt, latitude, longitude, date_key from tag_tracks", engine
+    )
+
+
+def lookup_neighbours(index, spatial_keys, date_keys, max_days=ENRICHMENT_MAX_DAYS):
+    """
+    Returns the mean value of the hexes around each h3 key (not including
+    the hex itself) at the nearest date, nan if none of them have one
+    """
+    spatial_keys = np.asarray(spatial_keys, dtype=np.int64)
+    date_keys = np.asarray(date_keys, dtype=np.int64)
+    cells, inverse = np.unique(spatial_keys, return_inverse=True)
+
+    rows, neighbours = [], []
+    for i, key in enumerate(cells):
+        if key == 0:
+            continue
+        for h3_index in h3.k_ring(spatial_key_to_index(int(key)), 1):
+            neighbour = spatial_index_to_key(h3_index)
+            if neighbour != key:
+                rows.append(i)
+                neighbours.append(neighbour)
+    rows = np.array(rows, dtype=np.int64)
+    neighbours = np.array(neighbours, dtype=np.int64)
+
+    # expand every point into one lookup per neighbour of its hex
+    counts = np.bincount(rows, minlength=len(cells))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    point_counts = counts[inverse]
+    points = np.repeat(np.arange(len(spatial_keys)), point_counts)
+    offsets = np.arange(len(points)) - np.repeat(
+        np.cumsum(point_counts) - point_counts, point_counts
+    )
+    values = index.lookup(
+        neighbours[starts[inverse][points] + offsets], date_keys[points], max_days
+    )
+
+    valid = ~np.isnan(values)
+    sums = np.bincount(
+        points[valid], weights=values[valid], minlength=len(spatial_keys)
+    )
+    found = np.bincount(points[valid], minlength=len(spatial_keys))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(found > 0, sums / found, np.nan)
+
+
+def enrich_measure(
+    tracks, measure, index, resolution, parent_index=None, parent_resolution=None
+):
+    """
+    Adds `measure` and `{measure}_match` columns to the tracks, looking the
+    hex up first, then its neighbours and finally its parent
+    """
+    spatial_keys = tracks[f"h3_key_{resolution}"].to_numpy()
+    date_keys = tracks["date_key"].to_numpy()
+
+    values = index.lookup(spatial_keys, date_keys)
+    matches = np.where(np.isnan(values), None, MATCH_CELL).astype(object)
+
+    missing = np.flatnonzero(np.isnan(values))
+    if len(missing) > 0:
+        values[missing] = lookup_neighbours(
+            index, spatial_keys[missing], date_keys[missing]
+        )
+        matches[missing[~np.isnan(values[missing])]] = MATCH_NEIGHBOURS
+
+    missing = np.flatnonzero(np.isnan(values))
+    if len(missing) > 0 and parent_index is not None:
+        values[missing] = parent_index.lookup(
+            tracks[f"h3_key_{parent_resolution}"].to_numpy()[missing],
+            date_keys[missing],
+        )
+        matches[missing[~np.isnan(values[missing])]] = MATCH_PARENT
+
+    tracks[measure] = values
+    tracks[f"{measure}_match"] = matches
+
+
+@instrument()
+def enrich_tracks(tracks, indexes, resolution, parent_resolution=None):
+    """
+    Returns a copy of the tracks with their h3 keys and every measure in
+    `indexes` (a dict of fact -> {resolution: FactIndex}) attached
+    """
+    tracks = tracks.copy()
+    spatial_keys = get_spatial_keys(
+        tracks["latitude"].to_numpy(), tracks["longitude"].to_numpy(), nested=True
+    )
+    for key_resolution, keys in spatial_keys.items():
+        tracks[f"h3_key_{key_resolution}"] = keys
+
+    for fact, fact_indexes in indexes.items():
+        enrich_measure(
+            tracks,
+            ENRICHMENT_MEASURES[fact],
+            fact_indexes[resolution],
+            resolution,
+            fact_indexes.get(parent_resolution),
+            parent_resolution,
+        )
+    return tracks
+
+
+@instrument()
+def load_enriched_tracks(
+    tracks,
+    resolution=None,
+    parent_resolution=None,
+    batch_size=ENRICHMENT_BATCH_SIZE,
+):
+    """
+    Enriches the tracks in batches and writes them to tag_tracks_enriched,
+    replacing what was there in one transaction. By default we match at the finest resolution
+    and fall back to the next coarser one. Returns the number of rows
+    written.
+    """
+    resolution = max(H3_RESOLUTIONS) if resolution is None else resolution
+    if parent_resolution is None:
+        coarser = [r for r in H3_RESOLUTIONS if r < resolution]
+        parent_resolution = max(coarser) if coarser else None
+    resolutions = [r for r in [resolution, parent_resolution] if r is not None]
+    indexes = {
+        fact: {r: read_fact_index(fact, r) for r in resolutions}
+        for fact in ENRICHMENT_MEASURES
+    }
+
+    rows = 0
+    # readers wait for the new table rather than seeing it partly written,
+    # and a failed run leaves the old one
+    with get_engine().begin() as connection:
+        recreate_table(connection, ENRICHED_TRACKS_TABLE)
+        for start in range(0, tracks.shape[0], batch_size):
+            enriched = enrich_tracks(
+                tracks.iloc[start : start + batch_size],
+                indexes,
+                resolution,
+                parent_resolution,
+            )
+            rows += write_dataframe(
+                enriched[[column.name for column in tag_tracks_enriched.columns]],
+                ENRICHED_TRACKS_TABLE,
+                connection=connection,
+            )
+    return rows
@@ -0,0 +1,248 @@
+"""
+Exports our fact tables, joined with their date and h3 dimensions, to
+Parquet for kepler.gl and notebooks.
+
+Each fact is written as a hive partitioned dataset,
+
+    {directory}/{fact}/year=2018/month=1/h3_key_2=.../part-0.parquet
+
+so readers (pyarrow, duckdb, pandas) can prune down to the months and
+coarse hexes they need. Rows are streamed from a server side cursor in
+the order of their partitions, so only one batch and one open file are
+ever held at a time.
+
+Every partition has a fingerprint (its row count and the sum of a hash of
+each row) that is cheap to compute in the database. The fingerprints of
+the last export are kept in a manifest next to the partitions and only
+partitions whose fingerprint changed are written again.
+
+pyarrow (see requirements.txt) is only needed here, so it's only imported
+here.
+"""
+
+import json
+import os
+import shutil
+
+import pandas as pd
+import sqlalchemy as sa
+
+from fishtank.db import get_engine
+from fishtank.dimensions.dates import DATE_TABLE
+from fishtank.dimensions.spatial import H3_RESOLUTIONS, H3_TABLE_PREFIX
+from fishtank.instrumentation import instrument
+from fishtank.schema import metadata
+
+EXPORT_FACTS = ["sea_surface_temperature", "primary_productivity", "tag_tracks"]
+EXPORT_BATCH_SIZE = 100_000
+EXPORT_PARTITION_RESOLUTION = min(H3_RESOLUTIONS)
+MANIFEST_FILE = "_manifest.json"
+DATE_COLUMNS = ["date", "year", "month", "day", "day_of_year", "iso_week", "season"]
+PARTITION_COLUMNS = ["year", "month", f"h3_key_{EXPORT_PARTITION_RESOLUTION}"]
+
+
+def get_partition_path(year, month, spatial_key):
+    return (
+        f"year={int(year)}/month={int(month)}/"
+        f"h3_key_{EXPORT_PARTITION_RESOLUTION}={int(spatial_key)}"
+    )
+
+
+def build_export_query(fact, partitions=None):
+    """
+    Returns the query for a fact's rows with their date attributes and the
+    boundary (as WKB) of their finest hex, ordered by partition. With
+    `partitions` only the rows of those (year, month, h3 key) are selected.
+    """
+    finest = max(H3_RESOLUTIONS)
+    fact_columns = [
+        f'f."{column.name}"'
+        for column in metadata.tables[fact].columns
+        if column.name not in DATE_COLUMNS
+    ]
+    date_columns = [f'd."{column}"' for column in DATE_COLUMNS]
+    partition_key = f"f.h3_key_{EXPORT_PARTITION_RESOLUTION}"
+    partition_filter = ""
+    if partitions is not None:
+        partition_filter = f"""
+    where
+        (d.year, d.month, {partition_key}) in (
+            select * from unnest(
+                cast(:years as integer[]),
+                cast(:months as integer[]),
+                cast(:spatial_keys as bigint[])
+            )
+        )"""
+    return f"""
+    select
+        {", ".join(fact_columns + date_columns)},
+        st_asbinary(h.geometry) as geometry
+    from
+        {fact} f
+        join {DATE_TABLE} d on d.date_key = f.date_key
+        left join {H3_TABLE_PREFIX}{finest} h on h.h3_key_{finest} = f.h3_key_{finest}
+    {partition_filter}
+    order by
+        d.year, d.month, {partition_key}
+    """
+
+
+def get_partition_parameters(partitions):
+    partitions = list(partitions)
+    return {
+        "years": [int(year) for year, _, _ in partitions],
+        "months": [int(month) for _, month, _ in partitions],
+        "spatial_keys": [int(key) for _, _, key in partitions],
+    }
+
+
+def read_partition_fingerprints(fact, engine=None):
+    """
+    Returns a dict of (year, month, h3 key) -> fingerprint for every
+    partition of a fact
+    """
+    engine = get_engine() if engine is None else engine
+    partition_key = f"f.h3_key_{EXPORT_PARTITION_RESOLUTION}"
+    fingerprints = pd.read_sql(
+        f"""
+        select
+            d.year,
+            d.month,
+            {partition_key} as spatial_key,
+            count(*) as count,
+            sum(hashtext(f::text)::bigint) as hash
+        from
+            {fact} f
+            join {DATE_TABLE} d on d.date_key = f.date_key
+        group by
+            d.year, d.month, {partition_key}
+        """,
+        engine,
+    )
+    return {
+        (int(year), int(month), int(key)): f"{count}:{hash_}"
+        for year, month, key, count, hash_ in fingerprints.itertuples(index=False)
+    }
+
+
+def read_manifest(directory):
+    path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(directory, manifest):
+    path = os.path.join(directory, MANIFEST_FILE)
+    with open(f"{path}.partial", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(f"{path}.partial", path)
+
+
+def write_partitions(batches, directory):
+    """
+    Writes dataframes of rows sorted by partition to their partitions'
+    files, replacing whatever was there. Returns a dict of partition path
+    -> rows written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    written = {}
+    path, writer = None, None
+    try:
+        for batch in batches:
+            if batch.shape[0] == 0:
+                continue
+            groups = batch.groupby(PARTITION_COLUMNS, sort=False)
+            for (year, month, key), rows in groups:
+                partition = get_partition_path(year, month, key)
+                table = pa.Table.from_pandas(
+                    rows.drop(columns=PARTITION_COLUMNS), preserve_index=False
+                )
+                if partition != path:
+                    if writer is not None:
+                        writer.close()
+                    path = partition
+                    partition_directory = os.path.join(directory, partition)
+                    shutil.rmtree(partition_directory, ignore_errors=True)
+                    os.makedirs(partition_directory)
+                    writer = pq.ParquetWriter(
+                        os.path.join(partition_directory, "part-0.parquet"),
+                        table.schema,
+                    )
+                    written[path] = 0
+                # a column that's all null in one batch comes through untyped
+                writer.write_table(table.cast(writer.schema))
+                written[path] += rows.shape[0]
+    finally:
+        if writer is not None:
+            writer.close()
+    return written
+
+
+def stream_query(sql, parameters, batch_size=EXPORT_BATCH_SIZE, engine=None):
+    """
+    Yields the results of a query as dataframes of `batch_size` rows, read
+    through a server side cursor
+    """
+    engine = get_engine() if engine is None else engine
+    with engine.connect() as connection:
+        result = connection.execution_options(
+            stream_results=True, max_row_buffer=batch_size
+        ).execute(sa.text(sql), parameters)
+        columns = list(result.keys())
+        for rows in result.partitions(batch_size):
+            yield pd.DataFrame.from_records(rows, columns=columns)
+
+
+@instrument()
+def export_fact(fact, directory, batch_size=EXPORT_BATCH_SIZE, engine=None):
+    """
+    Exports the partitions of a fact that changed since the last export
+    (and removes the ones that are gone). Returns a dict of partition path
+    -> rows written.
+    """
+    directory = os.path.join(directory, fact)
+    os.makedirs(directory, exist_ok=True)
+    manifest = read_manifest(directory)
+    partitions = read_partition_fingerprints(fact, engine)
+    fingerprints = {
+        get_partition_path(*partition): fingerprint
+        for partition, fingerprint in partitions.items()
+    }
+
+    for path in set(manifest) - set(fingerprints):
+        shutil.rmtree(os.path.join(directory, path), ignore_errors=True)
+        try:
+            # and the month and year directories if they're empty now
+            os.removedirs(os.path.dirname(os.path.join(directory, path)))
+        except OSError:
+            pass
+    changed = [
+        partition
+        for partition, fingerprint in partitions.items()
+        if manifest.get(get_partition_path(*partition)) != fingerprint
+    ]
+
+    written = {}
+    if changed:
+        batches = stream_query(
+            build_export_query(fact, changed),
+            get_partition_parameters(changed),
+            batch_size,
+            engine,
+        )
+        written = write_partitions(batches, directory)
+    write_manifest(directory, fingerprints)
+    return written
+
+
+def export_star_schema(directory, facts=None, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Exports every fact (or the given ones) to `directory`. Returns a dict
+    of fact -> partitions written.
+    """
+    facts = EXPORT_FACTS if facts is None else facts
+    return {fact: export_fact(fact, directory, batch_size) for fact in facts}
@@ -0,0 +1,272 @@
+"""
+Lightweight timing of our loader stages so we can tell where a slow load
+spends its time (fetching, averaging, keying, dimension lookups and
+appends, fact writes).
+
+Stages are marked with the `stage` context manager or the `instrument`
+decorator. For each stage we keep the number of calls, wall time, rows in
+and out, bytes written and database round trips. Stages nest and a
+stage's numbers include everything that happened inside it.
+
+Like the key registry, instrumentation is off unless it's enabled and
+while it's off the context manager and decorator do next to nothing. The
+loaders enable it when FISHTANK_METRICS_PATH is set and write the totals
+there when they finish, as a Prometheus text file if the path ends in
+`.prom` and as JSON lines otherwise.
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import sqlalchemy as sa
+
+METRICS_PATH_ENV = "FISHTANK_METRICS_PATH"
+PROMETHEUS_SUFFIX = ".prom"
+
+# the counters kept per stage, and their prometheus names
+STAGE_COUNTERS = {
+    "calls": "fishtank_stage_calls_total",
+    "seconds": "fishtank_stage_seconds_total",
+    "rows_in": "fishtank_stage_rows_in_total",
+    "rows_out": "fishtank_stage_rows_out_total",
+    "bytes_written": "fishtank_stage_bytes_written_total",
+    "round_trips": "fishtank_stage_db_round_trips_total",
+}
+
+
+class StageTimer:
+    def __init__(self, name, rows_in=None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.bytes_written = 0
+        self.round_trips = 0
+        self.seconds = 0.0
+        self.start = time.perf_counter()
+
+
+class NullStageTimer:
+    """
+    Handed out while instrumentation is disabled, ignores everything
+    """
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_null_timer = NullStageTimer()
+
+
+class StageRecorder:
+    def __init__(self, json_log=None):
+        self.json_log = json_log
+        self.totals = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def active_stages(self):
+        if not hasattr(self.local, "stages"):
+            self.local.stages = []
+        return self.local.stages
+
+    def record_io(self, round_trips=0, bytes_written=0):
+        for timer in self.active_stages():
+            timer.round_trips += round_trips
+            timer.bytes_written += bytes_written
+
+    def record(self, timer, failed=False):
+        with self.lock:
+            totals = self.totals.setdefault(
+                timer.name, {counter: 0 for counter in STAGE_COUNTERS}
+            )
+            totals["calls"] += 1
+            totals["seconds"] += timer.seconds
+            totals["rows_in"] += timer.rows_in or 0
+            totals["rows_out"] += timer.rows_out or 0
+            totals["bytes_written"] += timer.bytes_written
+            totals["round_trips"] += timer.round_trips
+            if self.json_log is not None:
+                event = {
+                    "stage": timer.name,
+                    "seconds": timer.seconds,
+                    "rows_in": timer.rows_in,
+                    "rows_out": timer.rows_out,
+                    "bytes_written": timer.bytes_written,
+                    "round_trips": timer.round_trips,
+                    "failed": failed,
+                }
+                self.json_log.write(json.dumps(event) + "\n")
+
+    def add_totals(self, totals):
+        """
+        Adds the totals recorded somewhere else (e.g. another process)
+        """
+        with self.lock:
+            for name, stage_totals in totals.items():
+                own = self.totals.setdefault(
+                    name, {counter: 0 for counter in STAGE_COUNTERS}
+                )
+                for counter in STAGE_COUNTERS:
+                    own[counter] += stage_totals.get(counter, 0)
+
+    def get_totals(self):
+        with self.lock:
+            return {name: dict(totals) for name, totals in self.totals.items()}
+
+
+_recorder = None
+_metrics_path = None
+
+
+def _count_round_trip(*args, **kwargs):
+    record_io(round_trips=1)
+
+
+def enable_instrumentation(json_log=None):
+    """
+    Starts recording stages, optionally writing a JSON line per finished
+    stage to `json_log`
+    """
+    global _recorder
+    if _recorder is None:
+        sa.event.listen(sa.engine.Engine, "before_cursor_execute", _count_round_trip)
+    _recorder = StageRecorder(json_log)
+    return _recorder
+
+
+def disable_instrumentation():
+    global _recorder
+    if _recorder is not None:
+        sa.event.remove(sa.engine.Engine, "before_cursor_execute", _count_round_trip)
+    _recorder = None
+
+
+def get_recorder():
+    return _recorder
+
+
+def configure_instrumentation():
+    """
+    Enables instrumentation if FISHTANK_METRICS_PATH is set
+    """
+    global _metrics_path
+    _metrics_path = os.environ.get(METRICS_PATH_ENV)
+    if _metrics_path:
+        enable_instrumentation()
+
+
+def record_io(round_trips=0, bytes_written=0):
+    """
+    Adds database round trips or bytes written to the stages running on
+    this thread, for work that doesn't go through a SQLAlchemy cursor
+    (like COPY on a raw connection)
+    """
+    recorder = _recorder
+    if recorder is not None:
+        recorder.record_io(round_trips, bytes_written)
+
+
+@contextmanager
+def stage(name, rows_in=None):
+    """
+    Times the block as the named stage. Set `rows_out` on what it yields to
+    record how many rows came out.
+    """
+    recorder = _recorder
+    if recorder is None:
+        yield _null_timer
+        return
+
+    timer = StageTimer(name, rows_in)
+    stages = recorder.active_stages()
+    stages.append(timer)
+    failed = False
+    try:
+        yield timer
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        stages.pop()
+        timer.seconds = time.perf_counter() - timer.start
+        recorder.record(timer, failed)
+
+
+def count_rows(value):
+    """
+    Returns the number of rows in a dataframe, array or set of keys (or a
+    row count), None for anything else
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, (set, frozenset)):
+        return len(value)
+    shape = getattr(value, "shape", None)
+    if shape:
+        return shape[0]
+    return None
+
+
+def instrument(name=None):
+    """
+    Decorates a function so every call is timed as a stage. Rows in are
+    counted from the first argument and rows out from the return value.
+    """
+
+    def decorator(function):
+        stage_name = function.__qualname__ if name is None else name
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _recorder is None:
+                return function(*args, **kwargs)
+            rows_in = count_rows(args[0]) if args else None
+            with stage(stage_name, rows_in) as timer:
+                result = function(*args, **kwargs)
+                timer.rows_out = count_rows(result)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def format_prometheus(totals):
+    lines = []
+    for counter, metric in STAGE_COUNTERS.items():
+        lines.append(f"# TYPE {metric} counter")
+        for name, stage_totals in sorted(totals.items()):
+            lines.append(f'{metric}{{stage="{name}"}} {stage_totals[counter]}')
+    return "\n".join(lines) + "\n"
+
+
+def format_json(totals):
+    return "".join(
+        json.dumps(dict(stage=name, **stage_totals)) + "\n"
+        for name, stage_totals in sorted(totals.items())
+    )
+
+
+def export_metrics(path=None):
+    """
+    Writes the stage totals to `path` (by default FISHTANK_METRICS_PATH),
+    does nothing while instrumentation is disabled
+    """
+    path = _metrics_path if path is None else path
+    if _recorder is None or not path:
+        return
+    totals = _recorder.get_totals()
+    if path.endswith(PROMETHEUS_SUFFIX):
+        contents = format_prometheus(totals)
+    else:
+        contents = format_json(totals)
+    # written then moved so a scraper never sees half a file
+    with open(f"{path}.partial", "w") as f:
+        f.write(contents)
+    os.replace(f"{path}.partial", path)
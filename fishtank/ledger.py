@@ -0,0 +1,157 @@
+"""
+A record of every unit of work our loaders have finished, so re-running a
+loader only does what's missing.
+
+Each entry is a source (usually the fact table), the window of date keys
+it covers (start inclusive, end exclusive), the h3 resolution it was
+aggregated to (if any) and the number of rows and a checksum of what was
+written. Loaders skip units already in the ledger.
+
+Writing a unit's rows and recording it in the ledger happen in separate
+transactions, so a loader that dies in between leaves rows with no entry.
+That's why `clear_window` exists, loaders clear a unit's window before
+writing it, which makes reloading a unit idempotent.
+
+Sources that only ever grow (like the tag data) don't need to be loaded
+in windows at all, `read_high_water_marks` and `filter_new_rows` pick out
+the rows newer than what's already loaded for each group (ptt).
+"""
+
+import hashlib
+
+import pandas as pd
+import sqlalchemy as sa
+from psycopg2 import errors, errorcodes
+
+from fishtank.db import get_engine
+from fishtank.instrumentation import instrument
+
+LEDGER_TABLE = "load_ledger"
+
+
+def get_checksum(dataframe):
+    """
+    Returns a checksum of a dataframe's values (ignoring its index)
+    """
+    hashes = pd.util.hash_pandas_object(dataframe, index=False).to_numpy()
+    return hashlib.sha256(hashes.tobytes()).hexdigest()
+
+
+def read_loaded_windows(source, resolution=None, engine=None):
+    """
+    Returns the set of (window_start, window_end) loaded for a source
+    """
+    engine = get_engine() if engine is None else engine
+    sql = f"""
+    select
+        window_start,
+        window_end
+    from
+        {LEDGER_TABLE}
+    where
+        source = %(source)s
+        and resolution is not distinct from %(resolution)s
+    """
+    ledger = pd.read_sql(
+        sql, engine, params={"source": source, "resolution": resolution}
+    )
+    return set(zip(ledger["window_start"], ledger["window_end"]))
+
+
+@instrument()
+def record_load(
+    source, window_start, window_end, dataframe, resolution=None, engine=None
+):
+    """
+    Records that the rows of `dataframe` were loaded for a source's window,
+    replacing any earlier entry for the same unit
+    """
+    engine = get_engine() if engine is None else engine
+    unit = {
+        "source": source,
+        "window_start": int(window_start),
+        "window_end": int(window_end),
+        "resolution": None if resolution is None else int(resolution),
+    }
+    with engine.begin() as connection:
+        connection.execute(
+            sa.text(f"""
+                delete from {LEDGER_TABLE}
+                where
+                    source = :source
+                    and window_start = :window_start
+                    and window_end = :window_end
+                    and resolution is not distinct from :resolution
+                """),
+            unit,
+        )
+        connection.execute(
+            sa.text(f"""
+                insert into {LEDGER_TABLE}
+                    (source, window_start, window_end, resolution,
+                     row_count, checksum, loaded_at)
+                values
+                    (:source, :window_start, :window_end, :resolution,
+                     :row_count, :checksum, now())
+                """),
+            dict(
+                unit,
+                row_count=int(dataframe.shape[0]),
+                checksum=get_checksum(dataframe),
+            ),
+        )
+
+
+@instrument()
+def clear_window(table, window_start, window_end, date_col="date_key", engine=None):
+    """
+    Deletes the rows of `table` in a window, left behind by a load that
+    didn't make it to the ledger
+    """
+    engine = get_engine() if engine is None else engine
+    with engine.begin() as connection:
+        connection.execute(
+            sa.text(f"""
+                delete from {table}
+                where {date_col} >= :window_start and {date_col} < :window_end
+                """),
+            {"window_start": int(window_start), "window_end": int(window_end)},
+        )
+
+
+def read_high_water_marks(table, group_col, order_col, engine=None):
+    """
+    Returns a dict of group -> the largest `order_col` loaded for it, empty
+    if the table doesn't exist yet
+    """
+    engine = get_engine() if engine is None else engine
+    sql = f"""
+    select
+        {group_col},
+        max({order_col}) as {order_col}
+    from
+        {table}
+    group by
+        {group_col}
+    """
+    try:
+        marks = pd.read_sql(sql, engine)
+    except sa.exc.ProgrammingError as e:
+        try:
+            raise e.orig
+        except errors.lookup(errorcodes.UNDEFINED_TABLE):
+            return {}
+    return dict(zip(marks[group_col], marks[order_col]))
+
+
+def filter_new_rows(dataframe, marks, group_col, order_col):
+    """
+    Returns the rows of `dataframe` past the high water mark of their group
+    """
+    if len(marks) == 0:
+        return dataframe
+    latest = dataframe[group_col].map(marks)
+    new = latest.isna().to_numpy()
+    known = ~new
+    new[known] = dataframe[order_col].to_numpy()[known] > latest.to_numpy()[known]
+    return dataframe[new]
@@ -0,0 +1,40 @@
+import pandas as pd
+import h3
+from fishtank.dimensions.spatial import H3_RESOLUTIONS, spatial_key_to_index
+from fishtank.raster import aggregate_grid_to_h3
+
+PREFIX = "data/gebco_2023_n78.9532_s34.4614_w160.5624_e237.5031"
+NUM_PROCESSES = 8
+
+
+def load_bathymetry(prefix=PREFIX, num_processes=NUM_PROCESSES):
+    """
+    Averages the GEBCO grid at `{prefix}.nc` onto the finest h3 cells and
+    writes their centers and elevations to `{prefix}.csv`. Returns the
+    number of cells written.
+    """
+    print("grouping data...")
+    resolution = max(H3_RESOLUTIONS)
+    grouped = aggregate_grid_to_h3(
+        f"{prefix}.nc",
+        "elevation",
+        resolution,
+        num_processes=num_processes,
+        checkpoint_path=f"{prefix}.checkpoint.npz",
+    )
+
+    print("converting to dataframe...")
+    centers = [
+        h3.h3_to_geo(spatial_key_to_index(key))
+        for key in grouped[f"h3_key_{resolution}"]
+    ]
+    dataframe = pd.DataFrame(
+        {
+            "lat": [lat for lat, _ in centers],
+            "lon": [lon for _, lon in centers],
+            "elevation": grouped["elevation"],
+        }
+    )
+    print("writing to csv...")
+    dataframe.to_csv(f"{prefix}.csv", index=False)
+    return dataframe.shape[0]
@@ -0,0 +1,232 @@
+import collections
+import csv
+import itertools
+import os
+import pandas as pd
+from fishtank.dimensions.dates import (
+    SECONDS_PER_DAY,
+    add_date_keys_to_facts,
+    build_date_dimension_addition,
+    append_date_dimension_addition,
+)
+from fishtank.dimensions.keys import enable_key_registry
+from fishtank.dimensions.spatial import (
+    H3_RESOLUTIONS,
+    add_spatial_keys_to_facts,
+    append_spatial_dimension_addition,
+    build_spatial_dimension_addition,
+)
+from fishtank.bulk import write_dataframe
+from fishtank.enrichment import load_enriched_tracks
+from fishtank.instrumentation import instrument
+from fishtank.ledger import filter_new_rows, read_high_water_marks, record_load
+from fishtank.profiles import load_daily_profiles
+from fishtank.rollups import refresh_rollups
+from fishtank.schema import (
+    ensure_schema,
+    ensure_partitions,
+    tag_context,
+    tag_tracks,
+)
+
+TRACKS_PATH = "data/HHM_Most_Likely_Tracks_CSV_Marcel_2.12.2024.csv"
+INVENTORY_PATH = "data/HMM.Inventory_CSV_Marcel_2.12.2024.csv"
+TIME_SERIES_PATH = "data/HMM_Time_Series_Data_Marcel_2.12.2024.csv"
+TIME_SERIES_CHUNKSIZE = 1_000_000
+TIME_SERIES_DTYPES = {
+    "Ptt": str,
+    "depth.m": "float64",
+    "temp.c": "float64",
+    "date.time.GMT": str,
+}
+TIME_SERIES_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def read_progress(progress_path):
+    if not os.path.exists(progress_path):
+        return 0
+    with open(progress_path) as f:
+        return int(f.read())
+
+
+def write_progress(progress_path, rows):
+    with open(f"{progress_path}.partial", "w") as f:
+        f.write(str(rows))
+    os.replace(f"{progress_path}.partial", progress_path)
+
+
+def clear_progress(progress_path):
+    if os.path.exists(progress_path):
+        os.remove(progress_path)
+
+
+def read_time_series(path, skip_rows=0, chunksize=TIME_SERIES_CHUNKSIZE):
+    """
+    Yields the time series a chunk at a time, starting after the first
+    `skip_rows` rows. The rows are skipped a line at a time rather than
+    with read_csv's skiprows, which holds every skipped row number in
+    memory.
+    """
+    with open(path, newline="") as f:
+        header = next(csv.reader([f.readline()]))
+        collections.deque(itertools.islice(f, skip_rows), maxlen=0)
+        yield from pd.read_csv(
+            f,
+            header=None,
+            names=header,
+            usecols=list(TIME_SERIES_DTYPES),
+            dtype=TIME_SERIES_DTYPES,
+            chunksize=chunksize,
+        )
+
+
+@instrument("load_time_series")
+def load_time_series(path, chunksize=TIME_SERIES_CHUNKSIZE):
+    """
+    Streams the time series into tag_data a chunk at a time, only appending
+    the rows newer than what's already loaded (or written by an earlier
+    chunk) for each ptt. The number of rows read so far is kept next to
+    the csv so that an interrupted load doesn't have to read the whole
+    file again, and removed once the whole file is read (a refreshed csv
+    has new rows all through it). Returns the number of rows written.
+    """
+    progress_path = f"{path}.progress"
+    rows_read = read_progress(progress_path)
+    latest = read_high_water_marks("tag_data", "ptt", "datetime")
+    rows_written = 0
+    for chunk in read_time_series(path, rows_read, chunksize):
+        rows_read += chunk.shape[0]
+        time_series = chunk.rename(
+            {
+                "Ptt": "ptt",
+                "depth.m": "depth_m",
+                "temp.c": "temperature_c",
+            },
+            axis=1,
+        )
+        time_series["datetime"] = pd.to_datetime(
+            time_series["date.time.GMT"], format=TIME_SERIES_DATE_FORMAT
+        )
+        del time_series["date.time.GMT"]
+        time_series = filter_new_rows(time_series, latest, "ptt", "datetime")
+        if time_series.shape[0] > 0:
+            add_date_keys_to_facts(time_series, date_col="datetime")
+
+            dimension = build_date_dimension_addition(time_series)
+            if dimension.shape[0] > 0:
+                append_date_dimension_addition(dimension)
+
+            ensure_partitions("tag_data", time_series["date_key"].unique())
+            rows_written += write_dataframe(time_series, "tag_data")
+            # so rows repeated in a later chunk aren't written again
+            latest.update(time_series.groupby("ptt")["datetime"].max().to_dict())
+            record_load(
+                "tag_data",
+                time_series["date_key"].min(),
+                time_series["date_key"].max() + SECONDS_PER_DAY,
+                time_series,
+            )
+        write_progress(progress_path, rows_read)
+    clear_progress(progress_path)
+    return rows_written
+
+
+def load_tagging(
+    tracks_path=TRACKS_PATH,
+    inventory_path=INVENTORY_PATH,
+    time_series_path=TIME_SERIES_PATH,
+    enrich=True,
+):
+    """
+    Loads the tracks, tag context and time series that aren't loaded yet.
+    Without `enrich` the tracks aren't paired with their environment, for
+    when that's still being loaded. Returns the number of track and time
+    series rows written.
+    """
+    ensure_schema()
+    enable_key_registry()
+
+    # load up most likely tracks data
+    tracks = pd.read_csv(tracks_path)
+    tracks = tracks.rename(
+        {
+            "Ptt": "ptt",
+            "Most.Likely.Latitude": "latitude",
+            "Most.Likely.Longitude": "longitude",
+        },
+        axis=1,
+    )
+    add_date_keys_to_facts(tracks, date_col="Date")
+    add_spatial_keys_to_facts(
+        tracks, lat_col="latitude", lon_col="longitude", nested=True
+    )
+    tracks["ptt"] = tracks["ptt"].astype(str)
+    del tracks["Date"]
+
+    dimension = build_date_dimension_addition(tracks)
+    if dimension.shape[0] > 0:
+        append_date_dimension_addition(dimension)
+
+    # tracks go well outside the precomputed region (h3 gives invalid
+    # coordinates a key of 0, which has no cell)
+    located = tracks[tracks[f"h3_key_{max(H3_RESOLUTIONS)}"] != 0]
+    for resolution in H3_RESOLUTIONS:
+        dimension = build_spatial_dimension_addition(located, resolution)
+        if dimension.shape[0] > 0:
+            append_spatial_dimension_addition(dimension, resolution)
+
+    rows = 0
+    # only append the days we don't have yet for each ptt
+    tracks = tracks[[column.name for column in tag_tracks.columns]]
+    new_tracks = filter_new_rows(
+        tracks,
+        read_high_water_marks("tag_tracks", "ptt", "date_key"),
+        "ptt",
+        "date_key",
+    )
+    if new_tracks.shape[0] > 0:
+        rows += write_dataframe(new_tracks, "tag_tracks")
+        refresh_rollups("tag_tracks", new_tracks["date_key"].unique())
+        record_load(
+            "tag_tracks",
+            new_tracks["date_key"].min(),
+            new_tracks["date_key"].max() + SECONDS_PER_DAY,
+            new_tracks,
+        )
+
+    # pair the tracks with their environment
+    if enrich:
+        load_enriched_tracks(tracks)
+
+    # load up the context
+    inventory = pd.read_csv(inventory_path)
+
+    inventory = inventory.rename(
+        {
+            "Ptt": "ptt",
+            "tag.model": "tag_model",
+            "time.series.resolution.min": "time_resolution_min",
+            "fork.length.cm": "fork_length_cm",
+            "deploy.latitude": "deploy_latitude",
+            "deploy.longitude": "deploy_longitude",
+            "End.Latitude": "end_latitude",
+            "End.Longitude": "end_longitude",
+            "hypothetical.data.retrieved": "hypothetical_data_retrieved",
+            "data.type": "data_type",
+            "deploy.date.GMT": "deploy_date",
+            "end.date.time.GMT": "end_date",
+            "Region": "region",
+        },
+        axis=1,
+    )
+    inventory["ptt"] = inventory["ptt"].astype(str)
+    inventory["deploy_date"] = pd.to_datetime(inventory["deploy_date"])
+    inventory["end_date"] = pd.to_datetime(inventory["end_date"])
+
+    inventory = inventory[[column.name for column in tag_context.columns]]
+    write_dataframe(inventory, "tag_context", upsert_keys=["ptt"])
+
+    # pull the time series data
+    rows += load_time_series(time_series_path)
+    load_daily_profiles()
+    return rows
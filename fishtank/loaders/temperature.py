@@ -0,0 +1,151 @@
+import ee
+import pandas as pd
+import numpy as np
+from tqdm import tqdm
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+from fishtank.dimensions.spatial import (
+    aggregate_points_to_h3,
+    append_spatial_dimension_addition,
+    build_spatial_dimension_addition,
+    load_spatial_dimension,
+    H3_RESOLUTIONS,
+)
+from fishtank.dimensions.dates import (
+    SECONDS_PER_DAY,
+    add_date_keys_to_facts,
+    build_date_dimension_addition,
+    append_date_dimension_addition,
+    load_date_dimension,
+)
+from fishtank.dimensions.keys import enable_key_registry
+from fishtank.bulk import write_dataframe
+from fishtank.cache import FetchCache
+from fishtank.instrumentation import instrument
+from fishtank.ledger import clear_window, read_loaded_windows, record_load
+from fishtank.parallel import get_months
+from fishtank.scheduler import run_pipeline
+from fishtank.regions import fetch_region
+from fishtank.rollups import refresh_rollups
+from fishtank.schema import ensure_schema
+
+ROI_BBOX = (-179, 34, -120, 79)
+EE_PROJECT = "ee-marcelsanders96"
+NUM_FETCH_WORKERS = 4
+COLLECTION = "NOAA/CDR/SST_PATHFINDER/V53"
+BANDS = ["sea_surface_temperature"]
+SCALE = 26000
+START = datetime(2018, 1, 15)
+END = datetime(2018, 12, 15)
+FACT = "sea_surface_temperature"
+FACT_RESOLUTION = max(H3_RESOLUTIONS)
+
+
+def get_window(date):
+    window_start = int(pd.Timestamp(date).floor("D").value // 10**9)
+    return window_start, window_start + SECONDS_PER_DAY
+
+
+@instrument("fetch_month")
+def fetch_month(date, cache=None, scale=SCALE):
+    window_start = date - relativedelta(days=3)
+    window_end = date + relativedelta(days=3)
+    params = {
+        "collection": COLLECTION,
+        "bands": BANDS,
+        "window": [f"{window_start:%Y-%m-%d}", f"{window_end:%Y-%m-%d}"],
+        "region": ROI_BBOX,
+        "scale": scale,
+    }
+
+    def fetch():
+        dataset = (
+            ee.ImageCollection(COLLECTION).filterDate(*params["window"]).select(BANDS)
+        )
+        return fetch_region(
+            ROI_BBOX,
+            lambda bbox: dataset.getRegion(ee.Geometry.BBox(*bbox), scale).getInfo(),
+        )
+
+    if cache is None:
+        return fetch()
+    return cache.fetch(params, fetch)
+
+
+@instrument("process_month")
+def process_month(date, df):
+    df = df[~np.isnan(df["sea_surface_temperature"])]
+    df["temperature_c"] = 0.01 * (df["sea_surface_temperature"] + 273.15)
+    del df["sea_surface_temperature"]
+    # average each pixel over time and then each hex over its pixels
+    gdf = aggregate_points_to_h3(
+        df["latitude"],
+        df["longitude"],
+        {"temperature_c": df["temperature_c"]},
+        {"temperature_c": ("temperature_c", "mean")},
+    )
+
+    # the coarser keys are parents of the finest, which can fall just
+    # outside the precomputed region
+    for resolution in H3_RESOLUTIONS:
+        dimension = build_spatial_dimension_addition(gdf, resolution)
+        if dimension.shape[0] > 0:
+            append_spatial_dimension_addition(dimension, resolution)
+
+    gdf["date"] = date
+    add_date_keys_to_facts(gdf, date_col="date")
+    dimension = build_date_dimension_addition(gdf)
+    if dimension.shape[0] > 0:
+        append_date_dimension_addition(dimension)
+
+    # clear out anything an interrupted run left behind
+    window_start, window_end = get_window(date)
+    clear_window(FACT, window_start, window_end)
+    write_dataframe(gdf, FACT)
+    refresh_rollups(FACT, gdf["date_key"].unique())
+    record_load(FACT, window_start, window_end, gdf, resolution=FACT_RESOLUTION)
+    return gdf.shape[0]
+
+
+def load_months(start=START, end=END, scale=SCALE, num_fetch_workers=NUM_FETCH_WORKERS):
+    """
+    Loads every month from start to end (inclusive) that isn't loaded yet,
+    fetching pixels `scale` meters apart. Returns the number of rows
+    written, or raises once the rest are loaded if any month couldn't be
+    fetched.
+    """
+    ee.Initialize(project=EE_PROJECT)
+    ensure_schema()
+    enable_key_registry()
+
+    # skip the months we've already loaded
+    loaded = read_loaded_windows(FACT, resolution=FACT_RESOLUTION)
+    dates = [date for date in get_months(start, end) if get_window(date) not in loaded]
+
+    # every cell and day we could see is added up front so the
+    # monthly loads never have to touch the dimensions
+    load_spatial_dimension(ROI_BBOX)
+    load_date_dimension(start, end)
+
+    rows = 0
+    with tqdm(total=len(dates)) as progress:
+
+        def process(date, df):
+            nonlocal rows
+            rows += process_month(date, df)
+            progress.update()
+
+        # raw responses are cached on disk so reruns don't hit the network
+        cache = FetchCache()
+        failures = run_pipeline(
+            dates,
+            lambda date: fetch_month(date, cache, scale),
+            process,
+            max_workers=num_fetch_workers,
+        )
+    for date, e in failures:
+        print(f"failed to fetch {date:%Y-%m}: {e}")
+    if failures:
+        # the other months are in the ledger, a rerun only fetches these
+        raise RuntimeError(f"failed to fetch {len(failures)} of {len(dates)} months")
+    return rows
@@ -0,0 +1,120 @@
+import os
+import tempfile
+import unittest
+import unittest.mock as mock
+import h3
+import pandas as pd
+
+
+from fishtank.dimensions.spatial import H3_RESOLUTIONS, spatial_index_to_key
+from fishtank.loaders.tagging import load_tagging, load_time_series
+
+HEADER = "Ptt,depth.m,temp.c,date.time.GMT\n"
+INVENTORY_HEADER = (
+    "Ptt,tag.model,time.series.resolution.min,fork.length.cm,deploy.latitude,"
+    "deploy.longitude,End.Latitude,End.Longitude,hypothetical.data.retrieved,"
+    "data.type,deploy.date.GMT,end.date.time.GMT,Region\n"
+)
+
+
+class TestLoadTimeSeries(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "time_series.csv")
+        self.marks = {}
+        self.written = []
+
+        def write_dataframe(dataframe, table):
+            self.written.append(dataframe)
+            for ptt, latest in dataframe.groupby("ptt")["datetime"].max().items():
+                self.marks[ptt] = latest
+            return dataframe.shape[0]
+
+        for target, kwargs in [
+            ("read_high_water_marks", {"side_effect": lambda *args: dict(self.marks)}),
+            ("write_dataframe", {"side_effect": write_dataframe}),
+            ("build_date_dimension_addition", {"return_value": pd.DataFrame()}),
+            ("ensure_partitions", {}),
+            ("record_load", {}),
+        ]:
+            patcher = mock.patch(f"fishtank.loaders.tagging.{target}", **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def write_csv(self, rows):
+        with open(self.path, "w") as f:
+            f.write(HEADER + "".join(f"{row}\n" for row in rows))
+
+    def test_refreshed_file(self):
+        # a reading repeated in a later chunk is only written once
+        self.write_csv(["1,5.0,10.0,2018-01-01 00:00:00"] * 2)
+        assert load_time_series(self.path, chunksize=1) == 1
+        assert not os.path.exists(f"{self.path}.progress")
+
+        # a refresh adds readings for a ptt we have, at the top of the file
+        self.write_csv(
+            [
+                "1,5.0,10.0,2018-01-01 00:00:00",
+                "1,6.0,11.0,2018-01-01 00:05:00",
+                "2,7.0,12.0,2018-01-01 00:00:00",
+            ]
+        )
+        assert load_time_series(self.path, chunksize=1) == 2
+        assert list(pd.concat(self.written[1:])["depth_m"]) == [6.0, 7.0]
+
+    def test_resume(self):
+        self.write_csv(
+            [
+                "1,5.0,10.0,2018-01-01 00:00:00",
+                "1,6.0,11.0,2018-01-01 00:05:00",
+                "2,7.0,12.0,2018-01-01 00:00:00",
+            ]
+        )
+        # an earlier run got through the first two rows
+        with open(f"{self.path}.progress", "w") as f:
+            f.write("2")
+        assert load_time_series(self.path) == 1
+        assert list(self.written[0]["depth_m"]) == [7.0]
+        assert not os.path.exists(f"{self.path}.progress")
+
+
+class TestLoadTagging(unittest.TestCase):
+    def test_spatial_dimension(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        tracks_path = os.path.join(directory.name, "tracks.csv")
+        inventory_path = os.path.join(directory.name, "inventory.csv")
+        with open(tracks_path, "w") as f:
+            # south of the precomputed region, and a position that failed
+            f.write("Ptt,Date,Most.Likely.Latitude,Most.Likely.Longitude\n")
+            f.write("1,2018-01-01,20.0,-60.0\n1,2018-01-02,,\n")
+        with open(inventory_path, "w") as f:
+            f.write(INVENTORY_HEADER + "1,,,,,,,,,,2018-01-01,2018-02-01,\n")
+
+        module = "fishtank.loaders.tagging"
+        for target, kwargs in [
+            ("ensure_schema", {}),
+            ("enable_key_registry", {}),
+            ("build_date_dimension_addition", {"return_value": pd.DataFrame()}),
+            ("read_high_water_marks", {"return_value": {}}),
+            ("write_dataframe", {"return_value": 1}),
+            ("refresh_rollups", {}),
+            ("record_load", {}),
+            ("load_time_series", {"return_value": 0}),
+            ("load_daily_profiles", {}),
+        ]:
+            patcher = mock.patch(f"{module}.{target}", **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        with mock.patch(
+            f"{module}.build_spatial_dimension_addition",
+            side_effect=lambda dataframe, resolution: dataframe,
+        ) as build, mock.patch(f"{module}.append_spatial_dimension_addition") as append:
+            load_tagging(tracks_path, inventory_path, enrich=False)
+
+        assert [c[0][1] for c in append.call_args_list] == list(H3_RESOLUTIONS)
+        for (dimension, resolution), _ in build.call_args_list:
+            key = spatial_index_to_key(h3.geo_to_h3(20.0, -60.0, resolution))
+            assert list(dimension[f"h3_key_{resolution}"]) == [key]
@@ -0,0 +1,140 @@
+"""
+Runs several loaders (or several month ranges of one loader) side by side
+on a pool of processes so a load can use every core of the loader host.
+
+A job is a "module:function" target and the keyword arguments to call it
+with. The function loads whatever it was asked to and returns the number
+of rows it wrote. Each job runs in a freshly spawned process with its own
+engine, key registry and instrumentation, nothing is shared with the
+parent but the database.
+
+The loaders share the date and h3 dimensions. Their appends only insert
+keys that aren't there yet and skip any another process inserts first
+(see `write_dataframe`), so two loaders adding the same day or hex at the
+same time is fine. Tables that are otherwise created lazily (the schema
+and the rollups) are created by the parent before any job starts.
+
+Stage metrics recorded by the jobs are added to the parent's, so with
+FISHTANK_METRICS_PATH set a parallel run writes one set of totals.
+"""
+
+import importlib
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+
+from fishtank.instrumentation import (
+    configure_instrumentation,
+    export_metrics,
+    get_recorder,
+)
+from fishtank.rollups import ensure_rollup_tables
+from fishtank.schema import ensure_schema
+
+
+def get_months(start, end):
+    """
+    Returns every date a month apart from start up to end (inclusive)
+    """
+    months = []
+    current = pd.Timestamp(start).to_pydatetime()
+    while current <= pd.Timestamp(end):
+        months.append(current)
+        current += relativedelta(months=1)
+    return months
+
+
+def split_months(start, end, num_ranges):
+    """
+    Splits the months from start to end into at most `num_ranges`
+    contiguous (start, end) ranges of about the same length
+    """
+    months = get_months(start, end)
+    num_ranges = max(1, min(num_ranges, len(months)))
+    size, extra = divmod(len(months), num_ranges)
+    ranges = []
+    first = 0
+    for i in range(num_ranges):
+        last = first + size + (1 if i < extra else 0)
+        if last > first:
+            ranges.append((months[first], months[last - 1]))
+        first = last
+    return ranges
+
+
+def get_target(target):
+    module, function = target.split(":")
+    return getattr(importlib.import_module(module), function)
+
+
+def run_job(target, kwargs):
+    """
+    Runs a job in a worker process. Returns the rows it wrote, how long it
+    took and the stage totals it recorded.
+    """
+    configure_instrumentation()
+    start = time.perf_counter()
+    rows = get_target(target)(**kwargs)
+    seconds = time.perf_counter() - start
+    recorder = get_recorder()
+    totals = {} if recorder is None else recorder.get_totals()
+    return rows or 0, seconds, totals
+
+
+def format_report(results, seconds):
+    """
+    Returns the per job and total throughput of a run as text
+    """
+    lines = []
+    for (target, kwargs), (rows, job_seconds) in results:
+        arguments = ", ".join(f"{key}={value}" for key, value in kwargs.items())
+        lines.append(
+            f"{target}({arguments}): {rows:,} rows in {job_seconds:.1f}s "
+            f"({rows / max(job_seconds, 1e-9):,.0f} rows/s)"
+        )
+    total = sum(rows for _, (rows, _) in results)
+    lines.append(
+        f"total: {total:,} rows in {seconds:.1f}s "
+        f"({total / max(seconds, 1e-9):,.0f} rows/s)"
+    )
+    return "\n".join(lines)
+
+
+def run_jobs(jobs, max_workers=None):
+    """
+    Runs a list of (target, kwargs) jobs across a pool of `max_workers`
+    processes (by default one per core). Returns a list of
+    ((target, kwargs), (rows, seconds)) in the order the jobs were given
+    and the wall time of the whole run. A failing job cancels the jobs that
+    haven't started and fails the run once the running ones finish.
+    """
+    configure_instrumentation()
+    ensure_schema()
+    ensure_rollup_tables()
+
+    start = time.perf_counter()
+    results = [None] * len(jobs)
+    # spawned rather than forked so no pooled connections are inherited
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers, mp_context=context) as executor:
+        futures = {
+            executor.submit(run_job, target, kwargs): i
+            for i, (target, kwargs) in enumerate(jobs)
+        }
+        try:
+            for future in as_completed(futures):
+                i = futures[future]
+                rows, seconds, totals = future.result()
+                results[i] = (jobs[i], (rows, seconds))
+                recorder = get_recorder()
+                if recorder is not None:
+                    recorder.add_totals(totals)
+        except BaseException:
+            executor.shutdown(cancel_futures=True)
+            raise
+    seconds = time.perf_counter() - start
+    export_metrics()
+    return results, seconds
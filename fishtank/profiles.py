@@ -0,0 +1,239 @@
+"""
+Daily dive profiles, one row per tag (ptt) and day summarising its time
+series so per fish, per day questions don't have to scan every reading in
+tag_data.
+
+Each day gets its count of readings, depth quantiles, min/max/mean
+temperature and the time spent in each depth bin. A reading stands for
+the time until the next reading of the same tag (capped, so gaps in the
+data don't count as time at depth).
+
+The table's columns are those of the default quantiles and depth bins (see
+the table in fishtank.schema), other bins can be had from
+`build_daily_profiles` directly. The summaries are computed with grouped
+array operations over readings sorted by ptt and datetime, a day at a time
+would be far too slow. Loads are incremental, only tags with readings that
+haven't been summarised are recomputed, from their last summarised day on.
+"""
+
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+from psycopg2 import errors, errorcodes
+
+from fishtank.bulk import write_dataframe
+from fishtank.db import get_engine
+from fishtank.instrumentation import instrument
+
+PROFILE_TABLE = "tag_daily_profiles"
+PROFILE_BATCH_PTTS = 20
+DEPTH_QUANTILES = [0.1, 0.5, 0.9]
+DEPTH_BIN_EDGES = [0, 10, 50, 100, 200, 500, 1000]
+MAX_READING_SECONDS = 3600
+# earlier than any date key, for tags with nothing summarised yet
+NO_DATE_KEY = -(2**62)
+
+
+def get_group_starts(*sorted_columns):
+    changes = np.zeros(len(sorted_columns[0]), dtype=bool)
+    changes[:1] = True
+    for column in sorted_columns:
+        changes[1:] |= column[1:] != column[:-1]
+    return np.flatnonzero(changes)
+
+
+def get_quantile_columns(quantiles=DEPTH_QUANTILES):
+    return [f"depth_m_q{int(round(quantile * 100))}" for quantile in quantiles]
+
+
+def get_depth_bin_columns(depth_bin_edges=DEPTH_BIN_EDGES):
+    columns = [
+        f"seconds_{low}_{high}m"
+        for low, high in zip(depth_bin_edges[:-1], depth_bin_edges[1:])
+    ]
+    return columns + [f"seconds_{depth_bin_edges[-1]}m_plus"]
+
+
+def get_reading_seconds(ptts, datetimes, max_seconds=MAX_READING_SECONDS):
+    """
+    Returns the seconds each reading stands for, the time until the next
+    reading of the same tag (the last reading of a tag gets the interval
+    before it)
+    """
+    seconds = np.diff(datetimes.astype("datetime64[s]").astype(np.int64)).astype(
+        np.float64
+    )
+    same_ptt = ptts[1:] == ptts[:-1]
+    following = np.where(same_ptt, seconds, np.nan)
+    durations = np.append(following, np.nan)
+    preceding = np.insert(np.where(same_ptt, seconds, np.nan), 0, np.nan)
+    durations = np.where(np.isnan(durations), preceding, durations)
+    return np.clip(np.nan_to_num(durations), 0, max_seconds)
+
+
+def get_group_quantiles(values, groups, starts, quantiles):
+    """
+    Returns an array of (group, quantile) for values sorted by group,
+    ignoring nans like np.nanquantile
+    """
+    # sort within each group with the nans last
+    order = np.lexsort((values, groups))
+    values = values[order]
+    valid = np.add.reduceat(~np.isnan(values), starts)
+
+    results = np.full((len(starts), len(quantiles)), np.nan)
+    has_values = valid > 0
+    for i, quantile in enumerate(quantiles):
+        positions = quantile * (valid[has_values] - 1)
+        low = np.floor(positions).astype(np.int64)
+        high = np.ceil(positions).astype(np.int64)
+        group_starts = starts[has_values]
+        low_values = values[group_starts + low]
+        high_values = values[group_starts + high]
+        results[has_values, i] = low_values + (high_values - low_values) * (
+            positions - low
+        )
+    return results
+
+
+def build_daily_profiles(
+    time_series, quantiles=DEPTH_QUANTILES, depth_bin_edges=DEPTH_BIN_EDGES
+):
+    """
+    Returns the daily profiles of a time series (ptt, depth_m,
+    temperature_c, datetime, date_key) sorted by ptt and datetime
+    """
+    if time_series.shape[0] == 0:
+        return pd.DataFrame()
+    ptts = time_series["ptt"].to_numpy()
+    date_keys = time_series["date_key"].to_numpy()
+    depths = time_series["depth_m"].to_numpy(dtype=np.float64)
+    temperatures = time_series["temperature_c"].to_numpy(dtype=np.float64)
+    seconds = get_reading_seconds(ptts, time_series["datetime"].to_numpy())
+
+    starts = get_group_starts(ptts, date_keys)
+    groups = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(ptts))))
+
+    profiles = pd.DataFrame({"ptt": ptts[starts], "date_key": date_keys[starts]})
+    profiles["count"] = np.bincount(groups)
+
+    depth_quantiles = get_group_quantiles(depths, groups, starts, quantiles)
+    for i, column in enumerate(get_quantile_columns(quantiles)):
+        profiles[column] = depth_quantiles[:, i]
+
+    valid = ~np.isnan(temperatures)
+    temperature_counts = np.add.reduceat(valid, starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        profiles["temperature_c_mean"] = (
+            np.add.reduceat(np.where(valid, temperatures, 0), starts)
+            / temperature_counts
+        )
+    # fmin and fmax skip nans unless the whole group is nan
+    profiles["temperature_c_min"] = np.fmin.reduceat(temperatures, starts)
+    profiles["temperature_c_max"] = np.fmax.reduceat(temperatures, starts)
+
+    # readings without a depth don't count towards any bin
+    depth_bins = np.digitize(depths, depth_bin_edges) - 1
+    binned = ~np.isnan(depths) & (depth_bins >= 0)
+    num_bins = len(depth_bin_edges)
+    time_at_depth = np.bincount(
+        groups[binned] * num_bins + depth_bins[binned],
+        weights=seconds[binned],
+        minlength=len(starts) * num_bins,
+    ).reshape(len(starts), num_bins)
+    for i, column in enumerate(get_depth_bin_columns(depth_bin_edges)):
+        profiles[column] = time_at_depth[:, i]
+    return profiles
+
+
+def read_reading_counts(table, count, engine=None):
+    """
+    Returns a dict of ptt -> (last date key, number of readings) for a
+    table, where `count` is the expression counting a group's readings,
+    empty if the table doesn't exist yet
+    """
+    engine = get_engine() if engine is None else engine
+    sql = f"""
+    select
+        ptt,
+        max(date_key) as date_key,
+        {count} as count
+    from
+        {table}
+    group by
+        ptt
+    """
+    try:
+        counts = pd.read_sql(sql, engine)
+    except sa.exc.ProgrammingError as e:
+        try:
+            raise e.orig
+        except errors.lookup(errorcodes.UNDEFINED_TABLE):
+            return {}
+    return dict(zip(counts["ptt"], zip(counts["date_key"], counts["count"])))
+
+
+def get_stale_ptts(engine=None):
+    """
+    Returns a dict of ptt -> the first date key to (re)compute for every
+    tag with readings that haven't been summarised. Readings are only ever
+    appended after a tag's latest one, so any that are new are on or after
+    its last summarised day and that day is recomputed too.
+    """
+    loaded = read_reading_counts("tag_data", "count(*)", engine)
+    summarised = read_reading_counts(PROFILE_TABLE, "sum(count)", engine)
+    stale = {}
+    for ptt, (latest, count) in loaded.items():
+        if ptt not in summarised:
+            stale[ptt] = NO_DATE_KEY
+            continue
+        summarised_latest, summarised_count = summarised[ptt]
+        if latest > summarised_latest or count != summarised_count:
+            stale[ptt] = summarised_latest
+    return stale
+
+
+@instrument()
+def load_daily_profiles(batch_ptts=PROFILE_BATCH_PTTS, engine=None):
+    """
+    Recomputes the daily profiles of every tag with new readings, a batch of
+    tags at a time. Returns the number of profiles written.
+    """
+    engine = get_engine() if engine is None else engine
+    stale = sorted(get_stale_ptts(engine).items())
+    rows = 0
+    for start in range(0, len(stale), batch_ptts):
+        batch = stale[start : start + batch_ptts]
+        parameters = {
+            "ptts": [ptt for ptt, _ in batch],
+            "starts": [int(date_key) for _, date_key in batch],
+        }
+        with engine.connect() as connection:
+            time_series = pd.read_sql(
+                sa.text("""
+                    select t.ptt, t.depth_m, t.temperature_c, t.datetime, t.date_key
+                    from tag_data t
+                    join unnest(cast(:ptts as text[]), cast(:starts as bigint[]))
+                        as s(ptt, start)
+                        on t.ptt = s.ptt and t.date_key >= s.start
+                    order by t.ptt, t.datetime
+                    """),
+                connection,
+                params=parameters,
+            )
+        profiles = build_daily_profiles(time_series)
+
+        with engine.begin() as connection:
+            connection.execute(
+                sa.text(f"""
+                    delete from {PROFILE_TABLE} t
+                    using unnest(cast(:ptts as text[]), cast(:starts as bigint[]))
+                        as s(ptt, start)
+                    where t.ptt = s.ptt and t.date_key >= s.start
+                    """),
+                parameters,
+            )
+        if profiles.shape[0] > 0:
+            write_dataframe(profiles, PROFILE_TABLE, engine=engine)
+            rows += profiles.shape[0]
+    return rows
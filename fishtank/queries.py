@@ -0,0 +1,173 @@
+"""
+Reads the rows of a fact within a region (a bounding box, a polygon or a
+radius around a point) and a date range without any geometry in the
+database.
+
+The region is covered with h3 cells at the finest resolution we key
+facts by and every complete group of children is compacted to its coarser
+parent (see `get_region_coverage`). Each cell is then turned into the
+range of fine keys beneath it, a parent's children are a contiguous range
+of keys, so the whole region becomes a handful of integer range scans on
+the fact's finest key index.
+
+Coarse cells are filtered through their children's range on the finest
+key too, rather than on the coarse key column, so every cell is a scan of
+the same index.
+
+The cover runs a little past the region's edge so rows with a latitude
+and longitude are clipped to the region once they're read. Results are
+streamed in chunks through a server side cursor.
+"""
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from fishtank.dimensions.spatial import (
+    EARTH_RADIUS_KM,
+    H3_RESOLUTIONS,
+    get_radius_region,
+    get_region_coverage,
+    spatial_keys_to_child_ranges,
+    to_region,
+)
+from fishtank.export import stream_query
+from fishtank.schema import metadata
+
+QUERY_CHUNKSIZE = 100_000
+
+
+def get_date_key(date):
+    return pd.Timestamp(date).floor("D").value // 10**9
+
+
+def get_coverage_ranges(coverage, resolution):
+    """
+    Returns sorted arrays of the lowest and highest keys at `resolution`
+    of every cell in a coverage (a dict of resolution -> keys)
+    """
+    ranges = [
+        spatial_keys_to_child_ranges(keys, resolution)
+        for keys in coverage.values()
+        if len(keys) > 0
+    ]
+    if not ranges:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    lows = np.concatenate([lows for lows, _ in ranges])
+    highs = np.concatenate([highs for _, highs in ranges])
+    order = np.argsort(lows)
+    return lows[order], highs[order]
+
+
+def build_region_query(fact, coverage, start=None, end=None, resolution=None):
+    """
+    Returns the query and its parameters for the rows of a fact in the
+    cells of a coverage, optionally between two dates (inclusive)
+    """
+    resolution = max(H3_RESOLUTIONS) if resolution is None else resolution
+    key_col = f"h3_key_{resolution}"
+    assert key_col in metadata.tables[fact].columns
+
+    lows, highs = get_coverage_ranges(coverage, resolution)
+    parameters = {"lows": lows.tolist(), "highs": highs.tolist()}
+    date_filters = []
+    if start is not None:
+        date_filters.append("f.date_key >= :start_key")
+        parameters["start_key"] = get_date_key(start)
+    if end is not None:
+        date_filters.append("f.date_key <= :end_key")
+        parameters["end_key"] = get_date_key(end)
+    where = f"where {' and '.join(date_filters)}" if date_filters else ""
+    sql = f"""
+    select
+        f.*
+    from
+        {fact} f
+        join unnest(cast(:lows as bigint[]), cast(:highs as bigint[]))
+            as r(low, high)
+            on f.{key_col} between r.low and r.high
+    {where}
+    """
+    return sql, parameters
+
+
+def has_coordinates(fact):
+    columns = metadata.tables[fact].columns
+    return "latitude" in columns and "longitude" in columns
+
+
+def query_region(
+    fact,
+    region,
+    start=None,
+    end=None,
+    resolution=None,
+    clip=True,
+    chunksize=QUERY_CHUNKSIZE,
+    engine=None,
+):
+    """
+    Yields the rows of a fact in a region (a bounding box or shapely
+    polygon) between two dates (inclusive) as dataframes of up to
+    `chunksize` rows. With `clip` rows whose coordinates fall outside the
+    region are dropped.
+    """
+    region = to_region(region)
+    coverage = get_region_coverage(region, resolution)
+    sql, parameters = build_region_query(fact, coverage, start, end, resolution)
+    clip = clip and has_coordinates(fact)
+    for chunk in stream_query(sql, parameters, chunksize, engine):
+        if clip:
+            inside = shapely.intersects_xy(
+                region, chunk["longitude"].to_numpy(), chunk["latitude"].to_numpy()
+            )
+            chunk = chunk[inside].reset_index(drop=True)
+        yield chunk
+
+
+def get_distances_km(lon, lat, lons, lats):
+    """
+    Returns the great circle distances from a point to arrays of points
+    """
+    lon, lat = np.radians(lon), np.radians(lat)
+    lons, lats = np.radians(lons), np.radians(lats)
+    a = (
+        np.sin((lats - lat) / 2) ** 2
+        + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def query_radius(
+    fact,
+    lon,
+    lat,
+    radius_km,
+    start=None,
+    end=None,
+    resolution=None,
+    chunksize=QUERY_CHUNKSIZE,
+    engine=None,
+):
+    """
+    Yields the rows of a fact within `radius_km` of a point between two
+    dates (inclusive) as dataframes of up to `chunksize` rows
+    """
+    chunks = query_region(
+        fact,
+        get_radius_region(lon, lat, radius_km),
+        start,
+        end,
+        resolution,
+        clip=False,
+        chunksize=chunksize,
+        engine=engine,
+    )
+    clip = has_coordinates(fact)
+    for chunk in chunks:
+        if clip:
+            distances = get_distances_km(
+                lon, lat, chunk["longitude"].to_numpy(), chunk["latitude"].to_numpy()
+            )
+            chunk = chunk[distances <= radius_km].reset_index(drop=True)
+        yield chunk
@@ -0,0 +1,248 @@
+"""
+Aggregation of gridded rasters (e.g. GEBCO bathymetry) onto h3 cells.
+
+A grid is processed in blocks of rows. For each block we key every cell
+in one vectorized call and reduce with a sort based group by, which
+leaves us with an array of keys and the matching running totals and
+counts. Those partial aggregates merge the same way so nothing ever goes
+through a python dict.
+
+When run in parallel each worker opens the netCDF file itself and reads
+only its own rows, so the grid is never pickled between processes. Run
+in a single process the file is streamed block by block. Either way the
+peak memory is a block plus the aggregate, whatever the size of the grid.
+"""
+
+import json
+import multiprocessing as mp
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from fishtank.dimensions.spatial import H3_RESOLUTIONS, get_spatial_keys
+
+DEFAULT_BLOCK_CELLS = 4_000_000
+
+
+def empty_aggregate():
+    return (
+        np.empty(0, dtype=np.int64),
+        np.empty(0, dtype=np.float64),
+        np.empty(0, dtype=np.int64),
+    )
+
+
+def group_aggregate(keys, totals, counts):
+    """
+    Sums totals and counts that share a key
+    """
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    return (
+        unique_keys,
+        np.bincount(inverse, weights=totals, minlength=len(unique_keys)),
+        np.bincount(inverse, weights=counts, minlength=len(unique_keys)).astype(
+            np.int64
+        ),
+    )
+
+
+def aggregate_block(lats, lons, values, resolution):
+    """
+    Returns the (keys, totals, counts) of a block of the grid, where
+    `values` has a row per latitude and a column per longitude
+    """
+    values = np.ma.masked_invalid(values)
+    rows, columns = np.nonzero(~np.ma.getmaskarray(values))
+    if len(rows) == 0:
+        return empty_aggregate()
+    keys = get_spatial_keys(
+        np.asarray(lats, dtype=np.float64)[rows],
+        np.asarray(lons, dtype=np.float64)[columns],
+        [resolution],
+    )[resolution]
+    return group_aggregate(
+        keys,
+        np.ma.getdata(values)[rows, columns].astype(np.float64),
+        np.ones(len(keys), dtype=np.int64),
+    )
+
+
+def merge_aggregates(aggregates):
+    aggregates = list(aggregates)
+    if len(aggregates) == 0:
+        return empty_aggregate()
+    keys, totals, counts = (np.concatenate(arrays) for arrays in zip(*aggregates))
+    return group_aggregate(keys, totals, counts)
+
+
+def get_row_blocks(num_rows, block_rows, start_row=0):
+    return [
+        (start, min(start + block_rows, num_rows))
+        for start in range(start_row, num_rows, block_rows)
+    ]
+
+
+def get_block_rows(variable, target_cells=DEFAULT_BLOCK_CELLS):
+    """
+    Picks a number of rows per block that lines up with the variable's
+    chunking on disk and holds roughly `target_cells` values
+    """
+    num_rows, num_columns = variable.shape
+    chunking = variable.chunking()
+    chunk_rows = 1 if chunking == "contiguous" else chunking[0]
+    chunks = max(1, target_cells // (chunk_rows * num_columns))
+    return min(num_rows, chunks * chunk_rows)
+
+
+def iter_grid_blocks(
+    path, variable, block_rows=None, start_row=0, lat_var="lat", lon_var="lon"
+):
+    """
+    Walks a (lat, lon) netCDF variable a block of rows at a time, yielding
+    (start, stop, lats, lons, values) so only one block is ever in memory
+    """
+    # netCDF4 is only needed by the raster loaders
+    import netCDF4 as nc
+
+    with nc.Dataset(path) as dataset:
+        values = dataset[variable]
+        block_rows = get_block_rows(values) if block_rows is None else block_rows
+        lons = dataset[lon_var][:]
+        for start, stop in get_row_blocks(values.shape[0], block_rows, start_row):
+            yield start, stop, dataset[lat_var][start:stop], lons, values[start:stop]
+
+
+def read_block(path, variable, start, stop, lat_var="lat", lon_var="lon"):
+    import netCDF4 as nc
+
+    with nc.Dataset(path) as dataset:
+        return (
+            dataset[lat_var][start:stop],
+            dataset[lon_var][:],
+            dataset[variable][start:stop],
+        )
+
+
+def _aggregate_block_task(args):
+    path, variable, start, stop, resolution, lat_var, lon_var = args
+    lats, lons, values = read_block(path, variable, start, stop, lat_var, lon_var)
+    return stop, aggregate_block(lats, lons, values, resolution)
+
+
+def get_checkpoint_parameters(path, variable, resolution, shape):
+    """
+    Returns what a checkpoint's aggregate depends on, the file (its size
+    and modification time, in case it's replaced), variable, resolution
+    and grid shape
+    """
+    stat = os.stat(path)
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "variable": variable,
+        "resolution": int(resolution),
+        "shape": [int(length) for length in shape],
+    }
+
+
+def save_checkpoint(checkpoint_path, next_row, aggregate, parameters):
+    keys, totals, counts = aggregate
+    # write then rename so a crash never leaves a half written checkpoint
+    partial_path = f"{checkpoint_path}.partial.npz"
+    np.savez(
+        partial_path,
+        next_row=next_row,
+        keys=keys,
+        totals=totals,
+        counts=counts,
+        parameters=json.dumps(parameters, sort_keys=True),
+    )
+    os.replace(partial_path, checkpoint_path)
+
+
+def load_checkpoint(checkpoint_path, parameters):
+    """
+    Returns the row to resume from and the aggregate up to that row, or
+    the start if there's no checkpoint or it was made with different
+    parameters
+    """
+    if checkpoint_path is None or not os.path.exists(checkpoint_path):
+        return 0, empty_aggregate()
+    with np.load(checkpoint_path) as checkpoint:
+        saved = str(checkpoint["parameters"]) if "parameters" in checkpoint else None
+        if saved != json.dumps(parameters, sort_keys=True):
+            warnings.warn(f"ignoring {checkpoint_path}, it was made for another grid")
+            return 0, empty_aggregate()
+        return int(checkpoint["next_row"]), (
+            checkpoint["keys"],
+            checkpoint["totals"],
+            checkpoint["counts"],
+        )
+
+
+def aggregate_grid_to_h3(
+    path,
+    variable,
+    resolution=None,
+    block_rows=None,
+    num_processes=None,
+    lat_var="lat",
+    lon_var="lon",
+    checkpoint_path=None,
+):
+    """
+    Averages a (lat, lon) netCDF variable over the h3 cells at the given
+    resolution (the finest of H3_RESOLUTIONS by default). Returns a
+    dataframe of h3_key_N, the mean value and the number of grid cells.
+
+    Blocks follow the file's chunking unless `block_rows` is given. With a
+    `checkpoint_path` the aggregate so far is saved after every block and a
+    rerun of the same grid picks up after the last finished block. The
+    checkpoint is removed once the whole grid is aggregated.
+    """
+    import netCDF4 as nc
+
+    resolution = max(H3_RESOLUTIONS) if resolution is None else resolution
+    with nc.Dataset(path) as dataset:
+        shape = dataset[variable].shape
+        num_rows = shape[0]
+        if block_rows is None:
+            block_rows = get_block_rows(dataset[variable])
+
+    parameters = get_checkpoint_parameters(path, variable, resolution, shape)
+    start_row, aggregate = load_checkpoint(checkpoint_path, parameters)
+
+    def add_block(stop, partial):
+        nonlocal aggregate
+        aggregate = merge_aggregates([aggregate, partial])
+        if checkpoint_path is not None:
+            save_checkpoint(checkpoint_path, stop, aggregate, parameters)
+
+    if num_processes == 1:
+        for _, stop, lats, lons, values in iter_grid_blocks(
+            path, variable, block_rows, start_row, lat_var, lon_var
+        ):
+            add_block(stop, aggregate_block(lats, lons, values, resolution))
+    else:
+        tasks = [
+            (path, variable, start, stop, resolution, lat_var, lon_var)
+            for start, stop in get_row_blocks(num_rows, block_rows, start_row)
+        ]
+        with mp.Pool(num_processes) as pool:
+            # in order so the checkpoint always covers a prefix of the rows
+            for stop, partial in pool.imap(_aggregate_block_task, tasks):
+                add_block(stop, partial)
+
+    keys, totals, counts = aggregate
+    grouped = pd.DataFrame(
+        {
+            f"h3_key_{resolution}": keys,
+            variable: totals / counts,
+            "count": counts,
+        }
+    )
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return grouped
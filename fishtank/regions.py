@@ -0,0 +1,104 @@
+"""
+Remote services like Earth Engine cap how much they'll return for one
+region request, so rather than asking for a whole region of interest at
+once we split it into tiles along h3 cell boundaries and fetch the tiles
+concurrently.
+
+Each tile is the bounding box of one h3 cell (clipped to the region).
+Neighbouring boxes overlap, so every pixel a tile returns is keyed and only
+kept by the tile whose cell it falls in. That way each pixel is counted
+exactly once.
+"""
+
+import numpy as np
+import pandas as pd
+from shapely.affinity import translate
+from shapely.geometry import Polygon
+
+from fishtank.dimensions.spatial import (
+    get_coords,
+    get_region_spatial_keys,
+    get_spatial_keys,
+    spatial_key_to_index,
+    to_region,
+)
+from fishtank.scheduler import run_pipeline
+
+TILE_RESOLUTION = 2
+
+
+def get_region_tiles(region, resolution=TILE_RESOLUTION):
+    """
+    Returns a list of (h3_key, (min_lon, min_lat, max_lon, max_lat)) tiles
+    covering the region
+    """
+    region = to_region(region)
+    tiles = []
+    for key in get_region_spatial_keys(region, resolution):
+        cell = Polygon(get_coords(spatial_key_to_index(key)))
+        # get_coords pushes cells on the antimeridian past 180
+        clipped = cell.intersection(region).union(
+            translate(cell, xoff=-360).intersection(region)
+        )
+        if not clipped.is_empty:
+            tiles.append((int(key), clipped.bounds))
+    return tiles
+
+
+def region_response_to_columns(response):
+    """
+    Turns a getRegion style response (a header row followed by one row per
+    pixel) into a dict of numpy columns
+    """
+    header, rows = response[0], response[1:]
+    columns = {}
+    for i, name in enumerate(header):
+        values = [row[i] for row in rows]
+        if name == "id":
+            columns[name] = np.array(values, dtype=object)
+        elif name == "time":
+            columns[name] = np.array(values, dtype=np.int64)
+        else:
+            # missing band values come back as None which becomes nan
+            columns[name] = np.array(values, dtype=np.float64)
+    return columns
+
+
+def fetch_region(
+    region,
+    fetch,
+    resolution=TILE_RESOLUTION,
+    max_workers=8,
+    retries=2,
+    lat_col="latitude",
+    lon_col="longitude",
+):
+    """
+    Fetches a region tile by tile with `fetch(bbox)`, which should return a
+    getRegion style response for the bounding box. Returns the pixels of
+    all the tiles as one dataframe.
+    """
+    tiles = get_region_tiles(region, resolution)
+    parts = []
+
+    def process(tile, response):
+        key, _ = tile
+        columns = region_response_to_columns(response)
+        keys = get_spatial_keys(columns[lat_col], columns[lon_col], [resolution])
+        mine = keys[resolution] == key
+        parts.append({name: values[mine] for name, values in columns.items()})
+
+    failures = run_pipeline(
+        tiles,
+        lambda tile: fetch(tile[1]),
+        process,
+        max_workers=max_workers,
+        retries=retries,
+    )
+    if failures:
+        raise RuntimeError(f"failed to fetch {len(failures)} of {len(tiles)} tiles")
+    if len(parts) == 0:
+        return pd.DataFrame()
+    return pd.DataFrame(
+        {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+    )
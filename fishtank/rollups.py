@@ -0,0 +1,119 @@
+"""
+Pre-aggregated copies of our fact tables, one per fact and h3 resolution,
+grouped by h3 key and date key. Dashboards working at a coarse resolution
+can read these instead of grouping the fine grained facts on every
+refresh.
+
+Rollups are refreshed per date key, so a load only has to recompute the
+days it touched. Everything is driven by H3_RESOLUTIONS so adding a
+resolution adds its rollups too.
+"""
+
+import sqlalchemy as sa
+
+from fishtank.db import get_engine
+from fishtank.dimensions.spatial import H3_RESOLUTIONS
+from fishtank.instrumentation import instrument
+
+ROLLUP_TABLE_INFIX = "_rollup_"
+
+# the measures to aggregate for each fact, every rollup also has a count
+ROLLUP_MEASURES = {
+    "sea_surface_temperature": ["temperature_c"],
+    "primary_productivity": ["log_chla_ave"],
+    "tag_tracks": [],
+}
+
+
+def get_rollup_table(fact, resolution):
+    return f"{fact}{ROLLUP_TABLE_INFIX}{resolution}"
+
+
+def get_rollup_columns(fact, resolution):
+    """
+    Returns a list of (column, type, expression) for the rollup of a fact
+    """
+    key_col = f"h3_key_{resolution}"
+    columns = [
+        (key_col, "bigint not null", key_col),
+        ("date_key", "bigint not null", "date_key"),
+        ("count", "bigint not null", "count(*)"),
+    ]
+    for measure in ROLLUP_MEASURES[fact]:
+        columns += [
+            (f"{measure}_sum", "double precision", f"sum({measure})"),
+            (f"{measure}_mean", "double precision", f"avg({measure})"),
+            (f"{measure}_min", "double precision", f"min({measure})"),
+            (f"{measure}_max", "double precision", f"max({measure})"),
+        ]
+    return columns
+
+
+def build_rollup_table_statement(fact, resolution):
+    table = get_rollup_table(fact, resolution)
+    key_col = f"h3_key_{resolution}"
+    columns = get_rollup_columns(fact, resolution)
+    definitions = ",\n".join(f"{column} {type_}" for column, type_, _ in columns)
+    return f"""
+        create table if not exists {table} (
+            {definitions},
+            primary key ({key_col}, date_key)
+        )
+        """
+
+
+def build_rollup_statements(fact, resolution, date_keys=None):
+    """
+    Returns the statements that (re)build the rollup of a fact at a
+    resolution, either for the given date keys or entirely
+    """
+    table = get_rollup_table(fact, resolution)
+    key_col = f"h3_key_{resolution}"
+    columns = get_rollup_columns(fact, resolution)
+
+    names = ", ".join(f'"{column}"' for column, _, _ in columns)
+    expressions = ", ".join(expression for _, _, expression in columns)
+    date_filter = "" if date_keys is None else "where date_key = any(:date_keys)"
+
+    return [
+        build_rollup_table_statement(fact, resolution),
+        f"delete from {table} {date_filter}",
+        f"""
+        insert into {table} ({names})
+        select {expressions}
+        from {fact}
+        {date_filter}
+        group by {key_col}, date_key
+        """,
+    ]
+
+
+@instrument()
+def refresh_rollups(fact, date_keys=None, resolutions=None):
+    """
+    Recomputes the rollups of a fact for the given date keys (or all of
+    them) at every resolution, each in its own transaction
+    """
+    resolutions = H3_RESOLUTIONS if resolutions is None else resolutions
+    parameters = {}
+    if date_keys is not None:
+        parameters["date_keys"] = sorted(set(int(key) for key in date_keys))
+    for resolution in resolutions:
+        with get_engine().begin() as connection:
+            for statement in build_rollup_statements(fact, resolution, date_keys):
+                connection.execute(sa.text(statement), parameters)
+
+
+def ensure_rollup_tables(facts=None, resolutions=None):
+    """
+    Creates any missing rollup tables up front, loaders running side by
+    side would otherwise race to create them on their first refresh
+    """
+    facts = list(ROLLUP_MEASURES) if facts is None else facts
+    resolutions = H3_RESOLUTIONS if resolutions is None else resolutions
+    with get_engine().begin() as connection:
+        for fact in facts:
+            for resolution in resolutions:
+                connection.execute(
+                    sa.text(build_rollup_table_statement(fact, resolution))
+                )
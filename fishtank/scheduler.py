@@ -0,0 +1,78 @@
+"""
+A small two stage pipeline for our loaders. Fetching a unit of work (e.g.
+a month of Earth Engine pixels) is slow and mostly waiting on the network,
+so fetches run concurrently on a bounded thread pool. Transforming and
+writing a fetched unit happens on the calling thread, one unit at a time,
+while the next fetches are already in flight.
+
+At most `max_workers + max_pending` units are fetched or waiting to be
+processed at any time, so a slow database applies backpressure to the
+fetches rather than piling results up in memory.
+"""
+
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+def fetch_with_retry(fetch, unit, retries=2, retry_delay=1.0):
+    """
+    Calls `fetch(unit)`, retrying with exponential backoff
+    """
+    for attempt in range(retries + 1):
+        try:
+            return fetch(unit)
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(retry_delay * 2**attempt)
+
+
+def run_pipeline(
+    units,
+    fetch,
+    process,
+    max_workers=4,
+    max_pending=None,
+    retries=2,
+    retry_delay=1.0,
+):
+    """
+    Runs `fetch(unit)` concurrently and `process(unit, fetched)` on the
+    calling thread as fetches complete.
+
+    A unit whose fetch still fails after `retries` retries is skipped.
+    Returns the list of (unit, exception) for those units. Errors raised by
+    `process` are not caught.
+    """
+    max_pending = max_workers if max_pending is None else max_pending
+    units = iter(units)
+    failures = []
+
+    executor = ThreadPoolExecutor(max_workers)
+    pending = {}
+
+    def submit_next():
+        for unit in units:
+            future = executor.submit(
+                fetch_with_retry, fetch, unit, retries, retry_delay
+            )
+            pending[future] = unit
+            return
+
+    try:
+        for _ in range(max_workers + max_pending):
+            submit_next()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                unit = pending.pop(future)
+                try:
+                    fetched = future.result()
+                except Exception as e:
+                    failures.append((unit, e))
+                else:
+                    process(unit, fetched)
+                submit_next()
+    finally:
+        executor.shutdown(cancel_futures=True)
+    return failures
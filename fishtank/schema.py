@@ -0,0 +1,507 @@
+"""
+Explicit definitions of our dimension and fact tables.
+
+Tables used to be created implicitly by `to_sql` which left them without
+primary keys or indexes. Here every dimension gets a primary key on its
+key, facts get btree indexes on their dimension keys and the big tag time
+series is range partitioned by date_key (a partition per year). Hex
+boundaries are stored as PostGIS polygons with a GiST index.
+
+`ensure_schema` is idempotent, it creates whatever is missing (tables,
+indexes, and on tables created before this module existed primary keys
+and columns) and leaves everything else alone, so loaders can call it
+before every run. Rows duplicating a key are dropped before the key is
+added. A tag_data created before it was partitioned has its
+rows moved into the partitioned table the first time.
+
+Every coarse h3 key of a fact is the parent of its finest key, rows
+loaded when the coarse keys were hashed from the coordinates are re-keyed
+once (adding the parent cells to the dimension and rebuilding the coarse
+rollups). Re-keyed columns are marked with a comment.
+"""
+
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+from geoalchemy2 import Geometry
+
+from fishtank.db import get_engine
+from fishtank.dimensions.dates import date_table
+from fishtank.dimensions.spatial import (
+    H3_RESOLUTIONS,
+    H3_TABLE_PREFIX,
+    build_spatial_dimension,
+    get_parent_key_sql,
+    get_spatial_keys,
+)
+from fishtank.ledger import LEDGER_TABLE
+from fishtank.profiles import (
+    PROFILE_TABLE,
+    get_depth_bin_columns,
+    get_quantile_columns,
+)
+from fishtank.rollups import ROLLUP_MEASURES, build_rollup_statements
+
+metadata = sa.MetaData()
+
+NESTED_KEY_COMMENT = f"parent of h3_key_{max(H3_RESOLUTIONS)}"
+
+
+def h3_key_columns():
+    return [
+        sa.Column(
+            f"h3_key_{resolution}",
+            sa.BigInteger,
+            comment=None if resolution == max(H3_RESOLUTIONS) else NESTED_KEY_COMMENT,
+        )
+        for resolution in H3_RESOLUTIONS
+    ]
+
+
+def fact_indexes(name, spatial=True):
+    indexes = [sa.Index(f"ix_{name}_date_key", "date_key")]
+    if spatial:
+        indexes += [
+            sa.Index(f"ix_{name}_h3_key_{resolution}", f"h3_key_{resolution}")
+            for resolution in H3_RESOLUTIONS
+        ]
+    return indexes
+
+
+dates = date_table.to_metadata(metadata)
+
+spatial_tables = {}
+for resolution in H3_RESOLUTIONS:
+    spatial_tables[resolution] = sa.Table(
+        f"{H3_TABLE_PREFIX}{resolution}",
+        metadata,
+        sa.Column(f"h3_key_{resolution}", sa.BigInteger, primary_key=True),
+        sa.Column("geometry", Geometry("POLYGON", srid=4326, spatial_index=False)),
+    )
+    sa.Index(
+        f"ix_{H3_TABLE_PREFIX}{resolution}_geometry",
+        spatial_tables[resolution].c.geometry,
+        postgresql_using="gist",
+    )
+
+sea_surface_temperature = sa.Table(
+    "sea_surface_temperature",
+    metadata,
+    sa.Column("longitude", sa.Float),
+    sa.Column("latitude", sa.Float),
+    sa.Column("temperature_c", sa.Float),
+    *h3_key_columns(),
+    sa.Column("date", sa.DateTime),
+    sa.Column("date_key", sa.BigInteger),
+    *fact_indexes("sea_surface_temperature"),
+)
+
+primary_productivity = sa.Table(
+    "primary_productivity",
+    metadata,
+    sa.Column("longitude", sa.Float),
+    sa.Column("latitude", sa.Float),
+    sa.Column("log_chla_ave", sa.Float),
+    *h3_key_columns(),
+    sa.Column("date", sa.DateTime),
+    sa.Column("date_key", sa.BigInteger),
+    *fact_indexes("primary_productivity"),
+)
+
+tag_tracks = sa.Table(
+    "tag_tracks",
+    metadata,
+    sa.Column("ptt", sa.Text),
+    sa.Column("latitude", sa.Float),
+    sa.Column("longitude", sa.Float),
+    sa.Column("date_key", sa.BigInteger),
+    *h3_key_columns(),
+    sa.Index("ix_tag_tracks_ptt", "ptt"),
+    *fact_indexes("tag_tracks"),
+)
+
+tag_tracks_enriched = sa.Table(
+    "tag_tracks_enriched",
+    metadata,
+    sa.Column("ptt", sa.Text),
+    sa.Column("latitude", sa.Float),
+    sa.Column("longitude", sa.Float),
+    sa.Column("date_key", sa.BigInteger),
+    *h3_key_columns(),
+    sa.Column("temperature_c", sa.Float),
+    sa.Column("temperature_c_match", sa.Text),
+    sa.Column("log_chla_ave", sa.Float),
+    sa.Column("log_chla_ave_match", sa.Text),
+    sa.Index("ix_tag_tracks_enriched_ptt", "ptt"),
+    *fact_indexes("tag_tracks_enriched"),
+)
+
+tag_context = sa.Table(
+    "tag_context",
+    metadata,
+    sa.Column("ptt", sa.Text, primary_key=True),
+    sa.Column("tag_model", sa.Text),
+    sa.Column("time_resolution_min", sa.Float),
+    sa.Column("fork_length_cm", sa.Float),
+    sa.Column("deploy_latitude", sa.Float),
+    sa.Column("deploy_longitude", sa.Float),
+    sa.Column("end_latitude", sa.Float),
+    sa.Column("end_longitude", sa.Float),
+    sa.Column("hypothetical_data_retrieved", sa.Text),
+    sa.Column("data_type", sa.Text),
+    sa.Column("deploy_date", sa.DateTime),
+    sa.Column("end_date", sa.DateTime),
+    sa.Column("region", sa.Text),
+)
+
+tag_data = sa.Table(
+    "tag_data",
+    metadata,
+    sa.Column("ptt", sa.Text),
+    sa.Column("depth_m", sa.Float),
+    sa.Column("temperature_c", sa.Float),
+    sa.Column("datetime", sa.DateTime),
+    sa.Column("date_key", sa.BigInteger),
+    sa.Index("ix_tag_data_ptt_datetime", "ptt", "datetime"),
+    *fact_indexes("tag_data", spatial=False),
+    postgresql_partition_by="RANGE (date_key)",
+)
+
+tag_daily_profiles = sa.Table(
+    PROFILE_TABLE,
+    metadata,
+    sa.Column("ptt", sa.Text, primary_key=True),
+    sa.Column("date_key", sa.BigInteger, primary_key=True),
+    sa.Column("count", sa.BigInteger),
+    *[sa.Column(column, sa.Float) for column in get_quantile_columns()],
+    sa.Column("temperature_c_mean", sa.Float),
+    sa.Column("temperature_c_min", sa.Float),
+    sa.Column("temperature_c_max", sa.Float),
+    *[sa.Column(column, sa.Float) for column in get_depth_bin_columns()],
+    *fact_indexes(PROFILE_TABLE, spatial=False),
+)
+
+load_ledger = sa.Table(
+    LEDGER_TABLE,
+    metadata,
+    sa.Column("source", sa.Text, nullable=False),
+    sa.Column("window_start", sa.BigInteger, nullable=False),
+    sa.Column("window_end", sa.BigInteger, nullable=False),
+    sa.Column("resolution", sa.Integer),
+    sa.Column("row_count", sa.BigInteger),
+    sa.Column("checksum", sa.Text),
+    sa.Column("loaded_at", sa.DateTime),
+    sa.Index(f"ix_{LEDGER_TABLE}_source_window", "source", "window_start"),
+)
+
+
+def get_year_partitions(table, date_keys):
+    """
+    Returns (partition, start_key, end_key) for every year the date keys
+    fall in
+    """
+    years = np.unique(
+        np.asarray(list(date_keys), dtype=np.int64)
+        .astype("datetime64[s]")
+        .astype("datetime64[Y]")
+    )
+    return [
+        (
+            f"{table}_y{year}",
+            int(year.astype("datetime64[s]").astype(np.int64)),
+            int((year + 1).astype("datetime64[s]").astype(np.int64)),
+        )
+        for year in years
+    ]
+
+
+def create_partitions(connection, table, date_keys):
+    for partition, start, end in get_year_partitions(table, date_keys):
+        connection.exec_driver_sql(
+            f"create table if not exists {partition} "
+            f"partition of {table} for values from ({start}) to ({end})"
+        )
+
+
+def ensure_partitions(table, date_keys, engine=None):
+    """
+    Creates the yearly partitions of `table` needed to hold the date keys
+    """
+    engine = get_engine() if engine is None else engine
+    with engine.begin() as connection:
+        create_partitions(connection, table, date_keys)
+
+
+def migrate_spatial_geometry(connection):
+    """
+    Converts h3 tables that still hold their boundaries as text (WKT, or
+    hex EWKB if `to_sql` created the table) to PostGIS polygons, in place
+    """
+    inspector = sa.inspect(connection)
+    for resolution, table in spatial_tables.items():
+        if not inspector.has_table(table.name):
+            continue
+        columns = {
+            column["name"]: column for column in inspector.get_columns(table.name)
+        }
+        if not isinstance(columns["geometry"]["type"], sa.Text):
+            continue
+        # the old expression index over the text can't survive the change
+        connection.exec_driver_sql(
+            f"drop index if exists ix_{H3_TABLE_PREFIX}{resolution}_geometry"
+        )
+        connection.exec_driver_sql(
+            f"alter table {table.name} alter column geometry "
+            f"type geometry(Polygon, 4326) using st_setsrid(geometry::geometry, 4326)"
+        )
+
+
+def is_partitioned(connection, name):
+    return connection.execute(
+        sa.text("select relkind = 'p' from pg_class where oid = to_regclass(:name)"),
+        {"name": name},
+    ).scalar()
+
+
+def migrate_unpartitioned_tables(connection):
+    """
+    Moves the rows of tables that should be partitioned but were created
+    by `to_sql` (like the old tag_data) into the declared partitioned
+    table, which only has to happen once
+    """
+    inspector = sa.inspect(connection)
+    for table in metadata.sorted_tables:
+        if table.dialect_options["postgresql"]["partition_by"] is None:
+            continue
+        if not inspector.has_table(table.name) or is_partitioned(
+            connection, table.name
+        ):
+            continue
+
+        existing = set(column["name"] for column in inspector.get_columns(table.name))
+        columns = ", ".join(
+            column.name for column in table.columns if column.name in existing
+        )
+        legacy = f"{table.name}_legacy"
+        connection.exec_driver_sql(f"alter table {table.name} rename to {legacy}")
+        # indexes keep their names when their table is renamed
+        for index in table.indexes:
+            connection.exec_driver_sql(f"drop index if exists {index.name}")
+        table.create(connection)
+
+        date_keys = connection.execute(
+            sa.text(f"select distinct date_key from {legacy}")
+        ).scalars()
+        create_partitions(connection, table.name, list(date_keys))
+        connection.exec_driver_sql(
+            f"insert into {table.name} ({columns}) select {columns} from {legacy}"
+        )
+        connection.exec_driver_sql(f"drop table {legacy}")
+
+
+def backfill_spatial_keys(connection, table):
+    """
+    Fills in the h3 keys of the rows of a table that have coordinates but
+    no keys, hashing each distinct location once
+    """
+    key_cols = [f"h3_key_{resolution}" for resolution in H3_RESOLUTIONS]
+    locations = pd.read_sql(
+        sa.text(f"""
+            select distinct
+                latitude,
+                longitude
+            from
+                {table}
+            where
+                {key_cols[-1]} is null
+                and latitude is not null
+                and longitude is not null
+            """),
+        connection,
+    )
+    if locations.shape[0] == 0:
+        return 0
+
+    spatial_keys = get_spatial_keys(
+        locations["latitude"].to_numpy(),
+        locations["longitude"].to_numpy(),
+        nested=True,
+    )
+    parameters = {
+        "latitudes": locations["latitude"].tolist(),
+        "longitudes": locations["longitude"].tolist(),
+    }
+    arrays = [
+        "cast(:latitudes as double precision[])",
+        "cast(:longitudes as double precision[])",
+    ]
+    for resolution, key_col in zip(H3_RESOLUTIONS, key_cols):
+        parameters[key_col] = spatial_keys[resolution].tolist()
+        arrays.append(f"cast(:{key_col} as bigint[])")
+    assignments = ", ".join(f"{key_col} = k.{key_col}" for key_col in key_cols)
+    connection.execute(
+        sa.text(f"""
+            update {table} t
+            set {assignments}
+            from unnest({", ".join(arrays)})
+                as k(latitude, longitude, {", ".join(key_cols)})
+            where
+                t.latitude = k.latitude
+                and t.longitude = k.longitude
+            """),
+        parameters,
+    )
+    return locations.shape[0]
+
+
+def add_missing_columns(connection):
+    """
+    Adds the declared columns a table created by `to_sql` doesn't have (the
+    old tagging loader never keyed tracks for instance) and backfills the
+    h3 keys of rows that have coordinates
+    """
+    inspector = sa.inspect(connection)
+    for table in metadata.sorted_tables:
+        existing = set(column["name"] for column in inspector.get_columns(table.name))
+        missing = [column for column in table.columns if column.name not in existing]
+        for column in missing:
+            connection.exec_driver_sql(
+                f"alter table {table.name} add column {column.name} "
+                f"{column.type.compile(dialect=connection.dialect)}"
+            )
+        missing_names = set(column.name for column in missing)
+        if (
+            missing_names & set(f"h3_key_{r}" for r in H3_RESOLUTIONS)
+            and "latitude" in existing
+            and "longitude" in existing
+        ):
+            backfill_spatial_keys(connection, table.name)
+
+
+def add_missing_cells(connection, table, resolution):
+    """
+    Adds the cells a table's h3 keys at a resolution point at but the
+    dimension doesn't have, returning how many were added
+    """
+    key_col = f"h3_key_{resolution}"
+    dimension = spatial_tables[resolution].name
+    keys = connection.execute(sa.text(f"""
+                select distinct
+                    {key_col}
+                from
+                    {table} t
+                where
+                    {key_col} != 0
+                    and not exists (
+                        select 1 from {dimension} d where d.{key_col} = t.{key_col}
+                    )
+                """)).scalars().all()
+    if len(keys) == 0:
+        return 0
+
+    cells = build_spatial_dimension(keys, resolution)
+    connection.execute(
+        sa.text(f"""
+            insert into {dimension} ({key_col}, geometry)
+            select
+                key,
+                st_geomfromtext(boundary, 4326)
+            from
+                unnest(cast(:keys as bigint[]), cast(:boundaries as text[]))
+                    as c(key, boundary)
+            on conflict do nothing
+            """),
+        {
+            "keys": cells[key_col].tolist(),
+            "boundaries": cells["geometry"].to_wkt().tolist(),
+        },
+    )
+    return len(keys)
+
+
+def migrate_nested_keys(connection):
+    """
+    Re-keys the coarse h3 keys that were hashed from the coordinates to be
+    the parents of the finest key, adds the parent cells the dimension is
+    missing and rebuilds the coarse rollups of the facts that changed
+    """
+    finest = f"h3_key_{max(H3_RESOLUTIONS)}"
+    inspector = sa.inspect(connection)
+    for table in metadata.sorted_tables:
+        nested = [
+            resolution
+            for resolution in H3_RESOLUTIONS
+            if f"h3_key_{resolution}" in table.columns
+            and table.columns[f"h3_key_{resolution}"].comment == NESTED_KEY_COMMENT
+        ]
+        if not nested:
+            continue
+        comments = {
+            column["name"]: column.get("comment")
+            for column in inspector.get_columns(table.name)
+        }
+        for resolution in nested:
+            key_col = f"h3_key_{resolution}"
+            if comments[key_col] == NESTED_KEY_COMMENT:
+                continue
+            parent = get_parent_key_sql(finest, resolution)
+            connection.exec_driver_sql(
+                f"update {table.name} set {key_col} = {parent} "
+                f"where {finest} is not null and {key_col} is distinct from {parent}"
+            )
+            connection.exec_driver_sql(
+                f"comment on column {table.name}.{key_col} "
+                f"is '{NESTED_KEY_COMMENT}'"
+            )
+            add_missing_cells(connection, table.name, resolution)
+            if table.name in ROLLUP_MEASURES:
+                for statement in build_rollup_statements(table.name, resolution):
+                    connection.execute(sa.text(statement))
+
+
+def remove_duplicate_keys(connection, table, key_cols):
+    """
+    Deletes all but one row of each key, which a table written without a
+    primary key (so its upserts never conflicted) can have many of
+    """
+    matches = " and ".join(f"a.{key} = b.{key}" for key in key_cols)
+    connection.exec_driver_sql(
+        f"delete from {table} a using {table} b where {matches} and a.ctid < b.ctid"
+    )
+
+
+def ensure_schema(engine=None):
+    engine = get_engine() if engine is None else engine
+    with engine.begin() as connection:
+        connection.exec_driver_sql("create extension if not exists postgis")
+        migrate_spatial_geometry(connection)
+        migrate_unpartitioned_tables(connection)
+        metadata.create_all(connection, checkfirst=True)
+
+        # tables created before this module existed, their columns have to
+        # be there before they can be indexed
+        add_missing_columns(connection)
+        migrate_nested_keys(connection)
+        inspector = sa.inspect(connection)
+        for table in metadata.sorted_tables:
+            primary_key = [column.name for column in table.primary_key.columns]
+            if (
+                primary_key
+                and not inspector.get_pk_constraint(table.name)["constrained_columns"]
+            ):
+                remove_duplicate_keys(connection, table.name, primary_key)
+                connection.exec_driver_sql(
+                    f"alter table {table.name} "
+                    f"add primary key ({', '.join(primary_key)})"
+                )
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+
+
+def recreate_table(connection, name):
+    """
+    Drops a table and creates it again from its definition, on a connection
+    so the new rows can be written in the same transaction
+    """
+    metadata.tables[name].drop(connection, checkfirst=True)
+    metadata.tables[name].create(connection)
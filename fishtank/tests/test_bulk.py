@@ -0,0 +1,99 @@
+import unittest
+import unittest.mock as mock
+import pandas as pd
+import geopandas as gpd
+from datetime import datetime
+from shapely.geometry import Point
+
+
+from fishtank.bulk import (
+    prepare_dataframe,
+    to_copy_buffer,
+    write_dataframe,
+)
+
+# Point(0, 1) with srid 4326
+POINT_EWKB = "0101000020E61000000000000000000000000000000000F03F"
+
+
+class TestPrepareDataframe(unittest.TestCase):
+    def test_geometry(self):
+        dataframe = gpd.GeoDataFrame(
+            [{"key": 1, "geometry": Point(0, 1)}, {"key": 2, "geometry": Point(2, 3)}]
+        )
+        results = prepare_dataframe(dataframe)
+        assert results["geometry"][0] == POINT_EWKB
+
+    def test_shapely_objects(self):
+        dataframe = pd.DataFrame([{"key": 1, "shape": Point(0, 1)}, {"key": 2}])
+        results = prepare_dataframe(dataframe)
+        assert results["shape"][0] == POINT_EWKB
+        assert pd.isna(results["shape"][1])
+
+
+class TestToCopyBuffer(unittest.TestCase):
+    def test_base_case(self):
+        dataframe = pd.DataFrame(
+            [
+                {"date": datetime(1970, 1, 2, 3, 4, 5), "fact": "a, cool fact"},
+                {"date": None, "fact": None},
+            ]
+        )
+        buffer = to_copy_buffer(dataframe)
+        assert buffer.read().splitlines() == [
+            '1970-01-02 03:04:05.000000,"a, cool fact"',
+            "\\N,\\N",
+        ]
+
+
+class TestWriteDataframe(unittest.TestCase):
+    def setUp(self):
+        self.dataframe = pd.DataFrame([{"key": key, "value": 1.0} for key in range(5)])
+        self.engine = mock.MagicMock()
+        self.transaction = self.engine.begin.return_value
+        self.connection = self.transaction.__enter__.return_value
+        self.cursor = self.connection.connection.cursor.return_value
+
+    def test_chunks(self):
+        with mock.patch("pandas.DataFrame.to_sql") as to_sql:
+            rows = write_dataframe(
+                self.dataframe, "facts", chunksize=2, engine=self.engine
+            )
+        assert rows == 5
+        # the table is created in the same transaction as the copy
+        assert to_sql.call_args[0][1] is self.connection
+        assert self.cursor.copy_expert.call_count == 3
+        assert self.cursor.copy_expert.call_args[0][0].startswith(
+            'copy "facts" ("key","value") from stdin'
+        )
+        self.transaction.__exit__.assert_called_once_with(None, None, None)
+
+    def test_upsert(self):
+        with mock.patch("pandas.DataFrame.to_sql"):
+            write_dataframe(
+                self.dataframe, "facts", upsert_keys=["key"], engine=self.engine
+            )
+        statements = [call[0][0] for call in self.cursor.execute.call_args_list]
+        assert "create temporary table" in statements[0]
+        assert 'copy "facts_staging"' in self.cursor.copy_expert.call_args[0][0]
+        assert 'where t."key" = s."key"' in statements[1]
+        assert "on conflict do nothing" in statements[1]
+        assert statements[2] == 'drop table "facts_staging"'
+
+    def test_rollback(self):
+        self.cursor.copy_expert.side_effect = RuntimeError()
+        with mock.patch("pandas.DataFrame.to_sql"):
+            with self.assertRaises(RuntimeError):
+                write_dataframe(self.dataframe, "facts", engine=self.engine)
+        assert self.transaction.__exit__.call_args[0][0] is RuntimeError
+
+    def test_connection(self):
+        connection = mock.MagicMock()
+        with mock.patch("pandas.DataFrame.to_sql"):
+            rows = write_dataframe(
+                self.dataframe, "facts", engine=self.engine, connection=connection
+            )
+        assert rows == 5
+        connection.connection.cursor.return_value.copy_expert.assert_called_once()
+        # the caller's transaction, nothing is committed here
+        self.engine.begin.assert_not_called()
@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+import unittest.mock as mock
+import numpy as np
+import pandas as pd
+
+
+from fishtank.cache import get_cache_key, FetchCache
+
+PARAMS = {"collection": "a", "bands": ["b"], "region": (-179, 34, -120, 79)}
+
+
+class TestGetCacheKey(unittest.TestCase):
+    def test_order(self):
+        assert get_cache_key({"a": 1, "b": 2}) == get_cache_key({"b": 2, "a": 1})
+
+    def test_params(self):
+        assert get_cache_key({"a": 1}) != get_cache_key({"a": 2})
+
+
+class TestFetchCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = FetchCache(self.directory.name)
+        self.dataframe = pd.DataFrame(
+            {
+                "id": np.array(["x", "yy"], dtype=object),
+                "time": np.array([1, 2], dtype=np.int64),
+                "band": [0.5, np.nan],
+            }
+        )
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        assert self.cache.get(PARAMS) is None
+        self.cache.put(PARAMS, self.dataframe)
+        results = self.cache.get(PARAMS)
+        assert list(results.columns) == ["id", "time", "band"]
+        assert list(results["id"]) == ["x", "yy"]
+        assert results["time"].dtype == np.int64
+        assert np.isnan(results["band"][1])
+
+    def test_memory_mapped(self):
+        self.cache.put(PARAMS, self.dataframe)
+        results = self.cache.get(PARAMS)
+        for column in ["time", "band"]:
+            array = results[column].to_numpy()
+            while not isinstance(array, np.memmap):
+                assert array.base is not None
+                array = array.base
+
+        # copy on write, the entry itself doesn't change
+        results.loc[0, "band"] = 2.0
+        assert self.cache.get(PARAMS)["band"][0] == 0.5
+
+    def test_fetch(self):
+        fetch = mock.MagicMock(return_value=self.dataframe)
+        self.cache.fetch(PARAMS, fetch)
+        results = self.cache.fetch(PARAMS, fetch)
+        assert fetch.call_count == 1
+        assert results.shape == (2, 3)
+
+    def test_evicts_least_recently_used(self):
+        for i in range(3):
+            self.cache.put(dict(PARAMS, scale=i), self.dataframe)
+            path = os.path.join(
+                self.directory.name, get_cache_key(dict(PARAMS, scale=i))
+            )
+            os.utime(path, (i, i))
+        entry_size = sum(entry.stat().st_size for entry in os.scandir(path))
+        self.cache.max_bytes = 2 * entry_size
+        self.cache.evict()
+        assert self.cache.get(dict(PARAMS, scale=0)) is None
+        assert self.cache.get(dict(PARAMS, scale=2)) is not None
@@ -0,0 +1,118 @@
+import subprocess
+import sys
+import unittest
+import unittest.mock as mock
+from datetime import datetime
+
+
+from fishtank.cli import get_parser, main
+
+# imported up front, patch.dict(sys.modules) would otherwise drop whatever
+# the commands import lazily (numpy included) after each test
+import fishtank.parallel  # noqa: F401
+
+
+class TestParser(unittest.TestCase):
+    def test_earth_engine_loader(self):
+        args = get_parser().parse_args(
+            ["primary-productivity", "--start", "2018-02-15", "--scale", "5000"]
+        )
+        assert args.loader == "fishtank.loaders.primary_productivity"
+        assert args.start == datetime(2018, 2, 15)
+        assert args.end is None
+        assert args.scale == 5000
+
+    def test_required_dates(self):
+        with mock.patch("sys.stderr"), self.assertRaises(SystemExit):
+            get_parser().parse_args(["dates", "--start", "2018-01-01"])
+
+
+class TestMain(unittest.TestCase):
+    def test_loader_defaults(self):
+        loader = mock.MagicMock()
+        loader.load_months.return_value = 10
+        with mock.patch.dict(
+            sys.modules,
+            {"fishtank.loaders.temperature": loader, "ee": mock.MagicMock()},
+        ), mock.patch("builtins.print"):
+            assert main(["temperature", "--end", "2018-03-15"]) == 0
+        # only what was given is passed on, the loader has the defaults
+        loader.load_months.assert_called_once_with(end=datetime(2018, 3, 15))
+
+    def test_tagging(self):
+        with mock.patch(
+            "fishtank.loaders.tagging.load_tagging", return_value=3
+        ) as load_tagging, mock.patch("builtins.print"):
+            main(["tagging", "--tracks", "tracks.csv"])
+        load_tagging.assert_called_once_with(tracks_path="tracks.csv")
+
+    def test_dates(self):
+        events = []
+        with mock.patch(
+            "fishtank.dimensions.dates.ensure_date_table",
+            side_effect=lambda: events.append("ensure_date_table"),
+        ), mock.patch(
+            "fishtank.dimensions.dates.load_date_dimension",
+            side_effect=lambda start, end: events.append("dates") or 2,
+        ), mock.patch(
+            "builtins.print"
+        ):
+            main(["dates", "--start", "2018-01-01", "--end", "2018-01-02"])
+        # the dates table exists before it's filled
+        assert events == ["ensure_date_table", "dates"]
+
+    def test_load_all(self):
+        loaders = {}
+        for name in ["temperature", "primary_productivity"]:
+            loader = mock.MagicMock(START=datetime(2018, 1, 15))
+            loader.END = datetime(2018, 4, 15)
+            loaders[f"fishtank.loaders.{name}"] = loader
+        with mock.patch.dict(
+            sys.modules, dict(loaders, ee=mock.MagicMock())
+        ), mock.patch(
+            "fishtank.parallel.run_jobs", return_value=([], 1.0)
+        ) as run_jobs, mock.patch(
+            "fishtank.enrichment.read_tracks"
+        ) as read_tracks, mock.patch(
+            "fishtank.enrichment.load_enriched_tracks", return_value=5
+        ) as load_enriched_tracks, mock.patch(
+            "builtins.print"
+        ):
+            main(["load-all", "--workers", "4", "--scale", "1000"])
+        jobs, workers = run_jobs.call_args[0]
+        assert workers == 4
+        assert jobs[0] == ("fishtank.loaders.tagging:load_tagging", {"enrich": False})
+        # enriched once after the environment jobs are done
+        load_enriched_tracks.assert_called_once_with(read_tracks.return_value)
+        # each earth engine loader gets half the workers' worth of months
+        monthly = [kwargs for target, kwargs in jobs[1:]]
+        assert len(monthly) == 4
+        assert all(kwargs["scale"] == 1000 for kwargs in monthly)
+        assert monthly[0]["start"] == datetime(2018, 1, 15)
+        assert monthly[1]["end"] == datetime(2018, 4, 15)
+
+
+class TestStartup(unittest.TestCase):
+    def test_lazy_imports(self):
+        # a fresh interpreter, the test run has imported everything already
+        code = (
+            "import sys, fishtank.cli; "
+            "print(any(m in sys.modules for m in "
+            "['pandas', 'sqlalchemy', 'geopandas', 'h3', 'ee']))"
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        )
+        assert output.stdout.strip() == "False"
+
+    def test_dates_imports(self):
+        # what the dates command imports, without the spatial stack
+        code = (
+            "import sys, fishtank.cli, fishtank.dimensions.dates; "
+            "print(any(m in sys.modules for m in "
+            "['h3', 'shapely', 'geoalchemy2', 'geopandas', 'fishtank.schema']))"
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        )
+        assert output.stdout.strip() == "False"
@@ -0,0 +1,60 @@
+import os
+import unittest
+import unittest.mock as mock
+
+
+from fishtank.db import (
+    get_engine,
+    get_engine_config,
+    dispose_engine,
+    get_pool_stats,
+    pool_stats,
+    DEFAULT_DATABASE_URL,
+)
+
+
+class TestGetEngineConfig(unittest.TestCase):
+    def test_defaults(self):
+        with mock.patch.dict(os.environ, {}, clear=True):
+            url, config = get_engine_config()
+        assert url == DEFAULT_DATABASE_URL
+        assert config["pool_size"] == 5
+        assert config["connect_args"] == {"connect_timeout": 10}
+
+    def test_environment(self):
+        environment = {
+            "FISHTANK_DATABASE_URL": "sqlite:///fishtank.db",
+            "FISHTANK_POOL_SIZE": "2",
+            "FISHTANK_POOL_TIMEOUT": "1.5",
+        }
+        with mock.patch.dict(os.environ, environment, clear=True):
+            url, config = get_engine_config()
+        assert url == "sqlite:///fishtank.db"
+        assert config["pool_size"] == 2
+        assert config["pool_timeout"] == 1.5
+        assert "connect_args" not in config
+
+
+class TestGetEngine(unittest.TestCase):
+    def setUp(self):
+        dispose_engine()
+        pool_stats.reset()
+
+    def tearDown(self):
+        dispose_engine()
+
+    def test_reused(self):
+        with mock.patch.dict(os.environ, {"FISHTANK_DATABASE_URL": "sqlite://"}):
+            engine = get_engine()
+            assert get_engine() is engine
+            for _ in range(3):
+                with engine.connect():
+                    pass
+        assert get_pool_stats()["checkouts"] == 3
+        assert engine.pool.checkedout() == 0
+
+    def test_dispose(self):
+        with mock.patch.dict(os.environ, {"FISHTANK_DATABASE_URL": "sqlite://"}):
+            engine = get_engine()
+            dispose_engine()
+            assert get_engine() is not engine
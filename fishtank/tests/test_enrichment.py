@@ -0,0 +1,153 @@
+import unittest
+import unittest.mock as mock
+import h3
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+from psycopg2.errors import UndefinedTable
+
+
+from fishtank.dimensions.spatial import spatial_index_to_key, spatial_key_to_index
+from fishtank.enrichment import (
+    FactIndex,
+    lookup_neighbours,
+    enrich_tracks,
+    load_enriched_tracks,
+    read_fact_index,
+)
+
+DAY = 86400
+LAT, LON = 50.0, -150.0
+CELL = spatial_index_to_key(h3.geo_to_h3(LAT, LON, 4))
+PARENT = spatial_index_to_key(h3.h3_to_parent(h3.geo_to_h3(LAT, LON, 4), 2))
+NEIGHBOURS = [
+    spatial_index_to_key(h3_index)
+    for h3_index in h3.k_ring(spatial_key_to_index(CELL), 1)
+    if spatial_index_to_key(h3_index) != CELL
+]
+
+
+class TestFactIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = FactIndex(
+            [2, 1, 1, 1], [0, 30 * DAY, 0, 60 * DAY], [5.0, 2.0, 1.0, 3.0]
+        )
+
+    def test_nearest_date(self):
+        results = self.index.lookup(
+            [1, 1, 1, 1, 2], [-DAY, 14 * DAY, 16 * DAY, 90 * DAY, 0]
+        )
+        assert list(results) == [1.0, 1.0, 2.0, 3.0, 5.0]
+
+    def test_missing_cell(self):
+        assert np.isnan(self.index.lookup([3], [0])).all()
+
+    def test_max_days(self):
+        results = self.index.lookup([1, 1], [100 * DAY, 10 * DAY], max_days=31)
+        assert np.isnan(results[0])
+        assert results[1] == 1.0
+
+
+class TestLookupNeighbours(unittest.TestCase):
+    def test_mean(self):
+        index = FactIndex(NEIGHBOURS[:2] + [CELL], [0, 0, 0], [1.0, 3.0, 100.0])
+        results = lookup_neighbours(index, [CELL, CELL, 0], [0, 0, 0])
+        assert list(results[:2]) == [2.0, 2.0]
+        assert np.isnan(results[2])
+
+
+class TestEnrichTracks(unittest.TestCase):
+    def setUp(self):
+        self.tracks = pd.DataFrame(
+            {"latitude": [LAT] * 3, "longitude": [LON] * 3, "date_key": [0, DAY, 0]}
+        )
+
+    def enrich(self, index, parent_index):
+        return enrich_tracks(
+            self.tracks,
+            {"sea_surface_temperature": {4: index, 2: parent_index}},
+            4,
+            2,
+        )
+
+    def test_cell(self):
+        results = self.enrich(FactIndex([CELL], [0], [10.0]), FactIndex([], [], []))
+        assert list(results["temperature_c"]) == [10.0] * 3
+        assert list(results["temperature_c_match"]) == ["cell"] * 3
+        assert (results["h3_key_4"] == CELL).all()
+
+    def test_fallbacks(self):
+        index = FactIndex([NEIGHBOURS[0]], [0], [7.0])
+        results = self.enrich(index, FactIndex([PARENT], [0], [4.0]))
+        assert list(results["temperature_c"]) == [7.0] * 3
+        assert list(results["temperature_c_match"]) == ["neighbours"] * 3
+
+        results = self.enrich(FactIndex([], [], []), FactIndex([PARENT], [0], [4.0]))
+        assert list(results["temperature_c_match"]) == ["parent"] * 3
+
+    def test_no_match(self):
+        results = self.enrich(FactIndex([], [], []), FactIndex([], [], []))
+        assert results["temperature_c"].isna().all()
+        assert results["temperature_c_match"].isna().all()
+
+
+class TestLoadEnrichedTracks(unittest.TestCase):
+    def test_batches(self):
+        tracks = pd.DataFrame(
+            {
+                "ptt": ["1"] * 5,
+                "latitude": [LAT] * 5,
+                "longitude": [LON] * 5,
+                "date_key": [0] * 5,
+            }
+        )
+        index = FactIndex([CELL], [0], [1.0])
+        with mock.patch("fishtank.enrichment.get_engine") as get_engine, mock.patch(
+            "fishtank.enrichment.read_fact_index", return_value=index
+        ) as read_fact_index, mock.patch(
+            "fishtank.enrichment.recreate_table"
+        ) as recreate_table, mock.patch(
+            "fishtank.enrichment.write_dataframe",
+            side_effect=lambda dataframe, table, connection: dataframe.shape[0],
+        ) as write_dataframe:
+            rows = load_enriched_tracks(tracks, batch_size=2)
+        assert rows == 5
+        assert write_dataframe.call_count == 3
+        # the table is replaced and every batch written in one transaction
+        connection = get_engine.return_value.begin.return_value.__enter__.return_value
+        recreate_table.assert_called_once_with(connection, "tag_tracks_enriched")
+        assert all(
+            call[1]["connection"] is connection
+            for call in write_dataframe.call_args_list
+        )
+        assert set(call[0][1] for call in read_fact_index.call_args_list) == {2, 4}
+        written = write_dataframe.call_args[0][0]
+        assert list(written["log_chla_ave_match"]) == ["cell"]
+
+    def test_no_rollups(self):
+        # tags loaded before any environment data
+        tracks = pd.DataFrame(
+            {"ptt": ["1"], "latitude": [LAT], "longitude": [LON], "date_key": [0]}
+        )
+        missing = sa.exc.ProgrammingError("select", {}, UndefinedTable())
+        with mock.patch("fishtank.enrichment.get_engine"), mock.patch(
+            "pandas.read_sql", side_effect=missing
+        ), mock.patch("fishtank.enrichment.recreate_table"), mock.patch(
+            "fishtank.enrichment.write_dataframe",
+            side_effect=lambda dataframe, table, connection: dataframe.shape[0],
+        ) as write_dataframe:
+            assert load_enriched_tracks(tracks) == 1
+        written = write_dataframe.call_args[0][0]
+        assert written["temperature_c"].isna().all()
+        assert written["log_chla_ave_match"].isna().all()
+
+
+class TestReadFactIndex(unittest.TestCase):
+    def test_rollup(self):
+        rollup = pd.DataFrame(
+            {"h3_key_4": [CELL], "date_key": [0], "temperature_c_mean": [9.0]}
+        )
+        with mock.patch("pandas.read_sql", return_value=rollup) as read_sql:
+            index = read_fact_index("sea_surface_temperature", 4, engine=mock.Mock())
+        assert "from sea_surface_temperature_rollup_4" in read_sql.call_args[0][0]
+        assert list(index.lookup([CELL], [0])) == [9.0]
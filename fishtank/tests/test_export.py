@@ -0,0 +1,103 @@
+import os
+import tempfile
+import unittest
+import unittest.mock as mock
+import pandas as pd
+
+
+from fishtank.export import (
+    get_partition_path,
+    build_export_query,
+    read_manifest,
+    write_partitions,
+    export_fact,
+)
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+
+def make_batch(rows):
+    return pd.DataFrame(
+        [
+            {"year": year, "month": month, "h3_key_2": key, "value": value}
+            for year, month, key, value in rows
+        ]
+    )
+
+
+class TestBuildExportQuery(unittest.TestCase):
+    def test_joins(self):
+        sql = build_export_query("sea_surface_temperature")
+        assert "join dates d on d.date_key = f.date_key" in sql
+        assert "left join h3_resolution_4 h on h.h3_key_4 = f.h3_key_4" in sql
+        assert "order by\n        d.year, d.month, f.h3_key_2" in sql
+        assert "unnest" not in sql
+
+    def test_partitions(self):
+        sql = build_export_query("tag_tracks", [(2018, 1, 5)])
+        assert "(d.year, d.month, f.h3_key_2) in" in sql
+        # the fact's own date column comes from the dimension instead
+        assert 'f."date"' not in sql
+
+
+@unittest.skipIf(pq is None, "pyarrow isn't installed")
+class TestWritePartitions(unittest.TestCase):
+    def test_batches(self):
+        batches = [
+            make_batch([(2018, 1, 5, 1.0), (2018, 1, 5, 2.0)]),
+            make_batch([(2018, 1, 5, 3.0), (2018, 2, 5, None)]),
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            written = write_partitions(batches, directory)
+            assert written == {
+                get_partition_path(2018, 1, 5): 3,
+                get_partition_path(2018, 2, 5): 1,
+            }
+            table = pq.read_table(
+                os.path.join(directory, "year=2018/month=1/h3_key_2=5/part-0.parquet")
+            )
+            assert table.column_names == ["value"]
+            assert table.column("value").to_pylist() == [1.0, 2.0, 3.0]
+
+
+@unittest.skipIf(pq is None, "pyarrow isn't installed")
+class TestExportFact(unittest.TestCase):
+    def export(self, directory, fingerprints):
+        def stream_query(sql, parameters, batch_size, engine):
+            return [
+                make_batch(
+                    [
+                        (year, month, key, 1.0)
+                        for year, month, key in zip(
+                            parameters["years"],
+                            parameters["months"],
+                            parameters["spatial_keys"],
+                        )
+                    ]
+                )
+            ]
+
+        with mock.patch(
+            "fishtank.export.read_partition_fingerprints", return_value=fingerprints
+        ), mock.patch("fishtank.export.stream_query", side_effect=stream_query):
+            return export_fact("tag_tracks", directory)
+
+    def test_incremental(self):
+        with tempfile.TemporaryDirectory() as directory:
+            written = self.export(directory, {(2018, 1, 5): "1:1", (2018, 2, 5): "1:2"})
+            assert len(written) == 2
+
+            written = self.export(directory, {(2018, 1, 5): "1:1", (2018, 2, 5): "1:3"})
+            assert list(written) == [get_partition_path(2018, 2, 5)]
+
+            written = self.export(directory, {(2018, 1, 5): "1:1"})
+            assert written == {}
+            assert not os.path.exists(
+                os.path.join(directory, "tag_tracks", "year=2018/month=2")
+            )
+            assert read_manifest(os.path.join(directory, "tag_tracks")) == {
+                get_partition_path(2018, 1, 5): "1:1"
+            }
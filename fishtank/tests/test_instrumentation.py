@@ -0,0 +1,105 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+import pandas as pd
+
+
+from fishtank.instrumentation import (
+    enable_instrumentation,
+    disable_instrumentation,
+    get_recorder,
+    stage,
+    instrument,
+    record_io,
+    count_rows,
+    export_metrics,
+)
+
+
+@instrument("double")
+def double(dataframe):
+    return pd.concat([dataframe, dataframe])
+
+
+class TestDisabled(unittest.TestCase):
+    def test_noop(self):
+        disable_instrumentation()
+        with stage("a", rows_in=1) as timer:
+            timer.rows_out = 2
+            record_io(round_trips=1)
+        assert double(pd.DataFrame({"a": [1]})).shape[0] == 2
+        assert get_recorder() is None
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.log = io.StringIO()
+        self.recorder = enable_instrumentation(self.log)
+
+    def tearDown(self):
+        disable_instrumentation()
+
+    def test_nested_stages(self):
+        with stage("outer", rows_in=10) as timer:
+            with stage("inner"):
+                record_io(round_trips=2, bytes_written=100)
+            timer.rows_out = 5
+        totals = self.recorder.get_totals()
+        assert totals["outer"]["calls"] == 1
+        assert totals["outer"]["rows_in"] == 10
+        assert totals["outer"]["rows_out"] == 5
+        assert totals["outer"]["round_trips"] == 2
+        assert totals["inner"]["bytes_written"] == 100
+        assert totals["outer"]["seconds"] >= totals["inner"]["seconds"]
+
+    def test_decorator(self):
+        double(pd.DataFrame({"a": [1, 2]}))
+        double(pd.DataFrame({"a": [1]}))
+        totals = self.recorder.get_totals()["double"]
+        assert totals["calls"] == 2
+        assert totals["rows_in"] == 3
+        assert totals["rows_out"] == 6
+
+    def test_add_totals(self):
+        with stage("a", rows_in=3):
+            pass
+        self.recorder.add_totals({"a": {"calls": 2, "rows_in": 4}, "b": {"calls": 1}})
+        totals = self.recorder.get_totals()
+        assert totals["a"]["calls"] == 3
+        assert totals["a"]["rows_in"] == 7
+        assert totals["b"]["calls"] == 1
+
+    def test_failure_logged(self):
+        with self.assertRaises(ValueError):
+            with stage("broken"):
+                raise ValueError()
+        event = json.loads(self.log.getvalue().splitlines()[-1])
+        assert event["stage"] == "broken"
+        assert event["failed"]
+
+    def test_export(self):
+        with stage("a", rows_in=3):
+            pass
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "metrics.prom")
+            export_metrics(path)
+            with open(path) as f:
+                contents = f.read()
+            assert 'fishtank_stage_rows_in_total{stage="a"} 3' in contents
+
+            path = os.path.join(directory, "metrics.json")
+            export_metrics(path)
+            with open(path) as f:
+                (line,) = f.read().splitlines()
+            assert json.loads(line)["stage"] == "a"
+
+
+class TestCountRows(unittest.TestCase):
+    def test_base_case(self):
+        assert count_rows(pd.DataFrame({"a": [1, 2]})) == 2
+        assert count_rows(7) == 7
+        assert count_rows({1, 2, 3}) == 3
+        assert count_rows(None) is None
+        assert count_rows(True) is None
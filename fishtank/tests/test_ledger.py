@@ -0,0 +1,74 @@
+import unittest
+import unittest.mock as mock
+import pandas as pd
+
+
+from fishtank.ledger import (
+    get_checksum,
+    record_load,
+    clear_window,
+    filter_new_rows,
+)
+
+
+class TestGetChecksum(unittest.TestCase):
+    def test_ignores_index(self):
+        dataframe = pd.DataFrame({"key": [1, 2], "value": [0.5, None]})
+        assert get_checksum(dataframe) == get_checksum(dataframe.set_axis([5, 6]))
+
+    def test_values(self):
+        dataframe = pd.DataFrame({"key": [1, 2]})
+        assert get_checksum(dataframe) != get_checksum(dataframe + 1)
+
+
+class TestRecordLoad(unittest.TestCase):
+    def test_replaces_unit(self):
+        engine = mock.MagicMock()
+        record_load("facts", 0, 86400, pd.DataFrame({"key": [1, 2]}), 4, engine)
+        connection = engine.begin.return_value.__enter__.return_value
+        (delete, unit), (insert, entry) = [
+            call[0] for call in connection.execute.call_args_list
+        ]
+        assert "delete from load_ledger" in str(delete)
+        assert "insert into load_ledger" in str(insert)
+        assert unit == {
+            "source": "facts",
+            "window_start": 0,
+            "window_end": 86400,
+            "resolution": 4,
+        }
+        assert entry["row_count"] == 2
+
+
+class TestClearWindow(unittest.TestCase):
+    def test_base_case(self):
+        engine = mock.MagicMock()
+        clear_window("facts", 0, 86400, engine=engine)
+        connection = engine.begin.return_value.__enter__.return_value
+        statement, parameters = connection.execute.call_args[0]
+        assert "delete from facts" in str(statement)
+        assert parameters == {"window_start": 0, "window_end": 86400}
+
+
+class TestFilterNewRows(unittest.TestCase):
+    def setUp(self):
+        self.dataframe = pd.DataFrame(
+            {
+                "ptt": ["1", "1", "2", "3"],
+                "datetime": pd.to_datetime(
+                    ["2020-01-01", "2020-01-03", "2020-01-01", "2020-01-01"]
+                ),
+            }
+        )
+
+    def test_base_case(self):
+        marks = {
+            "1": pd.Timestamp("2020-01-02"),
+            "2": pd.Timestamp("2020-01-01"),
+        }
+        results = filter_new_rows(self.dataframe, marks, "ptt", "datetime")
+        assert list(results.index) == [1, 3]
+
+    def test_nothing_loaded(self):
+        results = filter_new_rows(self.dataframe, {}, "ptt", "datetime")
+        assert results.shape[0] == 4
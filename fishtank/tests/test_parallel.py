@@ -0,0 +1,74 @@
+import unittest
+import unittest.mock as mock
+from datetime import datetime
+
+
+from fishtank.parallel import (
+    get_months,
+    split_months,
+    run_job,
+    run_jobs,
+    format_report,
+)
+
+
+def load_rows(rows):
+    return rows
+
+
+def fail():
+    raise ValueError("broken loader")
+
+
+class TestSplitMonths(unittest.TestCase):
+    def test_get_months(self):
+        months = get_months(datetime(2018, 1, 15), datetime(2018, 4, 15))
+        assert [month.month for month in months] == [1, 2, 3, 4]
+        assert all(month.day == 15 for month in months)
+
+    def test_even_ranges(self):
+        ranges = split_months(datetime(2018, 1, 15), datetime(2018, 12, 15), 5)
+        assert len(ranges) == 5
+        lengths = [len(get_months(start, end)) for start, end in ranges]
+        assert lengths == [3, 3, 2, 2, 2]
+        assert ranges[0][0] == datetime(2018, 1, 15)
+        assert ranges[-1][1] == datetime(2018, 12, 15)
+
+    def test_more_ranges_than_months(self):
+        ranges = split_months(datetime(2018, 1, 15), datetime(2018, 2, 15), 8)
+        assert ranges == [
+            (datetime(2018, 1, 15), datetime(2018, 1, 15)),
+            (datetime(2018, 2, 15), datetime(2018, 2, 15)),
+        ]
+
+
+class TestRunJobs(unittest.TestCase):
+    def test_run_job(self):
+        rows, seconds, totals = run_job(
+            "fishtank.tests.test_parallel:load_rows", {"rows": 3}
+        )
+        assert rows == 3
+        assert seconds >= 0
+
+    def test_pool(self):
+        jobs = [
+            ("fishtank.tests.test_parallel:load_rows", {"rows": rows})
+            for rows in [5, 7]
+        ]
+        with mock.patch("fishtank.parallel.ensure_schema"), mock.patch(
+            "fishtank.parallel.ensure_rollup_tables"
+        ):
+            results, seconds = run_jobs(jobs, max_workers=2)
+        assert [rows for _, (rows, _) in results] == [5, 7]
+        assert [job for job, _ in results] == jobs
+        report = format_report(results, seconds)
+        assert "load_rows(rows=5): 5 rows" in report
+        assert "total: 12 rows" in report
+
+    def test_failure(self):
+        jobs = [("fishtank.tests.test_parallel:fail", {})]
+        with mock.patch("fishtank.parallel.ensure_schema"), mock.patch(
+            "fishtank.parallel.ensure_rollup_tables"
+        ):
+            with self.assertRaises(ValueError):
+                run_jobs(jobs, max_workers=1)
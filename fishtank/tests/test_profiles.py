@@ -0,0 +1,110 @@
+import unittest
+import unittest.mock as mock
+import numpy as np
+import pandas as pd
+
+
+from fishtank.profiles import (
+    NO_DATE_KEY,
+    build_daily_profiles,
+    get_depth_bin_columns,
+    get_stale_ptts,
+)
+from fishtank.schema import tag_daily_profiles
+
+DAY = 86400
+
+
+def make_time_series(rows):
+    time_series = pd.DataFrame(
+        rows, columns=["ptt", "depth_m", "temperature_c", "datetime"]
+    )
+    time_series["datetime"] = pd.to_datetime(time_series["datetime"])
+    time_series["date_key"] = (
+        time_series["datetime"].dt.normalize().astype("int64") // 10**9
+    )
+    return time_series
+
+
+class TestBuildDailyProfiles(unittest.TestCase):
+    def test_base_case(self):
+        time_series = make_time_series(
+            [
+                ("1", 5.0, 10.0, "2018-01-01 00:00"),
+                ("1", 20.0, 8.0, "2018-01-01 00:10"),
+                ("1", 60.0, None, "2018-01-01 00:20"),
+                ("1", None, 6.0, "2018-01-01 00:40"),
+                ("1", 15.0, 9.0, "2018-01-02 00:00"),
+                ("2", 5.0, 12.0, "2018-01-01 00:00"),
+            ]
+        )
+        profiles = build_daily_profiles(
+            time_series, quantiles=[0.0, 0.5, 1.0], depth_bin_edges=[0, 10, 50]
+        )
+        assert profiles[["ptt", "date_key"]].values.tolist() == [
+            ["1", 1514764800],
+            ["1", 1514764800 + DAY],
+            ["2", 1514764800],
+        ]
+        assert profiles["count"].tolist() == [4, 1, 1]
+
+        first = profiles.iloc[0]
+        assert first["depth_m_q0"] == 5.0
+        assert first["depth_m_q50"] == 20.0
+        assert first["depth_m_q100"] == 60.0
+        assert np.isclose(first["temperature_c_mean"], 8.0)
+        assert first["temperature_c_min"] == 6.0
+        assert first["temperature_c_max"] == 10.0
+        # each reading lasts until the next one of the same ptt, capped
+        assert first["seconds_0_10m"] == 600
+        assert first["seconds_10_50m"] == 600
+        assert first["seconds_50m_plus"] == 1200
+
+        # the last reading of a ptt gets the interval before it
+        assert profiles.iloc[1]["seconds_10_50m"] == 3600
+        # and a lone reading gets nothing
+        assert profiles.iloc[2]["seconds_0_10m"] == 0
+
+    def test_no_values(self):
+        time_series = make_time_series([("1", None, None, "2018-01-01 00:00")])
+        profiles = build_daily_profiles(time_series)
+        assert profiles["count"].tolist() == [1]
+        assert profiles["depth_m_q50"].isna().all()
+        assert profiles["temperature_c_mean"].isna().all()
+
+    def test_matches_table(self):
+        time_series = make_time_series([("1", 5.0, 10.0, "2018-01-01 00:00")])
+        profiles = build_daily_profiles(time_series)
+        assert list(profiles.columns) == [
+            column.name for column in tag_daily_profiles.columns
+        ]
+
+    def test_depth_bin_columns(self):
+        assert get_depth_bin_columns([0, 10]) == ["seconds_0_10m", "seconds_10m_plus"]
+
+
+class TestGetStalePtts(unittest.TestCase):
+    def test_base_case(self):
+        counts = {
+            "tag_data": {
+                "1": (3 * DAY, 10),
+                "2": (2 * DAY, 5),
+                "3": (DAY, 1),
+                # new readings on the last summarised day
+                "4": (2 * DAY, 8),
+            },
+            "tag_daily_profiles": {
+                "1": (2 * DAY, 7),
+                "2": (2 * DAY, 5),
+                "4": (2 * DAY, 6),
+            },
+        }
+        with mock.patch(
+            "fishtank.profiles.read_reading_counts",
+            side_effect=lambda table, *args: counts[table],
+        ):
+            assert get_stale_ptts() == {
+                "1": 2 * DAY,
+                "3": NO_DATE_KEY,
+                "4": 2 * DAY,
+            }
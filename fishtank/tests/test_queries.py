@@ -0,0 +1,66 @@
+import unittest
+import unittest.mock as mock
+import h3
+import pandas as pd
+
+
+from fishtank.dimensions.spatial import spatial_index_to_key
+from fishtank.queries import (
+    build_region_query,
+    get_coverage_ranges,
+    query_region,
+    query_radius,
+)
+
+
+class TestGetCoverageRanges(unittest.TestCase):
+    def test_base_case(self):
+        coarse = spatial_index_to_key(h3.geo_to_h3(50, -150, 2))
+        fine = spatial_index_to_key(h3.geo_to_h3(0, 0, 4))
+        lows, highs = get_coverage_ranges({4: [fine], 2: [coarse]}, 4)
+        assert (fine, fine) in set(zip(lows, highs))
+        assert list(lows) == sorted(lows)
+
+
+class TestBuildRegionQuery(unittest.TestCase):
+    def test_base_case(self):
+        key = spatial_index_to_key(h3.geo_to_h3(0, 0, 4))
+        sql, parameters = build_region_query(
+            "sea_surface_temperature", {4: [key], 2: []}, "2018-01-01", "2018-01-31"
+        )
+        assert "f.h3_key_4 between r.low and r.high" in sql
+        assert "h3_key_2" not in sql
+        assert parameters["lows"] == parameters["highs"] == [key]
+        assert parameters["start_key"] == 1514764800
+        assert parameters["end_key"] == 1514764800 + 30 * 86400
+
+    def test_no_dates(self):
+        sql, parameters = build_region_query("tag_tracks", {4: []})
+        assert "where" not in sql
+        assert "start_key" not in parameters
+
+
+class TestQueryRegion(unittest.TestCase):
+    def setUp(self):
+        self.chunk = pd.DataFrame(
+            {
+                "latitude": [50.0, 50.5, 49.0],
+                "longitude": [-150.0, -150.5, -150.0],
+                "temperature_c": [1.0, 2.0, 3.0],
+            }
+        )
+
+    def test_clips(self):
+        with mock.patch(
+            "fishtank.queries.stream_query", return_value=[self.chunk]
+        ) as stream_query:
+            (chunk,) = query_region(
+                "sea_surface_temperature", (-151, 49.5, -149, 51), chunksize=10
+            )
+        assert chunk["temperature_c"].tolist() == [1.0, 2.0]
+        assert stream_query.call_args[0][2] == 10
+
+    def test_radius(self):
+        with mock.patch("fishtank.queries.stream_query", return_value=[self.chunk]):
+            (chunk,) = query_radius("sea_surface_temperature", -150, 50, 50)
+        assert chunk["temperature_c"].tolist() == [1.0]
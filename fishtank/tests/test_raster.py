@@ -0,0 +1,159 @@
+import os
+import tempfile
+import unittest
+from collections import defaultdict
+import h3
+import numpy as np
+
+
+from fishtank.dimensions.spatial import spatial_index_to_key
+from fishtank.raster import (
+    aggregate_block,
+    merge_aggregates,
+    get_row_blocks,
+    get_block_rows,
+    iter_grid_blocks,
+    get_checkpoint_parameters,
+    save_checkpoint,
+    aggregate_grid_to_h3,
+)
+
+try:
+    import netCDF4 as nc
+except ImportError:
+    nc = None
+
+
+def make_grid():
+    rng = np.random.default_rng(0)
+    lats = np.linspace(50, 52, 40)
+    lons = np.linspace(-150, -147, 60)
+    values = rng.normal(-1000, 100, (len(lats), len(lons)))
+    return lats, lons, values
+
+
+def grouped_by_dict(lats, lons, values, resolution):
+    totals = defaultdict(float)
+    counts = defaultdict(int)
+    for i in range(len(lats)):
+        for j in range(len(lons)):
+            key = spatial_index_to_key(h3.geo_to_h3(lats[i], lons[j], resolution))
+            totals[key] += values[i, j]
+            counts[key] += 1
+    return totals, counts
+
+
+class TestAggregateBlock(unittest.TestCase):
+    def test_matches_dict(self):
+        lats, lons, values = make_grid()
+        keys, totals, counts = aggregate_block(lats, lons, values, 4)
+        expected_totals, expected_counts = grouped_by_dict(lats, lons, values, 4)
+        assert set(keys) == set(expected_totals)
+        for key, total, count in zip(keys, totals, counts):
+            assert np.isclose(total, expected_totals[key])
+            assert count == expected_counts[key]
+
+    def test_masked(self):
+        lats, lons, values = make_grid()
+        values = np.ma.masked_array(values, mask=np.zeros(values.shape, dtype=bool))
+        values.mask[0, :] = True
+        values[1, 0] = np.nan
+        _, _, counts = aggregate_block(lats, lons, values, 4)
+        assert counts.sum() == values.size - len(lons) - 1
+
+
+class TestMergeAggregates(unittest.TestCase):
+    def test_matches_single_block(self):
+        lats, lons, values = make_grid()
+        whole = aggregate_block(lats, lons, values, 4)
+        merged = merge_aggregates(
+            [
+                aggregate_block(lats[start:stop], lons, values[start:stop], 4)
+                for start, stop in get_row_blocks(len(lats), 7)
+            ]
+        )
+        assert (whole[0] == merged[0]).all()
+        assert np.allclose(whole[1], merged[1])
+        assert (whole[2] == merged[2]).all()
+
+    def test_empty(self):
+        keys, _, _ = merge_aggregates([])
+        assert len(keys) == 0
+
+
+@unittest.skipIf(nc is None, "netCDF4 is not installed")
+class TestAggregateGridToH3(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "grid.nc")
+        lats, lons, values = make_grid()
+        with nc.Dataset(self.path, "w") as dataset:
+            dataset.createDimension("lat", len(lats))
+            dataset.createDimension("lon", len(lons))
+            dataset.createVariable("lat", "f8", ("lat",))[:] = lats
+            dataset.createVariable("lon", "f8", ("lon",))[:] = lons
+            elevation = dataset.createVariable(
+                "elevation", "f8", ("lat", "lon"), chunksizes=(4, len(lons))
+            )
+            elevation[:] = values
+        self.lats, self.lons, self.values = lats, lons, values
+        self.expected = aggregate_block(lats, lons, values, 4)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def check(self, results):
+        assert set(results.columns) == set(["h3_key_4", "elevation", "count"])
+        assert (results["h3_key_4"].values == self.expected[0]).all()
+        assert np.allclose(results["elevation"], self.expected[1] / self.expected[2])
+
+    def test_single_process(self):
+        self.check(aggregate_grid_to_h3(self.path, "elevation", 4, 9, num_processes=1))
+
+    def test_pool(self):
+        self.check(aggregate_grid_to_h3(self.path, "elevation", 4, 9, num_processes=2))
+
+    def test_block_rows(self):
+        with nc.Dataset(self.path) as dataset:
+            assert get_block_rows(dataset["elevation"], 60 * 9) == 8
+            assert get_block_rows(dataset["elevation"], 1) == 4
+            assert get_block_rows(dataset["elevation"], 10**9) == 40
+
+    def test_iter_grid_blocks(self):
+        blocks = list(iter_grid_blocks(self.path, "elevation", 16, start_row=8))
+        assert [(start, stop) for start, stop, _, _, _ in blocks] == [
+            (8, 24),
+            (24, 40),
+        ]
+        _, _, lats, lons, values = blocks[-1]
+        assert (lats == self.lats[24:]).all()
+        assert (values == self.values[24:]).all()
+
+    def resume(self, resolution):
+        checkpoint_path = os.path.join(self.directory.name, "checkpoint.npz")
+        # pretend a previous run finished the first 12 rows
+        save_checkpoint(
+            checkpoint_path,
+            12,
+            aggregate_block(self.lats[:12], self.lons, self.values[:12], resolution),
+            get_checkpoint_parameters(
+                self.path, "elevation", resolution, self.values.shape
+            ),
+        )
+        results = aggregate_grid_to_h3(
+            self.path,
+            "elevation",
+            4,
+            num_processes=1,
+            checkpoint_path=checkpoint_path,
+        )
+        # done with once the grid is aggregated
+        assert not os.path.exists(checkpoint_path)
+        return results
+
+    def test_resume(self):
+        self.check(self.resume(4))
+
+    def test_other_resolution(self):
+        with self.assertWarns(UserWarning):
+            self.check(self.resume(2))
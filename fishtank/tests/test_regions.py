@@ -0,0 +1,80 @@
+import unittest
+import numpy as np
+
+
+from fishtank.regions import (
+    get_region_tiles,
+    region_response_to_columns,
+    fetch_region,
+)
+
+REGION = (-179, 34, -120, 79)
+
+
+class StubRegion:
+    """
+    Stands in for Earth Engine's getRegion over a regular pixel grid
+    """
+
+    def __init__(self, spacing=0.5):
+        self.lons = np.arange(-179, -120, spacing) + spacing / 2
+        self.lats = np.arange(34, 79, spacing) + spacing / 2
+
+    def __call__(self, bbox):
+        min_lon, min_lat, max_lon, max_lat = bbox
+        rows = [["id", "longitude", "latitude", "time", "band"]]
+        for lon in self.lons[(self.lons >= min_lon) & (self.lons <= max_lon)]:
+            for lat in self.lats[(self.lats >= min_lat) & (self.lats <= max_lat)]:
+                value = None if lat > 78 else lat * lon
+                rows.append(["2018_01_15", lon, lat, 1516000000000, value])
+        return rows
+
+
+class TestGetRegionTiles(unittest.TestCase):
+    def test_within_region(self):
+        tiles = get_region_tiles(REGION)
+        assert len(tiles) > 1
+        for _, (min_lon, min_lat, max_lon, max_lat) in tiles:
+            assert -179 <= min_lon <= max_lon <= -120
+            assert 34 <= min_lat <= max_lat <= 79
+
+    def test_antimeridian(self):
+        tiles = get_region_tiles((-180, 50, -175, 55))
+        assert any(min_lon == -180 for _, (min_lon, _, _, _) in tiles)
+
+
+class TestRegionResponseToColumns(unittest.TestCase):
+    def test_base_case(self):
+        columns = region_response_to_columns(
+            [
+                ["id", "longitude", "latitude", "time", "band"],
+                ["a", -150.0, 50.0, 1, 2.5],
+                ["b", -151.0, 51.0, 2, None],
+            ]
+        )
+        assert columns["id"].dtype == object
+        assert columns["time"].dtype == np.int64
+        assert (columns["longitude"] == [-150.0, -151.0]).all()
+        assert columns["band"][0] == 2.5
+        assert np.isnan(columns["band"][1])
+
+    def test_empty(self):
+        columns = region_response_to_columns([["id", "latitude"]])
+        assert len(columns["latitude"]) == 0
+
+
+class TestFetchRegion(unittest.TestCase):
+    def test_every_pixel_once(self):
+        stub = StubRegion()
+        results = fetch_region(REGION, stub, max_workers=4)
+        expected = stub(REGION)
+        assert results.shape[0] == len(expected) - 1
+        assert not results.duplicated(["longitude", "latitude"]).any()
+        assert list(results.columns) == expected[0]
+
+    def test_failure(self):
+        def fetch(bbox):
+            raise RuntimeError()
+
+        with self.assertRaises(RuntimeError):
+            fetch_region((-150, 50, -149, 51), fetch, retries=0)
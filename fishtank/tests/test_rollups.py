@@ -0,0 +1,63 @@
+import unittest
+import unittest.mock as mock
+
+
+from fishtank.rollups import (
+    get_rollup_table,
+    get_rollup_columns,
+    build_rollup_statements,
+    refresh_rollups,
+)
+
+
+class TestGetRollupColumns(unittest.TestCase):
+    def test_measures(self):
+        columns = [
+            column for column, _, _ in get_rollup_columns("primary_productivity", 2)
+        ]
+        assert columns == [
+            "h3_key_2",
+            "date_key",
+            "count",
+            "log_chla_ave_sum",
+            "log_chla_ave_mean",
+            "log_chla_ave_min",
+            "log_chla_ave_max",
+        ]
+
+    def test_count_only(self):
+        columns = [column for column, _, _ in get_rollup_columns("tag_tracks", 4)]
+        assert columns == ["h3_key_4", "date_key", "count"]
+
+
+class TestBuildRollupStatements(unittest.TestCase):
+    def test_date_keys(self):
+        create, delete, insert = build_rollup_statements(
+            "sea_surface_temperature", 2, [0]
+        )
+        assert "create table if not exists sea_surface_temperature_rollup_2" in create
+        assert "primary key (h3_key_2, date_key)" in create
+        assert "where date_key = any(:date_keys)" in delete
+        assert "from sea_surface_temperature" in insert
+        assert "where date_key = any(:date_keys)" in insert
+        assert "group by h3_key_2, date_key" in insert
+
+    def test_everything(self):
+        _, delete, insert = build_rollup_statements("sea_surface_temperature", 2)
+        assert "where" not in delete
+        assert "where" not in insert
+
+
+class TestRefreshRollups(unittest.TestCase):
+    def test_every_resolution(self):
+        with mock.patch("fishtank.rollups.get_engine") as get_engine, mock.patch(
+            "fishtank.rollups.H3_RESOLUTIONS", [2, 4, 6]
+        ):
+            refresh_rollups("tag_tracks", [86400, 0, 0])
+        connection = get_engine.return_value.begin.return_value.__enter__.return_value
+        statements = [str(call[0][0]) for call in connection.execute.call_args_list]
+        for resolution in [2, 4, 6]:
+            assert any(
+                get_rollup_table("tag_tracks", resolution) in s for s in statements
+            )
+        assert connection.execute.call_args[0][1] == {"date_keys": [0, 86400]}
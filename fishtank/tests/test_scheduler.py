@@ -0,0 +1,93 @@
+import threading
+import time
+import unittest
+
+
+from fishtank.scheduler import fetch_with_retry, run_pipeline
+
+
+class FlakyFetch:
+    """
+    Stands in for Earth Engine, failing the first `failures` calls per unit
+    """
+
+    def __init__(self, failures=0, delay=0.01):
+        self.failures = failures
+        self.delay = delay
+        self.calls = {}
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, unit):
+        with self.lock:
+            self.calls[unit] = self.calls.get(unit, 0) + 1
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            attempt = self.calls[unit]
+        time.sleep(self.delay)
+        with self.lock:
+            self.running -= 1
+        if attempt <= self.failures:
+            raise RuntimeError(f"fetch {unit} failed")
+        return unit * 10
+
+
+class TestFetchWithRetry(unittest.TestCase):
+    def test_retries(self):
+        fetch = FlakyFetch(failures=2, delay=0)
+        assert fetch_with_retry(fetch, 1, retries=2, retry_delay=0) == 10
+        assert fetch.calls[1] == 3
+
+    def test_gives_up(self):
+        fetch = FlakyFetch(failures=3, delay=0)
+        with self.assertRaises(RuntimeError):
+            fetch_with_retry(fetch, 1, retries=2, retry_delay=0)
+
+
+class TestRunPipeline(unittest.TestCase):
+    def test_all_units(self):
+        fetch = FlakyFetch()
+        processed = {}
+        failures = run_pipeline(
+            range(20),
+            fetch,
+            lambda unit, fetched: processed.update({unit: fetched}),
+            max_workers=3,
+        )
+        assert failures == []
+        assert processed == {unit: unit * 10 for unit in range(20)}
+        assert 1 < fetch.max_running <= 3
+
+    def test_backpressure(self):
+        fetch = FlakyFetch(delay=0)
+        in_flight = []
+
+        def process(unit, fetched):
+            in_flight.append(max(fetch.calls) - unit)
+            time.sleep(0.01)
+
+        run_pipeline(range(20), fetch, process, max_workers=2, max_pending=1)
+        # never more than workers + pending units ahead of the one processed
+        assert max(in_flight) <= 2
+
+    def test_failures(self):
+        fetch = FlakyFetch(failures=5, delay=0)
+        processed = []
+        failures = run_pipeline(
+            range(3),
+            fetch,
+            lambda unit, fetched: processed.append(unit),
+            retries=1,
+            retry_delay=0,
+        )
+        assert processed == []
+        assert sorted(unit for unit, _ in failures) == [0, 1, 2]
+        assert all(isinstance(e, RuntimeError) for _, e in failures)
+
+    def test_process_error(self):
+        def process(unit, fetched):
+            raise ValueError()
+
+        with self.assertRaises(ValueError):
+            run_pipeline(range(10), FlakyFetch(delay=0), process)
@@ -0,0 +1,270 @@
+import unittest
+import unittest.mock as mock
+import h3
+import pandas as pd
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateTable, CreateIndex
+
+
+from fishtank.dimensions.spatial import H3_RESOLUTIONS, spatial_index_to_key
+from fishtank.schema import (
+    NESTED_KEY_COMMENT,
+    metadata,
+    dates,
+    spatial_tables,
+    tag_context,
+    tag_data,
+    get_year_partitions,
+    ensure_partitions,
+    ensure_schema,
+    migrate_nested_keys,
+    migrate_spatial_geometry,
+    migrate_unpartitioned_tables,
+)
+
+CELL = spatial_index_to_key(h3.geo_to_h3(50.0, -150.0, 4))
+PARENT = spatial_index_to_key(h3.h3_to_parent(h3.geo_to_h3(50.0, -150.0, 4), 2))
+
+
+def compile(element):
+    return str(element.compile(dialect=postgresql.dialect()))
+
+
+class TestTables(unittest.TestCase):
+    def test_dimension_primary_keys(self):
+        assert "PRIMARY KEY (date_key)" in compile(CreateTable(dates))
+        for resolution in H3_RESOLUTIONS:
+            ddl = compile(CreateTable(spatial_tables[resolution]))
+            assert f"PRIMARY KEY (h3_key_{resolution})" in ddl
+
+    def test_geometry_index(self):
+        for table in spatial_tables.values():
+            (index,) = table.indexes
+            ddl = compile(CreateIndex(index))
+            assert "USING gist (geometry)" in ddl
+
+    def test_geometry_column(self):
+        for table in spatial_tables.values():
+            assert "geometry(POLYGON,4326)" in compile(CreateTable(table))
+
+    def test_fact_indexes(self):
+        for name in ["sea_surface_temperature", "primary_productivity", "tag_tracks"]:
+            indexed = set(
+                column.name
+                for index in metadata.tables[name].indexes
+                for column in index.columns
+            )
+            assert (
+                set(["date_key"] + [f"h3_key_{r}" for r in H3_RESOLUTIONS]) <= indexed
+            )
+
+    def test_context_primary_key(self):
+        assert "PRIMARY KEY (ptt)" in compile(CreateTable(tag_context))
+
+    def test_partitioned(self):
+        assert "PARTITION BY RANGE (date_key)" in compile(CreateTable(tag_data))
+
+
+class TestGetYearPartitions(unittest.TestCase):
+    def test_base_case(self):
+        partitions = get_year_partitions("tag_data", [86400, 0, 1704067200])
+        assert partitions == [
+            ("tag_data_y1970", 0, 31536000),
+            ("tag_data_y2024", 1704067200, 1735689600),
+        ]
+
+
+class TestEnsurePartitions(unittest.TestCase):
+    def test_base_case(self):
+        engine = mock.MagicMock()
+        ensure_partitions("tag_data", [0], engine=engine)
+        connection = engine.begin.return_value.__enter__.return_value
+        assert connection.exec_driver_sql.call_args[0][0] == (
+            "create table if not exists tag_data_y1970 "
+            "partition of tag_data for values from (0) to (31536000)"
+        )
+
+
+class TestMigrateSpatialGeometry(unittest.TestCase):
+    def setUp(self):
+        self.connection = mock.MagicMock()
+        self.inspector = mock.MagicMock()
+        self.inspector.has_table.return_value = True
+
+    def migrate(self, column_type):
+        self.inspector.get_columns.return_value = [
+            {"name": "geometry", "type": column_type}
+        ]
+        with mock.patch("sqlalchemy.inspect", return_value=self.inspector):
+            migrate_spatial_geometry(self.connection)
+        return [c[0][0] for c in self.connection.exec_driver_sql.call_args_list]
+
+    def test_text(self):
+        statements = self.migrate(sa.Text())
+        assert len(statements) == 2 * len(H3_RESOLUTIONS)
+        assert "using st_setsrid(geometry::geometry, 4326)" in statements[1]
+
+    def test_already_geometry(self):
+        assert self.migrate(spatial_tables[H3_RESOLUTIONS[0]].c.geometry.type) == []
+
+
+class TestMigrateUnpartitionedTables(unittest.TestCase):
+    def migrate(self, partitioned):
+        connection = mock.MagicMock()
+        inspector = mock.MagicMock()
+        inspector.has_table.return_value = True
+        # what the old tagging loader's to_sql left behind
+        inspector.get_columns.return_value = [
+            {"name": column}
+            for column in ["ptt", "depth_m", "temperature_c", "datetime", "date_key"]
+        ]
+        connection.execute.return_value.scalar.return_value = partitioned
+        connection.execute.return_value.scalars.return_value = [0]
+        with mock.patch(
+            "sqlalchemy.inspect", return_value=inspector
+        ), mock.patch.object(tag_data, "create") as create:
+            migrate_unpartitioned_tables(connection)
+        statements = [c[0][0] for c in connection.exec_driver_sql.call_args_list]
+        return statements, create
+
+    def test_to_sql_table(self):
+        statements, create = self.migrate(False)
+        create.assert_called_once()
+        assert statements[0] == "alter table tag_data rename to tag_data_legacy"
+        assert "partition of tag_data for values from (0)" in statements[-3]
+        assert statements[-2] == (
+            "insert into tag_data (ptt, depth_m, temperature_c, datetime, date_key) "
+            "select ptt, depth_m, temperature_c, datetime, date_key "
+            "from tag_data_legacy"
+        )
+        assert statements[-1] == "drop table tag_data_legacy"
+
+    def test_already_partitioned(self):
+        statements, create = self.migrate(True)
+        create.assert_not_called()
+        assert statements == []
+
+
+class TestMigrateNestedKeys(unittest.TestCase):
+    def migrate(self, comment):
+        connection = mock.MagicMock()
+        # the parent of CELL isn't in the dimension yet
+        connection.execute.return_value.scalars.return_value.all.return_value = [PARENT]
+        inspector = mock.MagicMock()
+        inspector.get_columns.side_effect = lambda name: [
+            {"name": column.name, "comment": column.comment and comment}
+            for column in metadata.tables[name].columns
+        ]
+        with mock.patch("sqlalchemy.inspect", return_value=inspector):
+            migrate_nested_keys(connection)
+        statements = [c[0][0] for c in connection.exec_driver_sql.call_args_list]
+        executed = [
+            (c[0][0], c[0][1] if len(c[0]) > 1 else None)
+            for c in connection.execute.call_args_list
+        ]
+        return statements, executed
+
+    def test_hashed_keys(self):
+        statements, executed = self.migrate(None)
+        updated = [s.split()[1] for s in statements if s.startswith("update")]
+        assert sorted(updated) == [
+            "primary_productivity",
+            "sea_surface_temperature",
+            "tag_tracks",
+            "tag_tracks_enriched",
+        ]
+        i = statements.index(next(s for s in statements if "update tag_tracks " in s))
+        assert "set h3_key_2 = case when h3_key_4 = 0" in statements[i]
+        assert statements[i + 1] == (
+            f"comment on column tag_tracks.h3_key_2 is '{NESTED_KEY_COMMENT}'"
+        )
+        # the new parent cells are added to the dimension, once per table
+        cells = [parameters for _, parameters in executed if parameters]
+        assert [parameters["keys"] for parameters in cells] == [[PARENT]] * 4
+        assert cells[0]["boundaries"][0].startswith("POLYGON ((")
+        # only the coarse rollups of the facts are rebuilt
+        rebuilt = [str(e[0]) for e in executed if "insert into" in str(e[0])]
+        assert sum("insert into h3_resolution_2 " in s for s in rebuilt) == 4
+        rollups = [s for s in rebuilt if "_rollup_" in s]
+        assert len(rollups) == 3
+        assert all("_rollup_2" in s for s in rollups)
+
+    def test_already_nested(self):
+        assert self.migrate(NESTED_KEY_COMMENT) == ([], [])
+
+
+class TestEnsureSchema(unittest.TestCase):
+    def ensure(self, baseline, primary_keys={}):
+        """
+        Runs ensure_schema over tables that already exist, with the columns
+        in `baseline` and primary keys in `primary_keys` (or as declared),
+        returning the statements, parameters and indexes in order
+        """
+        inspector = mock.MagicMock()
+        inspector.get_columns.side_effect = lambda name: [
+            {"name": column}
+            for column in baseline.get(
+                name, [column.name for column in metadata.tables[name].columns]
+            )
+        ]
+        inspector.get_pk_constraint.side_effect = lambda name: {
+            "constrained_columns": primary_keys.get(
+                name,
+                [column.name for column in metadata.tables[name].primary_key],
+            )
+        }
+        engine = mock.MagicMock()
+        connection = engine.begin.return_value.__enter__.return_value
+        connection.dialect = postgresql.dialect()
+
+        events = []
+        connection.exec_driver_sql.side_effect = events.append
+        connection.execute.side_effect = lambda statement, parameters: events.append(
+            parameters
+        )
+        locations = pd.DataFrame({"latitude": [50.0], "longitude": [-150.0]})
+        with mock.patch("sqlalchemy.inspect", return_value=inspector), mock.patch(
+            "fishtank.schema.migrate_spatial_geometry"
+        ), mock.patch("fishtank.schema.migrate_unpartitioned_tables"), mock.patch(
+            "fishtank.schema.migrate_nested_keys"
+        ), mock.patch.object(
+            metadata, "create_all"
+        ), mock.patch(
+            "pandas.read_sql", return_value=locations
+        ), mock.patch.object(
+            sa.Index,
+            "create",
+            autospec=True,
+            side_effect=lambda index, connection, checkfirst: events.append(index.name),
+        ):
+            ensure_schema(engine)
+        return events
+
+    def test_baseline_tag_tracks(self):
+        # what the old tagging loader's to_sql left behind
+        events = self.ensure(
+            {"tag_tracks": ["ptt", "latitude", "longitude", "date_key"]}
+        )
+        added = [f"h3_key_{resolution}" for resolution in H3_RESOLUTIONS]
+        for column in added:
+            statement = f"alter table tag_tracks add column {column} BIGINT"
+            assert statement in events
+            # columns before the indexes on them
+            assert events.index(statement) < events.index(f"ix_tag_tracks_{column}")
+        (backfill,) = [event for event in events if isinstance(event, dict)]
+        assert backfill["latitudes"] == [50.0]
+        assert backfill["h3_key_4"] == [CELL]
+        assert events.index(backfill) < events.index("ix_tag_tracks_h3_key_4")
+        # nothing else was missing a column
+        assert len([e for e in events if str(e).startswith("alter table")]) == 2
+
+    def test_baseline_tag_context(self):
+        # to_sql created it without a key, so every upsert appended
+        events = self.ensure({}, {"tag_context": []})
+        deduplicate, add_key = [e for e in events if "tag_context" in str(e)]
+        assert deduplicate == (
+            "delete from tag_context a using tag_context b "
+            "where a.ptt = b.ptt and a.ctid < b.ctid"
+        )
+        assert add_key == "alter table tag_context add primary key (ptt)"
@@ -4,5 +4,28 @@ setup(
     name="fishtank",
     version="0.0.1",
     packages=find_packages(),
-    install_requires=[],
+    install_requires=[
+        "geoalchemy2==0.14.4",
+        "geopandas==0.14.3",
+        "h3==3.7.6",
+        "numpy==1.26.4",
+        "pandas==2.2.0",
+        "psycopg2-binary==2.9.9",
+        "python-dateutil==2.9.0.post0",
+        "shapely==2.0.3",
+        "SQLAlchemy==2.0.27",
+    ],
+    # what only some of the commands need, e.g. pip install fishtank[earth-engine]
+    extras_require={
+        "earth-engine": ["earthengine-api==0.1.390", "tqdm==4.66.2"],
+        "bathymetry": ["netCDF4==1.6.5"],
+        "export": ["pyarrow==15.0.2"],
+        "all": [
+            "earthengine-api==0.1.390",
+            "tqdm==4.66.2",
+            "netCDF4==1.6.5",
+            "pyarrow==15.0.2",
+        ],
+    },
+    entry_points={"console_scripts": ["fishtank=fishtank.cli:main"]},
 )